@@ -1,17 +1,86 @@
-from flask import Flask, request, jsonify
+import base64
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from src.account import AccountRegistry
 from src.account import Account
+from src.account import CompanyAccount
 from src.account import MongoAccountsRepository
+from src.account import VERSION_EPOCH
+from src.cache import LRUCache
+from src.columnar import MappedAccountRegistry, export_registry
+from src.jobs import JobQueue
+from src.idempotency import BUSY, MAX_KEY_LENGTH, MISMATCH, REPLAY, FileBackend, IdempotencyStore
+from src.logs import configure_logging, sample_request
+from src.onboarding import CREATED, EXISTS, INVALID_NIP, NOT_REGISTERED, UNAVAILABLE, onboard_companies
+from src.persistence import PersistenceEngine
+from src.serializer import Serializer
 
 #feature 15
 app = Flask(__name__)
-registry = AccountRegistry()
+serializer = Serializer()     # orjson when installed, see src/serializer.py
+
+class SerializerJSONProvider(DefaultJSONProvider):     # jsonify() through the same serializer
+    def dumps(self, obj, **kwargs):
+        return serializer.dumps(obj).decode()
+
+app.json = SerializerJSONProvider(app)
+response_cache = LRUCache(int(os.getenv("BANK_APP_RESPONSE_CACHE_BYTES", str(64 << 20))))    # encoded listings
+DEBUG = os.getenv("BANK_APP_DEBUG", "0") == "1"    # debug mode and full request logging; off unless asked for
+MAX_PAGE_SIZE = 1000
+BATCH_ACK = 100     # batch transfer results sent together, after one WAL flush
+REGISTRY_IMAGE = os.getenv("BANK_APP_REGISTRY_IMAGE")     # columnar snapshot, mmapped at startup
+if REGISTRY_IMAGE and os.path.exists(REGISTRY_IMAGE):
+    registry = MappedAccountRegistry(REGISTRY_IMAGE)
+else:
+    registry = AccountRegistry()
 mongoRepo = MongoAccountsRepository()
+registry.transaction_log = mongoRepo     # accounts recovered from an image or the WAL may have come from a load
+IDEMPOTENCY_FILE = os.getenv("BANK_APP_IDEMPOTENCY_FILE")     # keeps Idempotency-Key responses across restarts
+if IDEMPOTENCY_FILE is None and os.getenv("BANK_APP_DATA_DIR"):
+    IDEMPOTENCY_FILE = os.path.join(os.environ["BANK_APP_DATA_DIR"], "idempotency.log")
+persistence = None
+if os.getenv("BANK_APP_DATA_DIR"):     # local WAL + snapshots, recovered on startup
+    persistence = PersistenceEngine(
+        os.environ["BANK_APP_DATA_DIR"],
+        sync_interval=float(os.getenv("BANK_APP_WAL_SYNC_INTERVAL", "0.01")),
+    ).open(registry)
+jobs = JobQueue()
+JOB_PAUSE = float(os.getenv("BANK_APP_JOB_PAUSE", "0.005"))    # seconds between the batches of a save or load, for live traffic
+idempotency = IdempotencyStore(backend=FileBackend(IDEMPOTENCY_FILE) if IDEMPOTENCY_FILE else None)
+
+log = logging.getLogger("bank.api")
+configure_logging("DEBUG" if DEBUG else None, 1 if DEBUG else None)    # debug: every request, with traces
+
+@app.before_request
+def start_request():
+    g.log_sampled = sample_request()
+    g.started = time.perf_counter()
+
+@app.after_request
+def log_request(response):      # one structured access record per sampled request
+    if g.get("log_sampled") and log.isEnabledFor(logging.INFO):
+        elapsed = (time.perf_counter() - g.started) * 1000
+        log.info("%s %s %s", request.method, request.path, response.status_code, extra={
+            "method": request.method, "path": request.path, "status": response.status_code, "ms": round(elapsed, 2),
+        })
+    return response
+
+@app.after_request
+def wait_for_wal(response):     # a change is answered once the WAL flush covering it is done
+    if persistence is not None and request.method not in ("GET", "HEAD", "OPTIONS"):
+        persistence.wait()
+    return response
 
 @app.route("/api/accounts", methods=['POST'])
 def create_account():
     data = request.get_json()
-    print(f"Create account request: {data}")
+    log.debug("Create account request: %s", data)
     account = Account(data["first_name"], data["last_name"], data["pesel"])
     created = registry.add_account(account)
     if not created:
@@ -20,37 +89,144 @@ def create_account():
 
 @app.route("/api/accounts", methods=['GET'])
 def get_all_accounts():
-    print("Get all accounts request received")
-    accounts = registry.all_accounts()
-    accounts_data = [{"first_name": acc.first_name, "last_name": acc.last_name, "pesel": acc.pesel, "balance": acc.balance} for acc in accounts]
-    return jsonify(accounts_data), 200
+    log.debug("Get all accounts request received")
+    args = request.args
+    ndjson = args.get("format") == "ndjson" or request.accept_mimetypes.best == "application/x-ndjson"
+    try:
+        if ndjson:
+            accounts, _, _ = _listed_accounts(args, streamed=True)
+            return Response(stream_with_context(serializer.ndjson(accounts)), mimetype="application/x-ndjson")
+        # any listing depends on the registry alone, so the registry version validates all of them
+        return _conditional(registry.version, lambda: _listing_body(args), request.full_path)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+def _listed_accounts(args, streamed=False):     # (accounts, paged, limit); ValueError on bad arguments
+    paged = "limit" in args or "cursor" in args
+    limit = _page_limit(args) if paged else None
+    after = _decode_cursor(args.get("cursor"))
+    accounts = _filtered_accounts(args)
+    if accounts is None:
+        accounts = _account_stream(after, limit) if paged or streamed else registry.accounts   # a snapshot: adds may run meanwhile
+    elif paged:
+        accounts = _after_cursor(accounts, after, limit)
+    return accounts, paged, limit
+
+def _listing_body(args):
+    accounts, paged, limit = _listed_accounts(args)
+    if not paged:
+        return serializer.accounts(accounts)
+    accounts = list(accounts)
+    next_cursor = _encode_cursor(registry.key(accounts[-1])) if len(accounts) == limit else None
+    return b'{"accounts":' + serializer.accounts(accounts) + b',"next_cursor":' + serializer.dumps(next_cursor) + b"}"
+
+def _conditional(version, build, key=None):
+    # 304 when If-None-Match already holds this version, else 200 with build()'s body, kept in
+    # response_cache under (key, version) when a key is given. The version is read before the
+    # body is built, so a change in between only makes the client's next poll a 200.
+    etag = f"{VERSION_EPOCH}-{version}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        body = response_cache.get((key, version)) if key is not None else None
+        if body is None:
+            body = build()
+            if key is not None:
+                response_cache.put((key, version), body)
+        response = _json_response(body)
+    response.set_etag(etag)
+    return response
+
+def _json_response(body, status=200):     # already encoded JSON
+    return Response(body, status, mimetype="application/json")
+
+def _page_limit(args):
+    if "limit" not in args:
+        return MAX_PAGE_SIZE
+    limit = args.get("limit", type=int)
+    if limit is None or not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError("Invalid limit")
+    return limit
+
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def _decode_cursor(cursor):
+    if cursor is None:
+        return None
+    try:
+        return base64.b64decode(cursor.encode(), altchars=b"-_", validate=True).decode()
+    except ValueError:
+        raise ValueError("Invalid cursor") from None
+
+def _account_stream(after, limit):
+    # walks the registry in PESEL order one page at a time, so concurrent adds and deletes are safe
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = MAX_PAGE_SIZE if remaining is None else min(remaining, MAX_PAGE_SIZE)
+        page = registry.page(after, size)
+        yield from page
+        if len(page) < size:
+            return
+        after = registry.key(page[-1])
+        if remaining is not None:
+            remaining -= size
+
+def _after_cursor(accounts, after, limit):
+    accounts = sorted(accounts, key=registry.key)
+    if after is not None:
+        accounts = [acc for acc in accounts if registry.key(acc) > after]
+    return accounts[:limit]
+
+def _filtered_accounts(args):
+    nip = args.get("nip")
+    last_name = args.get("last_name")
+    min_balance = args.get("min_balance", type=float, default=None)
+    max_balance = args.get("max_balance", type=float, default=None)
+    if ("min_balance" in args and min_balance is None) or ("max_balance" in args and max_balance is None):
+        raise ValueError("Invalid balance filter")
+
+    if nip is not None:
+        company = registry.find_by_nip(nip)
+        accounts = [company] if company is not None else []
+    elif last_name is not None:
+        accounts = registry.find_by_last_name(last_name)
+    elif min_balance is not None or max_balance is not None:
+        return registry.find_by_balance_range(
+            min_balance if min_balance is not None else -math.inf,
+            max_balance if max_balance is not None else math.inf,
+        )
+    else:
+        return None
+
+    if last_name is not None:
+        accounts = [acc for acc in accounts if getattr(acc, "last_name", None) == last_name]
+    if min_balance is not None:
+        accounts = [acc for acc in accounts if acc.balance >= min_balance]
+    if max_balance is not None:
+        accounts = [acc for acc in accounts if acc.balance <= max_balance]
+    return accounts
 
 @app.route("/api/accounts/count", methods=['GET'])
 def get_account_count():
-    print("Get account count request received")
-    count = registry.account_count()
-    return jsonify({"count": count}), 200
+    log.debug("Get account count request received")
+    return _conditional(registry.version, lambda: serializer.dumps({"count": registry.account_count()}))
 
 @app.route("/api/accounts/<pesel>", methods=['GET'])
 def get_account_by_pesel(pesel):
-    print(f"Find account with pesel: {pesel}")
+    log.debug("Find account with pesel: %s", pesel)
     account_p = registry.find_by_pesel(pesel)
 
     if account_p is None:
         return jsonify({"error": "No account with this pesel found"}), 404
 
-    account_data = {
-        "first_name": account_p.first_name,
-        "last_name":account_p.last_name,
-        "pesel":account_p.pesel,
-        "balance":account_p.balance
-    }
-    return jsonify(account_data), 200
+    # the encoded body is cached on the account itself, per version (see Serializer.account)
+    return _conditional(account_p.version, lambda: serializer.account(account_p))
 
 
 @app.route("/api/accounts/<pesel>", methods=['PATCH'])
 def update_account(pesel):
-    print(f"received request to update account with pesel {pesel}")
+    log.debug("received request to update account with pesel %s", pesel)
 
     account_p = registry.find_by_pesel(pesel)
 
@@ -60,6 +236,9 @@ def update_account(pesel):
     first_name = request.json.get("first_name")
     last_name = request.json.get("last_name")
 
+    if isinstance(account_p, CompanyAccount) and (first_name is not None or last_name is not None):
+        return jsonify({"error": "Company accounts have no first or last name"}), 400
+
     if first_name is not None:
         account_p.first_name = first_name
 
@@ -71,56 +250,228 @@ def update_account(pesel):
 
 @app.route("/api/accounts/<pesel>", methods=['DELETE'])
 def delete_account(pesel):
-    print(f"received request to delete account with pesel {pesel}")
-
-    account_p = registry.find_by_pesel(pesel)
+    log.debug("received request to delete account with pesel %s", pesel)
 
-    if account_p is None:
+    if not registry.delete_account(pesel):
         return jsonify({"error": "No account with this pesel found"}), 404
 
-    registry.accounts.remove(account_p)
-
     return jsonify({"message": "Account deleted"}), 200
 
 @app.route("/api/accounts/<pesel>/transfer", methods=['POST'])
 def transfer(pesel):    #feature 17
+    data = request.get_json()
+    key = request.headers.get("Idempotency-Key")
+    if key is None:
+        body, status = _transfer(pesel, data)
+        return jsonify(body), status
+    body, status, replayed = _idempotent_transfer(key, pesel, data)
+    response = jsonify(body)
+    response.status_code = status
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+def _idempotent_transfer(key, pesel, data):    # (body, status, replayed); a retried key gets the first response
+    if not 0 < len(key) <= MAX_KEY_LENGTH:
+        return {"error": "Invalid Idempotency-Key"}, 400, False
+    state, stored = idempotency.begin(key, json.dumps([pesel, data], sort_keys=True))
+    if state == REPLAY:
+        return stored[0], stored[1], True
+    if state == BUSY:
+        return {"error": "A request with this Idempotency-Key is in progress"}, 409, False
+    if state == MISMATCH:
+        return {"error": "Idempotency-Key was used with a different request"}, 422, False
+    try:
+        body, status = _transfer(pesel, data)
+    except Exception:
+        idempotency.abandon(key)
+        raise
+    idempotency.finish(key, (body, status))
+    return body, status, False
+
+def _transfer(pesel, data):
     account_p = registry.find_by_pesel(pesel)
     if account_p is None:
-        return jsonify({"error": "No account with this pesel found"}), 404
+        return {"error": "No account with this pesel found"}, 404
 
-    data = request.get_json()
     amount = data.get("amount")
     transfer_type = data.get("type")
 
     if transfer_type not in ["incoming", "outgoing", "express"]:
-        return jsonify({"error": "Unknown transfer type"}), 400
-
-    if transfer_type == "incoming":
-        account_p.balance += amount
-        return jsonify({"message": "Incoming transfer received"}), 200
-
-    if transfer_type == "outgoing":
-        if account_p.balance < amount:
-            return jsonify({"error": "Not enough funds"}), 422
-
-        account_p.balance -= amount
-        return jsonify({"message": "Outgoing transfer received"}), 200
-
-    if transfer_type == "express":
-        account_p.balance += amount
-        return jsonify({"message": "Express transfer received"}), 200
+        return {"error": "Unknown transfer type"}, 400
+
+    if not _valid_amount(amount):
+        return {"error": "Invalid amount"}, 400
+
+    with registry.lock_for(pesel):
+        if transfer_type == "incoming":
+            account_p.balance += amount
+            account_p._record(amount, "incoming")
+            return {"message": "Incoming transfer received"}, 200
+
+        if transfer_type == "outgoing":
+            if account_p.balance < amount:
+                return {"error": "Not enough funds"}, 422
+
+            account_p.balance -= amount
+            account_p._record(-amount, "outgoing")
+            return {"message": "Outgoing transfer received"}, 200
+
+        if transfer_type == "express":
+            account_p.balance += amount     # a credit here, unlike Account.expressTransferOut, hence its own type
+            account_p._record(amount, "express_in")
+            return {"message": "Express transfer received"}, 200
+
+def _valid_amount(amount):    # a finite number; the JSON parser accepts NaN and Infinity, which break the balance index
+    return isinstance(amount, (int, float)) and not isinstance(amount, bool) and math.isfinite(amount)
+
+@app.route("/api/transfers/batch", methods=['POST'])
+def batch_transfer():
+    if request.mimetype == "application/x-ndjson":
+        items = (line for line in request.stream if line.strip())
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return jsonify({"error": "Expected a list of transfers"}), 400
+
+    def results():
+        lines = []
+        for item in items:
+            if isinstance(item, bytes):
+                try:
+                    item = json.loads(item)
+                except ValueError:
+                    item = None
+            try:
+                body, status = _batch_item(item)
+            except Exception:   # the 200 is already sent: report the item and go on with the rest
+                log.exception("Batch transfer item failed")
+                body, status = {"error": "Transfer failed"}, 500
+            lines.append(json.dumps({"status": status, **body}) + "\n")
+            if len(lines) == BATCH_ACK:
+                yield _acknowledged(lines)
+                lines = []
+        if lines:
+            yield _acknowledged(lines)
+
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
+
+def _acknowledged(lines):     # the result lines, once the WAL holds their transfers; one flush covers the lot
+    if persistence is not None:
+        persistence.wait()
+    return "".join(lines)
+
+def _batch_item(item):
+    if not isinstance(item, dict) or not isinstance(item.get("pesel"), str):
+        return {"error": "Invalid transfer"}, 400
+    if "idempotency_key" in item:     # per-item key, so a retried batch skips what already ran
+        body, status, _ = _idempotent_transfer(str(item["idempotency_key"]), item["pesel"], item)
+        return body, status
+    return _transfer(item["pesel"], item)
+
+ONBOARDING_RESPONSES = {
+    CREATED: ({"message": "Company account created"}, 201),
+    EXISTS: ({"error": "Account with this NIP already created"}, 409),
+    INVALID_NIP: ({"error": "Invalid NIP"}, 400),
+    NOT_REGISTERED: ({"error": "Company not registered"}, 400),
+    UNAVAILABLE: ({"error": "NIP registry unavailable"}, 503),
+}
+
+@app.route("/api/companies/batch", methods=['POST'])
+def batch_onboard_companies():
+    # every NIP is verified before any account is created, so the answer comes in one piece
+    if request.mimetype == "application/x-ndjson":
+        items = []
+        for line in request.stream:
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append(None)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return jsonify({"error": "Expected a list of companies"}), 400
+
+    valid, companies = _companies(items)
+    return Response(_onboarding_lines(valid, onboard_companies(registry, companies)), mimetype="application/x-ndjson")
+
+def _companies(items):      # (whether each item is a company, (company_name, nip) of those that are)
+    valid = [isinstance(item, dict) and isinstance(item.get("company_name"), str) for item in items]
+    return valid, [(item["company_name"], item.get("nip")) for item, ok in zip(items, valid) if ok]
+
+def _onboarding_lines(valid, results):     # one NDJSON line per item, the invalid ones included
+    results = iter(results)
+    lines = []
+    for ok in valid:
+        body, status = ONBOARDING_RESPONSES[next(results)] if ok else ({"error": "Invalid company"}, 400)
+        lines.append(json.dumps({"status": status, **body}) + "\n")
+    return "".join(lines)
+
+@app.route("/api/accounts/<pesel>/statement", methods=['GET'])
+def get_statement(pesel):
+    # streamed history statement, ?format=text|csv; from/to (ISO dates or datetimes, UTC) window it
+    # over the transaction log in the database and the transfers not saved there yet
+    account_p = registry.find_by_pesel(pesel)
+    if account_p is None:
+        return jsonify({"error": "No account with this pesel found"}), 404
+    kind = request.args.get("format", "text")
+    if kind not in ("text", "csv"):
+        return jsonify({"error": "format must be text or csv"}), 400
+    try:
+        start, end = (_parse_time(request.args.get(name)) for name in ("from", "to"))
+    except ValueError:
+        return jsonify({"error": "from and to must be ISO dates"}), 400
+    statement = account_p.statement(start, end)
+    if kind == "csv":
+        headers = {"Content-Disposition": f'attachment; filename="statement-{pesel}.csv"'}
+        return Response(stream_with_context(statement.csv_chunks()), mimetype="text/csv", headers=headers)
+    return Response(stream_with_context(statement.text_chunks()), mimetype="text/plain")
+
+def _parse_time(value):     # naive values are UTC, like the timestamps in the log
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+# save and load run as background jobs, one at a time; the request only queues them and
+# GET /api/jobs/<id> follows their progress
 
 @app.route("/api/accounts/save", methods=['POST'])
 def save_accounts_to_database():
-    count = mongoRepo.save_all(registry)
-    return jsonify({"message": "Accounts Saved to database"}), 200
+    job = jobs.submit("save", lambda job: {"saved": mongoRepo.save_all(registry, job.progress, JOB_PAUSE)})
+    return _job_accepted(job, "Saving accounts to database")
 
 @app.route("/api/accounts/load", methods=['POST'])
 def load_accounts_from_database():
-    count = mongoRepo.load_all(registry)
-    return jsonify({"message": "Accounts loaded fromm database"}), 200
+    job = jobs.submit("load", lambda job: {"loaded": mongoRepo.load_all(registry, job.progress, JOB_PAUSE)})
+    return _job_accepted(job, "Loading accounts from database")
+
+def _job_accepted(job, message):
+    response = jsonify({"message": message, "job": job.to_dict()})
+    response.status_code = 202
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return response
+
+@app.route("/api/jobs", methods=['GET'])
+def get_jobs():
+    return jsonify({"jobs": [job.to_dict() for job in jobs.jobs()]}), 200
+
+@app.route("/api/jobs/<job_id>", methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "No job with this id found"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route("/api/accounts/image", methods=['POST'])
+def export_registry_image():
+    if not REGISTRY_IMAGE:
+        return jsonify({"error": "BANK_APP_REGISTRY_IMAGE is not set"}), 400
+    count = export_registry(registry, REGISTRY_IMAGE)
+    return jsonify({"message": "Registry image written", "count": count}), 200
 
 
 if __name__ == '__main__':
-    print("Starting Flask server...")
-    app.run(debug=True, port=5000, host='127.0.0.1')
\ No newline at end of file
+    print("Starting Flask development server...")
+    app.run(debug=DEBUG, port=5000, host='127.0.0.1')
\ No newline at end of file
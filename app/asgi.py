@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+from app.api import JOB_PAUSE, _companies, _onboarding_lines, app as flask_app, jobs, persistence, registry, serializer
+from app.wsgi import HOST, PORT, THREADS
+from src.account import AsyncMongoAccountsRepository
+from src.logs import sample_request
+from src.nip_verifier import AsyncNipVerifier
+from src.onboarding import onboard_companies_async
+
+# asyncio entry point: python -m app.asgi (uvicorn, one process, one event loop)
+# The work that waits on other services - Mongo save/load jobs and the MF lookups of company
+# onboarding - runs in coroutines here, so a slow database or registry ties up no thread and
+# one process holds thousands of open clients. Every other route is app.api's Flask view, run in a
+# pool of BANK_APP_THREADS threads: they only touch the in-memory registry and answer at once.
+# Both share app.api's registry, so the responses are the same whichever server is used.
+BACKLOG = int(os.getenv("BANK_APP_BACKLOG", "4096"))
+CONNECTION_LIMIT = int(os.getenv("BANK_APP_CONNECTION_LIMIT", "10000"))
+
+mongo_repo = AsyncMongoAccountsRepository()
+nip_verifier = AsyncNipVerifier()
+log = logging.getLogger("bank.api")
+
+
+def _json(body, status=200, headers=None):     # the bytes jsonify would send
+    return Response(serializer.dumps(body) + b"\n", status, headers, media_type="application/json")
+
+
+def _job_accepted(job, message):
+    return _json({"message": message, "job": job.to_dict()}, 202, {"Location": f"/api/jobs/{job.id}"})
+
+
+def logged(view):     # the access record app.api writes for its Flask views
+    async def handle(request):
+        sampled = sample_request()
+        started = time.perf_counter()
+        response = await view(request)
+        if sampled and log.isEnabledFor(logging.INFO):
+            elapsed = (time.perf_counter() - started) * 1000
+            log.info("%s %s %s", request.method, request.url.path, response.status_code, extra={
+                "method": request.method, "path": request.url.path, "status": response.status_code, "ms": round(elapsed, 2),
+            })
+        return response
+    return handle
+
+
+async def save(job):
+    return {"saved": await mongo_repo.save_all(registry, job.progress, JOB_PAUSE)}
+
+
+async def load(job):
+    return {"loaded": await mongo_repo.load_all(registry, job.progress, JOB_PAUSE)}
+
+
+@logged
+async def save_accounts_to_database(request):   # the same jobs as app.api's, run as tasks of this loop
+    return _job_accepted(jobs.submit_async("save", save), "Saving accounts to database")
+
+
+@logged
+async def load_accounts_from_database(request):
+    return _job_accepted(jobs.submit_async("load", load), "Loading accounts from database")
+
+
+@logged
+async def batch_onboard_companies(request):
+    body = await request.body()
+    mimetype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if mimetype == "application/x-ndjson":
+        items = []
+        for line in body.splitlines():
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append(None)
+    else:
+        try:
+            items = json.loads(body) if mimetype == "application/json" or mimetype.endswith("+json") else None
+        except ValueError:
+            items = None
+        if not isinstance(items, list):
+            return _json({"error": "Expected a list of companies"}, 400)
+
+    valid, companies = _companies(items)
+    results = await onboard_companies_async(registry, companies, nip_verifier)
+    if persistence is not None:     # answered once the WAL holds the new accounts, like app.api's views
+        await asyncio.to_thread(persistence.wait)
+    return Response(_onboarding_lines(valid, results), media_type="application/x-ndjson")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await nip_verifier.aclose()
+    await mongo_repo.close()
+
+
+application = Starlette(routes=[
+    Route("/api/accounts/save", save_accounts_to_database, methods=["POST"]),
+    Route("/api/accounts/load", load_accounts_from_database, methods=["POST"]),
+    Route("/api/companies/batch", batch_onboard_companies, methods=["POST"]),
+    Mount("/", WSGIMiddleware(flask_app, workers=THREADS)),
+], lifespan=lifespan)
+
+
+def main():
+    log.info("Serving on http://%s:%s (asyncio, %d threads for Flask views)", HOST, PORT, THREADS)
+    uvicorn.run(application, host=HOST, port=PORT, backlog=BACKLOG, limit_concurrency=CONNECTION_LIMIT,
+                access_log=False, log_level="warning")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import logging
+import os
+
+from waitress.channel import HTTPChannel
+from waitress.server import create_server
+from waitress.task import WSGITask
+
+from app.api import app
+
+# Production entry point: python -m app.wsgi
+# The registry, its WAL and the mail/NIP pools live in this process's memory, so the app is
+# served by ONE process with a pool of worker threads (the registry is thread-safe). Several
+# processes would each get their own registry and fight over BANK_APP_DATA_DIR. Any other WSGI
+# server must be run the same way, e.g. gunicorn --workers 1 --threads 8 app.wsgi:application.
+application = app
+
+HOST = os.getenv("BANK_APP_HOST", "127.0.0.1")
+PORT = int(os.getenv("BANK_APP_PORT", "5000"))
+THREADS = int(os.getenv("BANK_APP_THREADS", "8"))
+CONNECTION_LIMIT = int(os.getenv("BANK_APP_CONNECTION_LIMIT", "1000"))
+
+
+class KeepAliveTask(WSGITask):
+    # waitress closes the connection after every response without a Content-Length, 304s
+    # included, though they never have a body; polling clients keep theirs open instead
+    def set_close_on_finish(self):
+        connection = self.request.headers.get("CONNECTION", "").lower()
+        if self.has_body or self.wrote_header or self.version != "1.1" or connection == "close":
+            super().set_close_on_finish()
+
+
+class KeepAliveChannel(HTTPChannel):
+    task_class = KeepAliveTask
+
+
+def main():
+    server = create_server(app, host=HOST, port=PORT, threads=THREADS, connection_limit=CONNECTION_LIMIT, ident="bank-app")
+    server.channel_class = KeepAliveChannel
+    logging.getLogger("bank.wsgi").info("Serving on http://%s:%s with %d worker threads", HOST, PORT, THREADS)
+    server.run()
+
+
+if __name__ == '__main__':
+    main()
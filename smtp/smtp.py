@@ -1,6 +1,92 @@
+import base64
+import mimetypes
+import os
+import smtplib
+import uuid
+from email.header import Header
+from email.mime.text import MIMEText
+
+ATTACHMENT_CHUNK = 57 * 1024    # a whole number of 57-byte groups, so every base64 line is full
+
+
 class SMTPClient:   #pragma: no cover   #feature 19
     def send(self, subject, text, email_address) -> bool:
         # tutaj byłby kod odpowiedzialny za wysłanie maila
         # return True jezeli wyslanie sie powiodło
         # return False jezeli wyslanie sie nie powiodło
-        return False
\ No newline at end of file
+        return False
+
+
+class SMTPConnection:   # delivers over one SMTP connection, opened on first send and kept for the next ones
+    def __init__(self, host=None, port=None, sender=None, timeout=10):
+        self.host = host or os.getenv("BANK_APP_SMTP_HOST", "localhost")
+        self.port = int(port or os.getenv("BANK_APP_SMTP_PORT", "25"))
+        self.sender = sender or os.getenv("BANK_APP_SMTP_SENDER", "bank@localhost")
+        self.timeout = timeout
+        self._smtp = None
+
+    def send(self, subject, text, email_address, attachments=()) -> bool:
+        # compat32 MIMEText builds ~7x faster than EmailMessage; plain 7bit body unless it needs utf-8
+        message = MIMEText(text, "plain", "us-ascii" if text.isascii() else "utf-8")
+        if not attachments:
+            message["Subject"] = subject
+            message["From"] = self.sender
+            message["To"] = email_address
+        for _ in range(2):      # a kept connection may have been dropped by the server, reconnect once
+            try:
+                if self._smtp is None:
+                    self._smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+                if attachments:
+                    self._send_multipart(subject, message, email_address, attachments)
+                else:
+                    self._smtp.sendmail(self.sender, [email_address], message.as_bytes())
+                return True
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+            except (smtplib.SMTPException, OSError):
+                self.close()
+                return False
+        return False
+
+    def _send_multipart(self, subject, body, email_address, attachments):
+        # multipart/mixed written straight to the socket: each attachment is opened with its
+        # opener and base64-encoded ATTACHMENT_CHUNK bytes at a time, never held whole
+        smtp = self._smtp
+        smtp.ehlo_or_helo_if_needed()
+        code, reply = smtp.mail(self.sender)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, reply, self.sender)
+        code, reply = smtp.rcpt(email_address)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({email_address: (code, reply)})
+        code, reply = smtp.docmd("data")
+        if code != 354:
+            raise smtplib.SMTPDataError(code, reply)
+        boundary = uuid.uuid4().hex
+        subject = subject if subject.isascii() else Header(subject, "utf-8").encode()
+        smtp.send((
+            f"Subject: {subject}\r\nFrom: {self.sender}\r\nTo: {email_address}\r\nMIME-Version: 1.0\r\n"
+            f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n--{boundary}\r\n'
+        ).encode())
+        smtp.send(smtplib.quotedata(body.as_string()).encode())
+        for filename, opener in attachments:
+            kind = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            smtp.send((
+                f"\r\n--{boundary}\r\nContent-Type: {kind}\r\nContent-Transfer-Encoding: base64\r\n"
+                f'Content-Disposition: attachment; filename="{filename}"\r\n\r\n'
+            ).encode())
+            with opener() as file:
+                while chunk := file.read(ATTACHMENT_CHUNK):
+                    smtp.send(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+        smtp.send(f"\r\n--{boundary}--\r\n.\r\n".encode())
+        code, reply = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, reply)
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
@@ -1,11 +1,79 @@
+import asyncio
 import os
-import requests
-from datetime import date
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager, nullcontext
+from heapq import merge
+from itertools import count, islice, takewhile
+from datetime import date, datetime, timezone
 from smtp.smtp import SMTPClient
-from pymongo import MongoClient
+from src.mailer import MailQueue
+from src.nip_verifier import NipVerifier
+from src.statements import Statement, history_entries, transfer_type
+from pymongo import ASCENDING, AsyncMongoClient, DeleteMany, DeleteOne, MongoClient, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+_versions = count(1)    # every change to an account or a registry takes the next number; next() is atomic
+VERSION_EPOCH = os.urandom(4).hex()     # tells this process's versions from those before a restart
+
+class History(array):     # transfer history as packed doubles instead of a list of boxed floats
+    __slots__ = ("positive_run", "offset")   # feature 12 state, kept up to date on append
+
+    WINDOW = 5
+
+    def __new__(cls, values=(), offset=0):
+        history = super().__new__(cls, "d", values)
+        history.offset = offset     # sequence number of the first entry held in memory
+        history._recount()
+        return history
+
+    def _recount(self):
+        run = 0
+        for value in reversed(self[-self.WINDOW:]):
+            if value <= 0:
+                break
+            run += 1
+        self.positive_run = run         # trailing positive transfers, counted up to WINDOW
+
+    @property
+    def window_sum(self):   # sum of the last WINDOW entries, summed afresh: a running total drifts with rounding
+        return math.fsum(self[-self.WINDOW:])
+
+    def append(self, value):
+        super().append(value)
+        self.positive_run = min(self.positive_run + 1, self.WINDOW) if value > 0 else 0
+
+    def extend(self, values):
+        super().extend(values)
+        self._recount()
+
+    def __eq__(self, other):
+        if isinstance(other, list):
+            return self.tolist() == other
+        return super().__eq__(other)
+
+    def __ne__(self, other):     # array's own __ne__ would ignore the list case above
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.tolist())
+
 
 class Account:
+    __slots__ = ("_first_name", "_last_name", "_balance", "pesel", "promoCode", "_history", "_registry", "_json", "_version")
+
+    EXPRESS_FEE = 1     #feature 8
+
     def __init__(self, first_name, last_name, pesel, promoCode = None):
+        self._registry = None   # registry indexing this account, set by AccountRegistry
+        self._json = None       # (version, encoded JSON) of the account, see src/serializer.py
+        self._version = next(_versions)     # renewed by every change, for ETags and the JSON cache
         self.first_name = first_name    #feature 1
         self.last_name = last_name      #feature 1
         self.balance = 0.0              #feature 1
@@ -14,6 +82,71 @@ class Account:
         self.canUsePromo(self.pesel, promoCode)
         self.history = []       #feature 11
 
+    @classmethod
+    def restore(cls, first_name, last_name, pesel, balance, history, history_offset=0):    # rebuilds stored data, skips validation and promo
+        account = cls.__new__(cls)
+        account._registry = None
+        account._json = None
+        account._version = next(_versions)
+        account._first_name = first_name
+        account._last_name = last_name
+        account.pesel = pesel
+        account.promoCode = None
+        account._balance = balance
+        account._history = History(history, history_offset)
+        return account
+
+    @property
+    def balance(self):
+        return self._balance
+
+    @balance.setter
+    def balance(self, value):
+        registry = self._registry
+        if registry is None:
+            self._balance = value
+            self._version = next(_versions)
+        else:
+            registry._set_balance(self, value)
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def history(self):
+        return self._history
+
+    @history.setter
+    def history(self, values):
+        self._history = values if isinstance(values, History) else History(values)
+        self._version = next(_versions)
+        if self._registry is not None:
+            self._registry._history_replaced(self)
+
+    @property
+    def first_name(self):
+        return self._first_name
+
+    @first_name.setter
+    def first_name(self, value):
+        self._first_name = value
+        self._version = next(_versions)
+        if self._registry is not None:
+            self._registry._names_changed(self)
+
+    @property
+    def last_name(self):
+        return self._last_name
+
+    @last_name.setter
+    def last_name(self, value):
+        registry = self._registry
+        if registry is None:
+            self._last_name = value
+            self._version = next(_versions)
+        else:
+            registry._set_last_name(self, value)
 
     def checkPesel(self,pesel):     #feature 3
         if pesel is not None and (len(pesel) == 11) :
@@ -35,60 +168,117 @@ class Account:
             elif year >= 60 :
                     self.usePromo(promo)
 
+    def _locked(self):  # the stripe of this account around a read-modify-write, see AccountRegistry.lock_for
+        registry = self._registry
+        return nullcontext() if registry is None else registry.lock_for(registry.key(self))
+
     def transferOut(self,amount):       #feature 6
-        if 0 < amount <= self.balance:
-            self.balance -= amount
-            self.history.append(-amount)    #feature 11
+        with self._locked():
+            if 0 < amount <= self.balance:
+                self.balance -= amount
+                self._record(-amount, "outgoing")    #feature 11
 
     def transferIn(self,amount):         #feature 6
-        if amount > 0 :
-            self.balance += amount
-            self.history.append(amount)     #feature 11
+        with self._locked():
+            if amount > 0 :
+                self.balance += amount
+                self._record(amount, "incoming")     #feature 11
 
     def expressTransferOut(self,amount):         #feature 8
-        if 0 < amount <= self.balance:
-            self.balance -= (amount + 1)
-            self.history.append(-amount)    #feature 11
-            self.history.append(-1)
+        with self._locked():
+            if 0 < amount <= self.balance:
+                self.balance -= (amount + self.EXPRESS_FEE)
+                self._record(-amount, "express")    #feature 11
+                self._record(-self.EXPRESS_FEE, "fee")
+
+    def _record(self, amount, kind):    #feature 11, history entry plus transaction log entry
+        seq = self.history.offset + len(self.history)
+        self.history.append(amount)
+        self._version = next(_versions)
+        if self._registry is not None:
+            self._registry._journal_entries(self, seq, [amount], [kind])
+
+    def _record_many(self, amounts, kinds):
+        seq = self.history.offset + len(self.history)
+        self.history.extend(amounts)
+        self._version = next(_versions)
+        if self._registry is not None:
+            self._registry._journal_entries(self, seq, amounts, kinds)
 
     def _last_three_plus(self): #feature 12 (pomocnicze)
-        if len(self.history) < 3:
-            return False
-        last_three = self.history[-3:]
-        return min(last_three) > 0
+        return self.history.positive_run >= 3
 
     def _last_five_sum_larger(self, amount):    #feature 12 (pomocnicze)
-        if len(self.history) < 5:
+        if len(self.history) < History.WINDOW:
             return False
-        last_five = self.history[-5:]
-        return sum(last_five) > amount
+        return self.history.window_sum > amount
 
     def submit_for_loan(self,amount):   #feature 12
         decision = False
 
-        if self._last_three_plus():
-            decision = True
+        with self._locked():
+            if self._last_three_plus():
+                decision = True
 
-        if self._last_five_sum_larger(amount):
-            decision = True
+            if self._last_five_sum_larger(amount):
+                decision = True
 
-        if decision:
-            self.balance += amount
+            if decision:
+                self.balance += amount
 
         return decision
 
-    def send_history_by_email(self,email_address):      #feature 19
+    def transfers(self, start=None, end=None):
+        # every transfer as log entries, oldest first; those before the in-memory history are
+        # paged in from the registry's transaction log as the iteration reaches them, the unsaved
+        # ones keep the type and time the registry's journal has for them. With start or end only
+        # the log and the journal are read: the in-memory history has no times to window it by.
+        registry = self._registry
+        log = registry.transaction_log if registry is not None else None
+        unsaved = registry.unsaved_transfers(self) if registry is not None else []
+        if start is not None or end is not None:
+            last = -1
+            if log is not None:
+                for entry in log.iter_history(registry.key(self), start=start, end=end):
+                    last = entry["seq"]
+                    yield entry
+            yield from (entry for entry in unsaved if entry["seq"] > last)
+            return
+        history = self.history
+        if history.offset:
+            if log is None:
+                raise LookupError(f"transfers before #{history.offset} are in a transaction log that is not attached")
+            yield from log.iter_history(registry.key(self), before=history.offset)
+        unsaved = {entry["seq"]: entry for entry in unsaved}
+        for entry in history_entries(history):
+            yield unsaved.get(entry["seq"], entry)
+
+    def statement(self, start=None, end=None):    # streaming statement of the whole history, or of [start, end)
+        return Statement(self.transfers(start, end), start, end)
+
+    def history_email(self):    # (subject, text): the statement summary, the same size for any history length
         today = date.today().strftime('%Y-%m-%d')
-        subject = f"Account Transfer History {today}"
-        text = f"Personal account history: {self.history}"
+        lines = ["Personal account history", *self.statement().summarize().lines()]
+        return f"Account Transfer History {today}", "\n".join(lines)
 
+    def send_history_by_email(self,email_address):      #feature 19
+        subject, text = self.history_email()
         smtp_client = SMTPClient()
         return smtp_client.send(subject, text, email_address)
 
 
 #feature 7
+nip_verifier = NipVerifier()   # shared by every CompanyAccount: one HTTP pool, one cache
+
 class CompanyAccount(Account): # pragma: no cover
-    def __init__(self,company_name,nip_number):
+    __slots__ = ("company_name", "nip_number")
+
+    EXPRESS_FEE = 5     #feature 8
+
+    def __init__(self,company_name,nip_number):     # company_name and nip_number are never changed afterwards
+        self._registry = None
+        self._json = None
+        self._version = next(_versions)
         self.company_name = company_name
         self.nip_number = self.check_nip(nip_number)
         if self.nip_number != "Invalid":
@@ -97,20 +287,20 @@ class CompanyAccount(Account): # pragma: no cover
         self.balance = 0.0
         self.history = []
 
-    def verify_nip_in_registry(self,nip):       #feature 18
-        base = os.getenv('BANK_APP_MF_URL', 'https://wl-test.mf.gov.pl')
-        today = date.today().strftime('%Y-%m-%d')
-        url = f"{base}/api/search/nip/{nip}?date={today}"
-
-        response = requests.get(url)
-        print(f"MF API response: {response.text}")
-
-        if response.status_code == 200:
-            data = response.json()
-            if 'result' in data and 'subject' in data['result']:
-                return data['result']['subject'].get('statusVat') == 'Czynny'
+    @classmethod
+    def restore(cls, company_name, nip_number, balance, history, history_offset=0):     # stored data, no MF lookup
+        account = cls.__new__(cls)
+        account._registry = None
+        account._json = None
+        account._version = next(_versions)
+        account.company_name = company_name
+        account.nip_number = nip_number
+        account._balance = balance
+        account._history = History(history, history_offset)
+        return account
 
-        return False
+    def verify_nip_in_registry(self,nip):       #feature 18
+        return nip_verifier.is_active(nip)
 
     def check_nip(self,number):     #feature 18
         if isinstance(number,str) and len(number)==10 :
@@ -119,84 +309,855 @@ class CompanyAccount(Account): # pragma: no cover
             return "Invalid"
 
     def expressTransferOut(self,amount):     #feature 8
-        if self.balance >= amount > 0:
-            self.balance -= (amount + 5)
-            self.history.append(-amount)
-            self.history.append(-5)
+        with self._locked():
+            if self.balance >= amount > 0:
+                self.balance -= (amount + self.EXPRESS_FEE)
+                self._record(-amount, "express")
+                self._record(-self.EXPRESS_FEE, "fee")
 
     def take_loan(self,amount):     #feature 13
-        if self.balance >= (2*amount) and -1775 in self.history:
-            self.balance += amount
-            return True
-        else:
-            return False
+        # the history only grows, so the ZUS payment is looked up (in the log, if need be) without the lock
+        paid_zus = -1775 in self.history or any(entry["amount"] == -1775 for entry in self.transfers())
+        with self._locked():
+            if self.balance >= (2*amount) and paid_zus:
+                self.balance += amount
+                return True
+            else:
+                return False
 
-    def send_history_by_email(self, email_address): #feature 19
+    def history_email(self):
         today = date.today().strftime('%Y-%m-%d')
-        subject = f"Account Transfer History {today}"
-        text = f"Company account history: {self.history}"
+        lines = ["Company account history", *self.statement().summarize().lines()]
+        return f"Account Transfer History {today}", "\n".join(lines)
 
-        smtp_client = SMTPClient()
-        return smtp_client.send(subject, text, email_address)
+
+@contextmanager
+def _holding(locks):    # acquires locks in the given order, releases them in reverse
+    for lock in locks:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
+class SortedBuckets:      # sorted list kept as short sorted runs, O(sqrt n) add/remove instead of O(n)
+    LOAD = 1000
+
+    def __init__(self, items=()):
+        self.reset(items)
+
+    def reset(self, items):
+        items = sorted(items)
+        self._runs = [items[i:i + self.LOAD] for i in range(0, len(items), self.LOAD)]
+        self._maxes = [run[-1] for run in self._runs]
+        self._len = len(items)
+
+    def clear(self):
+        self.reset(())
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for run in self._runs:
+            yield from run
+
+    def add(self, item):
+        if not self._runs:
+            self._runs.append([item])
+            self._maxes.append(item)
+        else:
+            i = min(bisect_left(self._maxes, item), len(self._runs) - 1)
+            run = self._runs[i]
+            insort(run, item)
+            self._maxes[i] = run[-1]
+            if len(run) > 2 * self.LOAD:
+                self._runs[i + 1:i + 1] = [run[self.LOAD:]]
+                del run[self.LOAD:]
+                self._maxes[i:i + 1] = [run[-1], self._runs[i + 1][-1]]
+        self._len += 1
+
+    def remove(self, item):
+        i = bisect_left(self._maxes, item)
+        run = self._runs[i]
+        del run[bisect_left(run, item)]
+        if run:
+            self._maxes[i] = run[-1]
+        else:
+            del self._runs[i]
+            del self._maxes[i]
+        self._len -= 1
+
+    def _slice(self, i, j):
+        # items from position j of run i onwards
+        yield from self._runs[i][j:] if i < len(self._runs) else ()
+        for run in self._runs[i + 1:]:
+            yield from run
+
+    def from_left(self, item):     # items >= item, in order
+        i = bisect_left(self._maxes, item)
+        return self._slice(i, bisect_left(self._runs[i], item) if i < len(self._runs) else 0)
+
+    def from_right(self, item):    # items > item, in order
+        i = bisect_right(self._maxes, item)
+        return self._slice(i, bisect_right(self._runs[i], item) if i < len(self._runs) else 0)
 
 #feature 14
 class AccountRegistry:
+    STRIPES = 64
+    JOURNAL_LIMIT = 1_000_000   # journal entries kept between saves, past it only where each account's begin
+
     def __init__(self):
-        self.accounts = []
+        self._by_pesel = {}         # key -> Account, keeps insertion order
+        self._by_last_name = {}     # last_name -> {key: Account}
+        self._by_nip = {}           # nip -> CompanyAccount
+        self._keys = SortedBuckets()        # sorted keys, for cursor pagination
+        self._deleted = set()       # keys deleted since the last save; a re-added key stays, its old log is dropped
+        self._listeners = []        # persistence observers, replaced (never changed in place) on subscribe
+        self._lock = threading.RLock()      # guards the indexes above, always taken after a stripe
+        self._stripes = [threading.Lock() for _ in range(self.STRIPES)]
+        # What a balance write or transfer touches is split by stripe, each part behind its own
+        # shard lock, so writes to different stripes never wait for each other or for _lock.
+        # A shard lock is taken last (after _lock) and nothing is acquired while holding it.
+        self._shard_locks = [threading.Lock() for _ in range(self.STRIPES)]
+        self._by_balance = [SortedBuckets() for _ in range(self.STRIPES)]  # sorted (balance, key) pairs
+        self._dirty = [set() for _ in range(self.STRIPES)]     # keys created or modified since the last save
+        self._journal = [[] for _ in range(self.STRIPES)]      # (key, seq, amount, type, timestamp) transfers since the last save
+        self._backfill = [{} for _ in range(self.STRIPES)]     # key -> seq of its first transfer dropped from a full journal
+        self.transaction_log = None     # repository holding the transfers older than the accounts' in-memory history
+        self._version = next(_versions)     # renewed by every change to the registry or its accounts
+
+    @staticmethod
+    def key(account):
+        if isinstance(account, CompanyAccount):
+            return account.nip_number
+        return account.pesel
+
+    def _stripe(self, key):     # stripe, and shard, of a key
+        return hash(key) % self.STRIPES
+
+    @property
+    def accounts(self):     # a snapshot, safe to iterate while other threads add and delete
+        with self._lock:
+            return list(self._by_pesel.values())
+
+    def _attach(self, account, key):   # indexes an account without recording it as a change
+        self._by_pesel[key] = account
+        if isinstance(account, CompanyAccount):
+            self._by_nip[account.nip_number] = account
+        else:
+            self._by_last_name.setdefault(account.last_name, {})[key] = account
+        account._registry = self
+
+    def _index(self, account, key):     # caller holds _lock and the key's shard lock
+        self._attach(account, key)
+        self._dirty[self._stripe(key)].add(key)
+        self._notify("on_put", account)
+
+    def _unindex(self, account):    # caller holds _lock and the key's shard lock
+        key = self.key(account)
+        del self._by_pesel[key]
+        if isinstance(account, CompanyAccount):
+            del self._by_nip[account.nip_number]
+        else:
+            self._remove_last_name(account.last_name, key)
+        self._remove_balance(account.balance, key)
+        self._keys.remove(key)
+        i = self._stripe(key)
+        self._dirty[i].discard(key)
+        self._journal[i] = [entry for entry in self._journal[i] if entry[0] != key]    # a new owner starts at seq 0
+        self._backfill[i].pop(key, None)
+        self._deleted.add(key)
+        account._registry = None
+        self._notify("on_delete", key)
+
+    def _remove_last_name(self, last_name, key):
+        bucket = self._by_last_name[last_name]
+        del bucket[key]
+        if not bucket:
+            del self._by_last_name[last_name]
+
+    def _remove_balance(self, balance, key):
+        self._by_balance[self._stripe(key)].remove((balance, key))
+
+    def _mark_dirty(self, key):
+        i = self._stripe(key)
+        with self._shard_locks[i]:
+            self._dirty[i].add(key)
+
+    def _set_balance(self, account, value):
+        key = self.key(account)
+        i = self._stripe(key)
+        with self._shard_locks[i]:
+            registered = account._registry is self
+            if registered:
+                self._remove_balance(account._balance, key)
+                self._by_balance[i].add((value, key))
+                self._dirty[i].add(key)
+            account._balance = value
+            account._version = next(_versions)
+            if registered:
+                self._notify("on_balance", account)
+
+    def _set_last_name(self, account, value):
+        with self._lock:
+            if account._registry is self:
+                key = self.key(account)
+                self._remove_last_name(account._last_name, key)
+                self._by_last_name.setdefault(value, {})[key] = account
+                self._mark_dirty(key)
+            account._last_name = value
+            account._version = next(_versions)
+            if account._registry is self:
+                self._notify("on_names", account)
+
+    def _names_changed(self, account):
+        with self._lock:
+            if account._registry is self:
+                self._mark_dirty(self.key(account))
+                self._notify("on_names", account)
+
+    def _history_replaced(self, account):
+        with self._lock:
+            if account._registry is self:
+                self._mark_dirty(self.key(account))
+                self._notify("on_put", account)
+
+    def subscribe(self, listener):
+        with self._lock, self._shards():
+            self._listeners = self._listeners + [listener]
+
+    def unsubscribe(self, listener):
+        with self._lock, self._shards():
+            listeners = list(self._listeners)
+            listeners.remove(listener)
+            self._listeners = listeners
+
+    @property
+    def version(self):
+        return self._version
+
+    def _notify(self, event, *args):
+        # called after every change, under the lock that orders the changes of its account: the
+        # shard lock for balances and transfers, _lock (and the shard lock) for the rest. Events of
+        # different stripes can arrive from several threads at once.
+        self._version = next(_versions)
+        for listener in self._listeners:
+            getattr(listener, event)(*args)
+
+    def take_changes(self):     # (changed accounts, deleted keys) since the last call, tracking restarts
+        with self._lock, self._shards():
+            changed = [self._by_pesel[key] for dirty in self._dirty for key in dirty]
+            deleted = list(self._deleted)
+            self._dirty = [set() for _ in range(self.STRIPES)]
+            self._deleted = set()
+        return changed, deleted
+
+    def restore_changes(self, changed, deleted):    # puts back changes whose save failed
+        with self._lock, self._shards():
+            for account in changed:
+                if account._registry is self:
+                    key = self.key(account)
+                    self._dirty[self._stripe(key)].add(key)
+            self._deleted.update(deleted)
+
+    def _journal_entries(self, account, seq, amounts, kinds, now=None):
+        now = now or datetime.now(timezone.utc)
+        key = self.key(account)
+        i = self._stripe(key)
+        with self._shard_locks[i]:
+            if account._registry is self:
+                if len(self._journal[i]) >= self.JOURNAL_LIMIT // self.STRIPES:
+                    self._drop_journal(i)
+                self._journal[i].extend((key, seq + j, float(amount), kind, now) for j, (amount, kind) in enumerate(zip(amounts, kinds)))
+                self._notify("on_transfers", account, seq, amounts, kinds, now)
+
+    def replay_transfers(self, account, seq, amounts, kinds, timestamp):
+        # transfers logged before a restart (the WAL), added to the history and the journal at seq;
+        # those the history already holds are skipped
+        history = account.history
+        held = max(history.offset + len(history) - seq, 0)
+        if held < len(amounts):
+            history.extend(amounts[held:])
+            account._version = next(_versions)
+            self._journal_entries(account, seq + held, amounts[held:], kinds[held:], timestamp)
+
+    def history_unsaved(self):
+        # counts the in-memory history of every account as not saved yet, for a registry rebuilt
+        # from local files: the next save writes it to the transaction log (rows already there stay)
+        with self._lock, self._shards():
+            for key, account in self._by_pesel.items():
+                if len(account.history):
+                    backfill = self._backfill[self._stripe(key)]
+                    backfill[key] = min(account.history.offset, backfill.get(key, account.history.offset))
+
+    def _drop_journal(self, i):
+        # caller holds the shard lock. Nothing has saved the journal for a while: it keeps only
+        # where each account's unsaved transfers begin, the next save takes them from the history
+        backfill = self._backfill[i]
+        for key, seq, *_ in self._journal[i]:
+            backfill[key] = min(seq, backfill.get(key, seq))
+        self._journal[i] = []
+
+    def take_journal(self):
+        with self._shards():
+            journal = [entry for entries in self._journal for entry in entries]
+            backfill = [(self._by_pesel[key], key, seq) for shard in self._backfill for key, seq in shard.items()]
+            self._journal = [[] for _ in range(self.STRIPES)]
+            self._backfill = [{} for _ in range(self.STRIPES)]
+        return journal + self._backfilled(backfill, journal) if backfill else journal
+
+    def _backfilled(self, backfill, journal):
+        # entries of the dropped transfers, rebuilt from the histories up to where the journal picks
+        # up again; the type comes from the sign and the time is unknown
+        journaled = {}
+        for key, seq, *_ in journal:
+            journaled[key] = min(seq, journaled.get(key, seq))
+        entries = []
+        for account, key, first in backfill:
+            history = account.history
+            end = journaled.get(key, history.offset + len(history))
+            for seq in range(max(first, history.offset), end):
+                amount = history[seq - history.offset]
+                entries.append((key, seq, amount, transfer_type(amount), None))
+        return entries
+
+    def unsaved_transfers(self, account):     # the account's journal entries as log entries, oldest first
+        key = self.key(account)
+        i = self._stripe(key)
+        with self._shard_locks[i]:
+            entries = sorted((entry for entry in self._journal[i] if entry[0] == key), key=lambda entry: entry[1])
+        return [{"seq": seq, "amount": amount, "type": kind, "timestamp": timestamp} for _, seq, amount, kind, timestamp in entries]
+
+    def restore_journal(self, journal):     # before restore_changes: entries of keys deleted meanwhile are dropped
+        shards = {}
+        for entry in journal:
+            shards.setdefault(self._stripe(entry[0]), []).append(entry)
+        with self._lock, self._shards(shards):
+            for i, entries in shards.items():
+                self._journal[i][:0] = [entry for entry in entries if entry[0] not in self._deleted]
+
+    def mark_clean(self):
+        with self._lock, self._shards():
+            for i in range(self.STRIPES):
+                self._dirty[i].clear()
+                self._journal[i].clear()
+                self._backfill[i].clear()
+            self._deleted.clear()
+
+    def lock_for(self, key):    # striped per-account lock, hold it around read-modify-write of one account
+        return self._stripes[self._stripe(key)]
+
+    def locked(self, keys):     # holds the stripes of several accounts, taken in a fixed order
+        return _holding([self._stripes[i] for i in sorted({self._stripe(key) for key in keys})])
+
+    def _shards(self, shards=None):     # holds the shard locks of the given stripes, all of them by default
+        return _holding([self._shard_locks[i] for i in (range(self.STRIPES) if shards is None else sorted(shards))])
+
+    def set_balances(self, updates):    # (account, balance) pairs, a shard's index rebuilt once when much of it changes
+        shards = {}
+        for account, balance in updates:
+            if account._registry is self:
+                shards.setdefault(self._stripe(self.key(account)), []).append((account, balance))
+            else:
+                account.balance = balance
+        for i, shard in shards.items():
+            with self._shard_locks[i]:
+                index = self._by_balance[i]
+                rebuild = len(shard) * 64 > len(index)
+                for account, balance in shard:
+                    registered = account._registry is self
+                    if registered and not rebuild:
+                        key = self.key(account)
+                        index.remove((account._balance, key))
+                        index.add((balance, key))
+                    account._balance = balance
+                    account._version = next(_versions)
+                    if registered:
+                        self._dirty[i].add(self.key(account))
+                        self._notify("on_balance", account)
+                if rebuild:
+                    index.reset((self._by_pesel[key]._balance, key) for _, key in index)
 
     def add_account(self,account: Account):
-        if self.find_by_pesel(account.pesel) is None:
-            self.accounts.append(account)
-            return True
-        return False
+        key = self.key(account)
+        with self._lock, self._shard_locks[self._stripe(key)]:
+            if key in self._by_pesel:
+                return False
+            self._index(account, key)
+            self._by_balance[self._stripe(key)].add((account.balance, key))
+            self._keys.add(key)
+        return True
 
+    def add_accounts(self, accounts):   # bulk load
+        added = []
+        with self._lock, self._shards():
+            for account in accounts:
+                key = self.key(account)
+                if key not in self._by_pesel:
+                    self._index(account, key)
+                    added.append((account.balance, key))
+            self._sort_in(added)
+        return len(added)
+
+    def _sort_in(self, added):
+        # (balance, key) pairs into the sorted indexes, each rebuilt once for large batches;
+        # caller holds _lock and the shard locks of the keys
+        shards = {}
+        for balance, key in added:
+            shards.setdefault(self._stripe(key), []).append((balance, key))
+        for i, pairs in shards.items():
+            index = self._by_balance[i]
+            if len(pairs) * 64 <= len(index):
+                for pair in pairs:
+                    index.add(pair)
+            else:
+                index.reset(list(index) + pairs)
+        if len(added) * 64 <= len(self._keys):
+            for _, key in added:
+                self._keys.add(key)
+        else:
+            self._keys.reset(list(self._keys) + [key for _, key in added])
+
+    def replace_account(self, account):
+        # puts account in place of the one with its key as a change to that account, not a new
+        # owner: unlike delete + add, the transaction log of the key is kept
+        key = self.key(account)
+        with self._lock:
+            old = self._by_pesel.get(key)
+            if old is not None:
+                deleted = key in self._deleted
+                with self._shard_locks[self._stripe(key)]:
+                    self._unindex(old)
+                if not deleted:
+                    self._deleted.discard(key)
+            self.add_account(account)
+
+    def delete_account(self, pesel):
+        with self._lock:
+            account = self._by_pesel.get(pesel)
+            if account is None:
+                return False
+            with self._shard_locks[self._stripe(pesel)]:
+                self._unindex(account)
+        return True
+
+    def clear(self):
+        with self._lock, self._shards():
+            for account in self._by_pesel.values():
+                account._registry = None
+            self._by_pesel.clear()
+            self._by_last_name.clear()
+            self._by_nip.clear()
+            self._keys.clear()
+            for i in range(self.STRIPES):
+                self._by_balance[i].clear()
+                self._dirty[i].clear()
+                self._journal[i].clear()
+                self._backfill[i].clear()
+            self._deleted.clear()
+            self._notify("on_clear")
+
+    def swap_in(self, shadow):
+        # replaces every account with those of shadow, a registry nothing else uses (a load
+        # builds it on the side). The indexes change hands in one step under _lock, so readers
+        # see the old accounts or the new ones, never an empty or half-filled registry. The
+        # result counts as saved; shadow is left empty.
+        for account in shadow._by_pesel.values():
+            account._registry = self
+        with self._lock, self._shards():
+            for account in self._by_pesel.values():
+                account._registry = None
+            self._by_pesel, shadow._by_pesel = shadow._by_pesel, {}
+            self._by_last_name, shadow._by_last_name = shadow._by_last_name, {}
+            self._by_nip, shadow._by_nip = shadow._by_nip, {}
+            self._by_balance, shadow._by_balance = shadow._by_balance, [SortedBuckets() for _ in range(shadow.STRIPES)]
+            self._keys, shadow._keys = shadow._keys, SortedBuckets()
+            for i in range(self.STRIPES):
+                self._dirty[i].clear()
+                self._journal[i].clear()
+                self._backfill[i].clear()
+            self._deleted.clear()
+            self._notify("on_clear")
+            for account in self._by_pesel.values():
+                self._notify("on_put", account)
+        shadow.mark_clean()
 
     def find_by_pesel(self,pesel):
-        for a in self.accounts:
-            if a.pesel == pesel:
-                return a
-        return None
+        return self._by_pesel.get(pesel)
+
+    def evaluate_loans(self, loan_requests):     # iterable of (pesel, amount) pairs
+        decisions = []
+        for pesel, amount in loan_requests:
+            account = self.find_by_pesel(pesel)
+            decisions.append(account is not None and account.submit_for_loan(amount))
+        return decisions
+
+    def find_by_last_name(self, last_name):
+        with self._lock:
+            return list(self._by_last_name.get(last_name, {}).values())
+
+    def find_by_nip(self, nip):
+        return self._by_nip.get(nip)
+
+    def find_by_balance_range(self, low=-math.inf, high=math.inf):     # in balance order, merged from the shards
+        end = (math.nextafter(high, math.inf),)
+        found = []
+        with self._lock:
+            for lock, index in zip(self._shard_locks, self._by_balance):
+                with lock:
+                    found.append(list(takewhile(lambda item: item < end, index.from_left((low,)))))
+            return [self._by_pesel[key] for _, key in merge(*found)]
 
-    def all_accounts(self):
-        return list(self.accounts)
+    def page(self, after=None, limit=100):     # accounts with key > after, in key order
+        with self._lock:
+            keys = iter(self._keys) if after is None else self._keys.from_right(after)
+            return [self._by_pesel[key] for key in islice(keys, limit)]
+
+    def send_all_statements(self, addresses, mailer=None, attach_csv=False):
+        # queues the history statement of every account with an address in addresses (key -> email)
+        # and waits for delivery; returns (sent, failed). Without a mailer a temporary MailQueue is used.
+        # attach_csv adds the full history as history.csv, rendered by the worker at send time.
+        own = mailer is None
+        mailer = mailer or MailQueue()
+        futures = []
+        try:
+            after = None
+            while True:
+                page = self.page(after, 1000)
+                for account in page:
+                    address = addresses.get(self.key(account))
+                    if address:
+                        # a new statement per call: the mailer opens the attachment again on every retry
+                        attachments = ([("history.csv", lambda account=account: account.statement().csv_file())]
+                                       if attach_csv else ())
+                        futures.append(mailer.submit(*account.history_email(), address, attachments))
+                if len(page) < 1000:
+                    break
+                after = self.key(page[-1])
+        finally:
+            if own:
+                mailer.close()
+        sent = sum(future.result() for future in futures)
+        return sent, len(futures) - sent
+
+    def all_accounts(self):     # live view, not a copy
+        return self._by_pesel.values()
 
     def account_count(self):
-        return len(self.accounts)
+        return len(self._by_pesel)
+
+def mongo_settings():    # MongoClient options from the environment
+    write_concern = os.getenv("BANK_APP_MONGO_W", "1")
+    timeout = int(os.getenv("BANK_APP_MONGO_TIMEOUT_MS", "5000"))
+    return {
+        "host": os.getenv("BANK_APP_MONGO_URI", "mongodb://localhost:27017"),
+        "maxPoolSize": int(os.getenv("BANK_APP_MONGO_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("BANK_APP_MONGO_MIN_POOL_SIZE", "0")),
+        "serverSelectionTimeoutMS": timeout,
+        "connectTimeoutMS": timeout,
+        "socketTimeoutMS": int(os.getenv("BANK_APP_MONGO_SOCKET_TIMEOUT_MS", "30000")),
+        "w": int(write_concern) if write_concern.isdigit() else write_concern,
+    }
+
+
+_mongo_client = None    # (pid, client) shared by every repository in this process
+_mongo_client_lock = threading.Lock()
+
+
+def mongo_client():
+    # One pooled client per process, created on first use. MongoClient is not fork-safe,
+    # so a forked worker sees a different pid and builds its own instead of reusing the parent's sockets.
+    global _mongo_client
+    with _mongo_client_lock:
+        if _mongo_client is None or _mongo_client[0] != os.getpid():
+            _mongo_client = (os.getpid(), MongoClient(**mongo_settings()))
+        return _mongo_client[1]
+
 
 class MongoAccountsRepository:
-    def __init__(self):
-        self.client = MongoClient("mongodb://localhost:27017")
-        self.collection = self.client["bank"]["accounts"]
+    LOAD_BATCH_SIZE = 10000
+    SAVE_BATCH_SIZE = 1000
+    LOAD_PROJECTION = {
+        "_id": 0, "first_name": 1, "last_name": 1, "pesel": 1, "kind": 1, "company_name": 1, "nip": 1, "balance": 1,
+        "history_cursor": 1, "history_tail": 1, "history": 1,     # history: documents saved before the transaction log
+    }
+    HISTORY_PAGE = 1000
+    STORED_PROJECTION = {"_id": 0, "pesel": 1, "seq": 1, "amount": 1}
+    DUPLICATE_KEY = 11000
+
+    def __init__(self, client=None, database=None):    # connects lazily, to the shared client unless one is given
+        self._client = client
+        self.database = database or os.getenv("BANK_APP_MONGO_DB", "bank")
+        self._collection = None
+        self._companies = None
+        self._transactions = None
+        self._indexed = False
+
+    @property
+    def client(self):
+        return self._client or mongo_client()
+
+    @property
+    def collection(self):
+        if self._collection is not None:
+            return self._collection
+        return self.client[self.database]["accounts"]
+
+    @collection.setter
+    def collection(self, collection):
+        self._collection = collection
+
+    @property
+    def companies(self):    # company accounts, keyed by NIP: the accounts collection has a unique PESEL
+        if self._companies is not None:
+            return self._companies
+        return self.client[self.database]["companies"]
+
+    @companies.setter
+    def companies(self, collection):
+        self._companies = collection
+
+    @property
+    def transactions(self):
+        if self._transactions is not None:
+            return self._transactions
+        return self.client[self.database]["transactions"]
+
+    @transactions.setter
+    def transactions(self, collection):
+        self._transactions = collection
+
+    def _ensure_indexes(self):
+        if not self._indexed:
+            self.collection.create_index("pesel", unique=True)
+            self.companies.create_index("nip", unique=True)
+            self.transactions.create_index([("pesel", ASCENDING), ("seq", ASCENDING)], unique=True)
+            self._indexed = True
+
+    @staticmethod
+    def _to_document(account):
+        history = account.history
+        if isinstance(account, CompanyAccount):
+            document = {"kind": "company", "company_name": account.company_name, "nip": account.nip_number}
+        else:
+            document = {"first_name": account.first_name, "last_name": account.last_name, "pesel": account.pesel}
+        document.update({
+            "balance": account.balance,
+            "history_cursor": history.offset + len(history),     # entries stored in the transactions collection
+            "history_tail": history[-History.WINDOW:].tolist()   # keeps loan eligibility without reading the log
+        })
+        return document
+
+    @staticmethod
+    def _from_document(doc):
+        tail = doc.get("history_tail", doc.get("history", []))
+        cursor = doc.get("history_cursor", len(tail))
+        if doc.get("kind") == "company":
+            return CompanyAccount.restore(doc["company_name"], doc["nip"], doc["balance"], tail, cursor - len(tail))
+        return Account.restore(doc["first_name"], doc["last_name"], doc["pesel"], doc["balance"], tail, cursor - len(tail))
+
+    @staticmethod
+    def _transaction_documents(journal):
+        return [
+            {"pesel": pesel, "seq": seq, "amount": amount, "type": kind, "timestamp": timestamp}
+            for pesel, seq, amount, kind, timestamp in journal
+        ]
+
+    def _duplicates(self, e):   # (documents refused as duplicates, query for the stored ones); other errors raise
+        errors = e.details["writeErrors"]
+        if any(error["code"] != self.DUPLICATE_KEY for error in errors):
+            raise e
+        documents = [error["op"] for error in errors]
+        query = {"$or": [{"pesel": document["pesel"], "seq": document["seq"]} for document in documents]}
+        return documents, query
+
+    @staticmethod
+    def _check_stored(e, documents, stored):
+        # entries already stored by an earlier, partly failed save are fine; another transfer
+        # under the same (pesel, seq) is not
+        amounts = {(document["pesel"], document["seq"]): document["amount"] for document in stored}
+        if any(amounts.get((document["pesel"], document["seq"])) != document["amount"] for document in documents):
+            raise e
+
+    def _insert_transactions(self, journal):
+        try:
+            self.transactions.insert_many(self._transaction_documents(journal), ordered=False)
+        except BulkWriteError as e:
+            documents, query = self._duplicates(e)
+            self._check_stored(e, documents, self.transactions.find(query, self.STORED_PROJECTION))
+
+    @contextmanager
+    def _draining(self, registry):
+        # (changed, deleted, journal) since the last save, put back into registry if anything
+        # in the block fails or is cancelled - building the documents included
+        changed, deleted = registry.take_changes()
+        journal = registry.take_journal()
+        try:
+            yield changed, deleted, journal
+        except BaseException:
+            registry.restore_journal(journal)
+            registry.restore_changes(changed, deleted)
+            raise
+
+    def _operations(self, changed, deleted):
+        # (log purges, account operations, company operations). A deleted key may be either kind, it
+        # goes from both collections unless it was added again; its transactions go in any case
+        accounts, companies, added = [], [], set()
+        for account in changed:
+            if isinstance(account, CompanyAccount):
+                companies.append(ReplaceOne({"nip": account.nip_number}, self._to_document(account), upsert=True))
+                added.add(account.nip_number)
+            else:
+                accounts.append(ReplaceOne({"pesel": account.pesel}, self._to_document(account), upsert=True))
+                added.add(account.pesel)
+        accounts += [DeleteOne({"pesel": key}) for key in deleted if key not in added]
+        companies += [DeleteOne({"nip": key}) for key in deleted if key not in added]
+        return [DeleteMany({"pesel": key}) for key in deleted], accounts, companies
+
+    def _save_batches(self, journal, purges, accounts, companies):
+        # (collection, batch) pairs, None for the new transactions. The purges of deleted keys come
+        # before them, so a new owner's transfers are not taken for the old one's; the transactions
+        # come before the accounts, so no cursor points past the stored log
+        size = self.SAVE_BATCH_SIZE
+        parts = ((self.transactions, purges), (None, journal), (self.collection, accounts), (self.companies, companies))
+        return [(collection, items[i:i + size]) for collection, items in parts for i in range(0, len(items), size)]
+
+    def save_all(self, registry, progress=None, pause=0.0):
+        # writes only what changed since the last save or load, SAVE_BATCH_SIZE documents at a
+        # time with pause seconds between batches; progress(written, total) follows each batch
+        # after a failure the written batches are saved again; they are upserts and known transactions
+        with self._draining(registry) as (changed, deleted, journal):
+            if not changed and not deleted and not journal:
+                return 0
+
+            batches = self._save_batches(journal, *self._operations(changed, deleted))
+            written, total = 0, sum(len(batch) for _, batch in batches)
+            self._ensure_indexes()
+            for collection, batch in batches:
+                if written and pause:
+                    time.sleep(pause)
+                if collection is None:
+                    self._insert_transactions(batch)
+                else:
+                    collection.bulk_write(batch, ordered=False)
+                written += len(batch)
+                if progress:
+                    progress(written, total)
+        return len(changed) + len(deleted)
+
+    def history_page(self, pesel, after=-1, limit=HISTORY_PAGE, start=None, end=None, before=None):
+        # transactions with after < seq < before, oldest first; start/end limit them to timestamps in [start, end)
+        query = {"pesel": pesel, "seq": {"$gt": after} if before is None else {"$gt": after, "$lt": before}}
+        if start is not None or end is not None:
+            query["timestamp"] = {op: value for op, value in (("$gte", start), ("$lt", end)) if value is not None}
+        cursor = self.transactions.find(query, {"_id": 0})
+        return list(cursor.sort("seq", ASCENDING).limit(limit))
+
+    def iter_history(self, pesel, page_size=HISTORY_PAGE, start=None, end=None, before=None):     # reads the log lazily, one page at a time
+        after = -1
+        while True:
+            page = self.history_page(pesel, after, page_size, start, end, before)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1]["seq"]
+
+    def load_all(self, registry, progress=None, pause=0.0):
+        # reads every account into a shadow registry, LOAD_BATCH_SIZE at a time with pause seconds
+        # between batches, then swaps it in; progress(read, estimated total) follows each batch
+        collections = (self.collection, self.companies)
+        total = sum(collection.estimated_document_count() for collection in collections) if progress else None
+        loaded = []
+        for collection in collections:
+            for doc in collection.find({}, self.LOAD_PROJECTION, batch_size=self.LOAD_BATCH_SIZE):
+                loaded.append(self._from_document(doc))
+                if len(loaded) % self.LOAD_BATCH_SIZE == 0:
+                    self._loaded_batch(len(loaded), total, progress, pause)
+        self._loaded_batch(len(loaded), total, progress, 0.0)
+        registry.transaction_log = self     # the loaded accounts hold only the tail of their history
+        return self._replace_all(registry, loaded)
+
+    @staticmethod
+    def _loaded_batch(read, total, progress, pause):
+        if progress:
+            progress(read, max(total, read))
+        if pause:
+            time.sleep(pause)
+
+    @staticmethod
+    def _replace_all(registry, loaded):
+        shadow = AccountRegistry()
+        added = shadow.add_accounts(loaded)
+        registry.swap_in(shadow)
+        return added
 
-    def save_all(self, registry):
-        self.collection.delete_many({})
-        accounts_data = []
 
-        for account in registry.all_accounts():
-            account_dict = {
-                "first_name": account.first_name,
-                "last_name": account.last_name,
-                "pesel": account.pesel,
-                "balance": account.balance,
-                "history": account.history
-            }
-            accounts_data.append(account_dict)
+class AsyncMongoAccountsRepository(MongoAccountsRepository):
+    # The same documents through pymongo's asyncio client, for app/asgi.py: a save or load
+    # waiting on the server holds no thread; save_all and load_all are coroutines. An
+    # AsyncMongoClient belongs to the event loop it is first used on, so each repository
+    # creates its own instead of sharing mongo_client().
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = AsyncMongoClient(**mongo_settings())
+        return self._client
 
-        if accounts_data:
-            self.collection.insert_many(accounts_data)
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
 
+    async def _ensure_indexes(self):
+        if not self._indexed:
+            await self.collection.create_index("pesel", unique=True)
+            await self.companies.create_index("nip", unique=True)
+            await self.transactions.create_index([("pesel", ASCENDING), ("seq", ASCENDING)], unique=True)
+            self._indexed = True
 
-    def load_all(self, registry):
-        registry.accounts.clear()
+    async def _insert_transactions(self, journal):
+        try:
+            await self.transactions.insert_many(self._transaction_documents(journal), ordered=False)
+        except BulkWriteError as e:
+            documents, query = self._duplicates(e)
+            stored = [document async for document in self.transactions.find(query, self.STORED_PROJECTION)]
+            self._check_stored(e, documents, stored)
 
-        for acc_data in self.collection.find():
-            account = Account(
-                acc_data["first_name"],
-                acc_data["last_name"],
-                acc_data["pesel"]
-            )
+    async def save_all(self, registry, progress=None, pause=0.0):
+        with self._draining(registry) as (changed, deleted, journal):
+            if not changed and not deleted and not journal:
+                return 0
 
-            account.balance = acc_data["balance"]
-            account.history = acc_data["history"]
-            registry.add_account(account)
+            batches = self._save_batches(journal, *self._operations(changed, deleted))
+            written, total = 0, sum(len(batch) for _, batch in batches)
+            await self._ensure_indexes()
+            for collection, batch in batches:
+                if written and pause:
+                    await asyncio.sleep(pause)
+                if collection is None:
+                    await self._insert_transactions(batch)
+                else:
+                    await collection.bulk_write(batch, ordered=False)
+                written += len(batch)
+                if progress:
+                    progress(written, total)
+        return len(changed) + len(deleted)
 
+    async def load_all(self, registry, progress=None, pause=0.0):
+        collections = (self.collection, self.companies)
+        total = sum([await collection.estimated_document_count() for collection in collections]) if progress else None
+        loaded = []
+        for collection in collections:
+            async for doc in collection.find({}, self.LOAD_PROJECTION, batch_size=self.LOAD_BATCH_SIZE):
+                loaded.append(self._from_document(doc))
+                if len(loaded) % self.LOAD_BATCH_SIZE == 0:
+                    self._loaded_batch(len(loaded), total, progress, 0.0)
+                    if pause:
+                        await asyncio.sleep(pause)
+        self._loaded_batch(len(loaded), total, progress, 0.0)
+        # older history is read where statements run, in a thread, so through the synchronous client
+        registry.transaction_log = MongoAccountsRepository(database=self.database)
+        # indexing a large registry takes a while, other requests keep being served meanwhile
+        return await asyncio.to_thread(self._replace_all, registry, loaded)
@@ -0,0 +1,126 @@
+import numpy as np
+
+INCOMING, OUTGOING, EXPRESS = 0, 1, 2
+TRANSFER_TYPES = {"incoming": INCOMING, "outgoing": OUTGOING, "express": EXPRESS}
+KIND_NAMES = np.array(["incoming", "outgoing", "express"])
+
+
+class BatchTransferEngine:
+    # Applies (pesel, type, amount) rows with the same rules as Account.transferIn,
+    # transferOut and expressTransferOut called one by one in row order.
+    # Rows are grouped per account; round r of the short groups applies the r-th
+    # row of every account at once, long groups are replayed with np.add.accumulate.
+    # Both paths add the same float deltas in the same order as the sequential code.
+    LONG_GROUP = 64
+    WINDOW = 64
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def _lookup(self, pesels):
+        unique, inverse = np.unique(np.asarray(pesels, dtype=str), return_inverse=True)
+        accounts = [self.registry.find_by_pesel(pesel) for pesel in unique.tolist()]
+        found = np.array([account is not None for account in accounts], dtype=bool)
+        slots = np.cumsum(found) - 1     # slot of each unique pesel among found accounts
+        acc = np.where(found[inverse], slots[inverse], -1)
+        return [account for account in accounts if account is not None], acc
+
+    @staticmethod
+    def _kinds(types):
+        unique, inverse = np.unique(np.asarray(types, dtype=str), return_inverse=True)
+        codes = np.array([TRANSFER_TYPES.get(t, -1) for t in unique.tolist()], dtype=np.int8)
+        return codes[inverse]
+
+    def apply(self, transfers):
+        transfers = list(transfers)
+        n = len(transfers)
+        accepted = np.zeros(n, dtype=bool)
+        if n == 0:
+            return accepted
+
+        pesels, types, amounts = zip(*transfers)
+        accounts, acc = self._lookup(pesels)
+        kind = self._kinds(types)
+        amount = np.asarray(amounts, dtype=np.float64)
+        if not accounts:
+            return accepted
+
+        with self.registry.locked(self.registry.key(account) for account in accounts):
+            self._apply_locked(accounts, acc, kind, amount, accepted)
+        return accepted
+
+    def _apply_locked(self, accounts, acc, kind, amount, accepted):
+        balances = np.array([account.balance for account in accounts], dtype=np.float64)
+        fees = np.array([account.EXPRESS_FEE for account in accounts], dtype=np.float64)
+
+        valid = (acc >= 0) & (kind >= 0) & (amount > 0)
+        fee = np.where(kind == EXPRESS, fees[acc], 0.0)
+        delta = np.where(kind == INCOMING, amount, -(amount + fee))
+        checked = kind != INCOMING
+
+        rows = np.flatnonzero(valid)
+        rows = rows[np.argsort(acc[rows], kind="stable")]
+        if rows.size == 0:
+            return
+        boundaries = np.flatnonzero(np.diff(acc[rows])) + 1
+        starts = np.concatenate(([0], boundaries))
+        lengths = np.diff(np.concatenate((starts, [rows.size])))
+
+        short = lengths <= self.LONG_GROUP
+        self._apply_rounds(rows, starts[short], lengths[short], acc, amount, delta, checked, balances, accepted)
+        for start, length in zip(starts[~short], lengths[~short]):
+            group = rows[start:start + length]
+            j = acc[group[0]]
+            balances[j] = self._apply_group(group, amount, delta, checked, balances[j], accepted)
+
+        self._write_back(accounts, acc, kind, amount, fee, balances, accepted)
+
+    @staticmethod
+    def _apply_rounds(rows, starts, lengths, acc, amount, delta, checked, balances, accepted):
+        for r in range(int(lengths.max()) if lengths.size else 0):
+            current = rows[starts[lengths > r] + r]
+            accs = acc[current]
+            before = balances[accs]
+            ok = ~checked[current] | (amount[current] <= before)
+            balances[accs] = before + np.where(ok, delta[current], 0.0)
+            accepted[current] = ok
+
+    def _apply_group(self, group, amount, delta, checked, balance, accepted):
+        pos, window = 0, self.WINDOW
+        while pos < group.size:
+            current = group[pos:pos + window]
+            running = np.add.accumulate(np.concatenate(([balance], delta[current])))
+            before = running[:-1]
+            bad = checked[current] & (amount[current] > before)
+            if not bad.any():
+                accepted[current] = True
+                balance = running[-1]
+                pos += current.size
+                window *= 2
+                continue
+            k = int(np.argmax(bad))
+            accepted[current[:k]] = True
+            balance = before[k]
+            pos += k + 1
+            window = self.WINDOW
+        return balance
+
+    def _write_back(self, accounts, acc, kind, amount, fee, balances, accepted):
+        rows = np.flatnonzero(accepted)
+        rows = rows[np.argsort(acc[rows], kind="stable")]
+        if rows.size == 0:
+            return
+
+        # every accepted row produces one or two history entries, like the Account methods
+        first = np.where(kind[rows] == INCOMING, amount[rows], -amount[rows])
+        second = np.where(kind[rows] == EXPRESS, -fee[rows], np.nan)
+        entries = np.column_stack((first, second)).ravel()
+        kinds = np.column_stack((KIND_NAMES[kind[rows]], np.full(rows.size, "fee"))).ravel()
+        owners = np.repeat(acc[rows], 2)
+        keep = ~np.isnan(entries)
+        entries, kinds, owners = entries[keep], kinds[keep], owners[keep]
+
+        touched, split_at = np.unique(owners, return_index=True)
+        for j, chunk, chunk_kinds in zip(touched.tolist(), np.split(entries, split_at[1:]), np.split(kinds, split_at[1:])):
+            accounts[j]._record_many(chunk.tolist(), chunk_kinds.tolist())
+        self.registry.set_balances(zip([accounts[j] for j in touched.tolist()], balances[touched].tolist()))
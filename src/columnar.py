@@ -0,0 +1,232 @@
+import math
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from src.account import AccountRegistry, Account, CompanyAccount
+
+# Columnar registry image: a header, fixed-width columns (key, kind, balance, name ids,
+# history bounds) and two variable-length areas (all history doubles back to back, and a
+# deduplicated UTF-8 string table). Rows are sorted by key, so a lookup is one binary
+# search over the mmapped key column and nothing else is read until an account is used.
+
+MAGIC = b"BANKCOL1"
+HEADER = struct.Struct("<8sQQQQQ")     # magic, rows, key width, strings, string bytes, history entries
+PERSONAL, COMPANY = 0, 1
+NO_STRING = -1
+
+
+def _columns(rows, key_width, strings, string_bytes, history):
+    # (name, dtype, count) in file order; every column starts on an 8 byte boundary
+    return [
+        ("keys", f"S{key_width}", rows),
+        ("kind", np.uint8, rows),
+        ("balance", np.float64, rows),
+        ("first", np.int32, rows),
+        ("second", np.int32, rows),
+        ("history_start", np.uint64, rows + 1),    # row i owns history[start[i]:start[i + 1]]
+        ("history_seq", np.uint64, rows),          # History.offset of each row
+        ("history", np.float64, history),
+        ("string_start", np.uint64, strings + 1),
+        ("string_data", np.uint8, string_bytes),
+    ]
+
+
+def _starts(lengths):   # prefix sums with a leading 0, so item i spans starts[i]:starts[i + 1]
+    starts = np.zeros(len(lengths) + 1, dtype=np.uint64)
+    np.cumsum(lengths, out=starts[1:])
+    return starts
+
+
+def _aligned(size):
+    return -size % 8
+
+
+def export_registry(registry, path):    # writes registry as an image at path, atomically; returns rows written
+    with registry._lock:
+        accounts = registry.page(None, registry.account_count())
+
+    strings = {}
+
+    def string_id(value):
+        if value is None:
+            return NO_STRING
+        return strings.setdefault(value, len(strings))
+
+    keys, kind, first, second, seq, lengths = [], [], [], [], [], []
+    for account in accounts:
+        keys.append(registry.key(account).encode())
+        if isinstance(account, CompanyAccount):
+            kind.append(COMPANY)
+            first.append(string_id(account.company_name))
+            second.append(NO_STRING)
+        else:
+            kind.append(PERSONAL)
+            first.append(string_id(account.first_name))
+            second.append(string_id(account.last_name))
+        seq.append(account.history.offset)
+        lengths.append(len(account.history))
+
+    encoded = [value.encode() for value in strings]
+    key_width = max((len(key) for key in keys), default=1)
+    data = {
+        "keys": np.array(keys, dtype=f"S{key_width}"),
+        "kind": np.array(kind, dtype=np.uint8),
+        "balance": np.array([account.balance for account in accounts], dtype=np.float64),
+        "first": np.array(first, dtype=np.int32),
+        "second": np.array(second, dtype=np.int32),
+        "history_start": _starts(lengths),
+        "history_seq": np.array(seq, dtype=np.uint64),
+        "history": np.frombuffer(b"".join(account.history.tobytes() for account in accounts), dtype=np.float64),
+        "string_start": _starts([len(value) for value in encoded]),
+        "string_data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+    }
+
+    header = HEADER.pack(MAGIC, len(accounts), key_width, len(encoded), data["string_data"].size, data["history"].size)
+    with open(path + ".tmp", "wb") as f:
+        f.write(header + bytes(_aligned(len(header))))
+        for name, _, _ in _columns(len(accounts), key_width, len(encoded), data["string_data"].size, data["history"].size):
+            column = data[name].tobytes()
+            f.write(column + bytes(_aligned(len(column))))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    return len(accounts)
+
+
+class RegistryImage:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, rows, key_width, strings, string_bytes, history = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"not a registry image: {path}")
+        self.rows = rows
+        pos = HEADER.size + _aligned(HEADER.size)
+        for name, dtype, count in _columns(rows, key_width, strings, string_bytes, history):
+            column = np.frombuffer(self._map, dtype=dtype, count=count, offset=pos)
+            setattr(self, name, column)
+            pos += column.nbytes + _aligned(column.nbytes)
+        self._key_width = key_width
+
+    def __len__(self):
+        return self.rows
+
+    def find(self, key):    # row holding key, or None
+        encoded = key.encode() if isinstance(key, str) else None
+        if not encoded or len(encoded) > self._key_width:
+            return None
+        row = int(np.searchsorted(self.keys, encoded))
+        if row < self.rows and self.keys[row] == encoded:
+            return row
+        return None
+
+    def _string(self, i):
+        if i == NO_STRING:
+            return None
+        return self.string_data[self.string_start[i]:self.string_start[i + 1]].tobytes().decode()
+
+    def account(self, row):
+        key = self.keys[row].decode()
+        history = self.history[self.history_start[row]:self.history_start[row + 1]].tobytes()
+        balance = float(self.balance[row])
+        offset = int(self.history_seq[row])
+        if self.kind[row] == COMPANY:
+            return CompanyAccount.restore(self._string(self.first[row]), key, balance, history, offset)
+        return Account.restore(self._string(self.first[row]), self._string(self.second[row]), key, balance, history, offset)
+
+
+class MappedAccountRegistry(AccountRegistry):
+    # AccountRegistry started from an image: find_by_pesel and account_count work straight
+    # away, an account becomes a real object the first time it is looked up, and queries
+    # over every account (names, balances, paging) hydrate the rest first.
+    def __init__(self, path):
+        super().__init__()
+        self._image = RegistryImage(path)
+        self._pending = np.ones(len(self._image), dtype=bool)    # rows not hydrated yet
+        self._pending_count = len(self._image)
+
+    def _hydrate(self, key):    # caller holds _lock and the key's shard lock
+        row = self._image.find(key)
+        if row is None or not self._pending[row]:
+            return
+        self._pending[row] = False
+        self._pending_count -= 1
+        account = self._image.account(row)
+        self._attach(account, key)
+        self._sort_in([(account.balance, key)])
+
+    def hydrate_all(self):
+        with self._lock, self._shards():
+            if not self._pending_count:
+                return
+            rows = np.flatnonzero(self._pending).tolist()
+            self._pending[:] = False
+            self._pending_count = 0
+            added = []
+            for row in rows:
+                account = self._image.account(row)
+                key = self.key(account)
+                self._attach(account, key)
+                added.append((account.balance, key))
+            self._sort_in(added)
+
+    def find_by_pesel(self, pesel):
+        if self._pending_count and pesel not in self._by_pesel:
+            with self._lock, self._shard_locks[self._stripe(pesel)]:
+                self._hydrate(pesel)
+        return super().find_by_pesel(pesel)
+
+    def find_by_nip(self, nip):
+        self.find_by_pesel(nip)     # a company is keyed by its NIP
+        return super().find_by_nip(nip)
+
+    def account_count(self):
+        return len(self._by_pesel) + self._pending_count
+
+    def add_account(self, account):
+        self.find_by_pesel(self.key(account))
+        return super().add_account(account)
+
+    def add_accounts(self, accounts):
+        self.hydrate_all()
+        return super().add_accounts(accounts)
+
+    def delete_account(self, pesel):
+        self.find_by_pesel(pesel)
+        return super().delete_account(pesel)
+
+    def clear(self):
+        with self._lock:
+            self._pending[:] = False
+            self._pending_count = 0
+            super().clear()
+
+    def swap_in(self, shadow):
+        with self._lock:
+            self._pending[:] = False
+            self._pending_count = 0
+            super().swap_in(shadow)
+
+    @property
+    def accounts(self):
+        self.hydrate_all()
+        return super().accounts
+
+    def all_accounts(self):
+        self.hydrate_all()
+        return super().all_accounts()
+
+    def find_by_last_name(self, last_name):
+        self.hydrate_all()
+        return super().find_by_last_name(last_name)
+
+    def find_by_balance_range(self, low=-math.inf, high=math.inf):
+        self.hydrate_all()
+        return super().find_by_balance_range(low, high)
+
+    def page(self, after=None, limit=100):
+        self.hydrate_all()
+        return super().page(after, limit)
@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+NEW, REPLAY, BUSY, MISMATCH = "new", "replay", "busy", "mismatch"
+MAX_KEY_LENGTH = 255
+_PENDING = object()     # response slot of a key whose request is still running
+
+
+class FileBackend:
+    # Append-only JSON lines of finished entries, flushed per write (a process crash loses
+    # nothing, an OS crash may lose the tail). Loading drops expired entries and rewrites the file.
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def load(self, now):    # [(key, fingerprint, response, expires)] still valid at now, oldest first
+        entries = []
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        key, fingerprint, response, expires = json.loads(line)
+                    except ValueError:      # a line torn by a crash
+                        continue
+                    if expires > now:
+                        entries.append((key, fingerprint, tuple(response), expires))
+        with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(entry) + "\n" for entry in entries)
+        os.replace(self.path + ".tmp", self.path)
+        return entries
+
+    def save(self, key, fingerprint, response, expires):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps([key, fingerprint, response, expires]) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class IdempotencyStore:
+    # Responses of requests sent with an Idempotency-Key, so that a retry gets the first answer
+    # instead of running again. begin() claims a key: NEW means run the request and finish() it
+    # (or abandon() it on error), REPLAY returns the stored response, BUSY means the first request
+    # is still running, MISMATCH that the key came with a different request (fingerprint).
+    # Entries expire ttl seconds after they were claimed; they sit in claim order, so expiry and
+    # the max_keys bound both evict from the front in O(1).
+    def __init__(self, ttl=None, max_keys=None, backend=None, clock=time.time):
+        self.ttl = float(ttl if ttl is not None else os.getenv("BANK_APP_IDEMPOTENCY_TTL", "86400"))
+        self.max_keys = int(max_keys if max_keys is not None else os.getenv("BANK_APP_IDEMPOTENCY_MAX_KEYS", "100000"))
+        self.backend = backend
+        self.evicted = 0    # unexpired entries dropped to stay under max_keys
+        self._clock = clock
+        self._entries = OrderedDict()       # key -> [fingerprint, response or _PENDING, expires]
+        self._lock = threading.Lock()
+        if backend is not None:
+            for key, fingerprint, response, expires in backend.load(clock()):
+                self._entries[key] = [fingerprint, response, expires]
+            self._trim(clock())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def begin(self, key, fingerprint):     # (NEW | REPLAY | BUSY | MISMATCH, stored response or None)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                if entry[0] != fingerprint:
+                    return MISMATCH, None
+                if entry[1] is _PENDING:
+                    return BUSY, None
+                return REPLAY, entry[1]
+            self._entries.pop(key, None)
+            self._entries[key] = [fingerprint, _PENDING, now + self.ttl]
+            self._trim(now)
+        return NEW, None
+
+    def finish(self, key, response):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] is not _PENDING:
+                return      # evicted while running
+            entry[1] = response
+            if self.backend is not None:
+                self.backend.save(key, entry[0], response, entry[2])
+
+    def abandon(self, key):     # the request failed, a retry may run it again
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is _PENDING:
+                del self._entries[key]
+
+    def _trim(self, now):   # caller holds _lock (or is __init__)
+        entries = self._entries
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry[2] > now and len(entries) <= self.max_keys:
+                return
+            if entry[2] > now:
+                self.evicted += 1
+            del entries[key]
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
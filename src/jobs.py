@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+log = logging.getLogger("bank.jobs")
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+class Job:
+    # One background run of work(job). work reports how far it got through progress(done, total)
+    # and returns the job's result (a dict). Other threads read the fields without a lock: each
+    # is set by a single assignment.
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = QUEUED
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created = _now()
+        self.started = None
+        self.finished = None
+
+    def progress(self, done, total=None):
+        if total is not None:
+            self.total = total
+        self.done = done
+
+    def to_dict(self):
+        stamps = {name: value and value.isoformat() for name, value in
+                  (("created", self.created), ("started", self.started), ("finished", self.finished))}
+        return {
+            "id": self.id, "type": self.kind, "status": self.state, "done": self.done, "total": self.total,
+            "result": self.result, "error": self.error, **stamps,
+        }
+
+
+class JobQueue:
+    # Save/load jobs, run one at a time off the request path: submit() hands work to a worker
+    # thread, submit_async() runs coroutine work as a task of the running event loop. A job
+    # submitted while one of its kind is still queued gets that job back, it would do the same
+    # work. The newest `keep` finished jobs stay around for their status.
+    def __init__(self, keep=100):
+        self.keep = keep
+        self._jobs = OrderedDict()      # id -> Job, oldest first
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._turn = None       # asyncio.Lock of the coroutine jobs, made on the loop that runs them
+        self._tasks = set()     # running tasks, referenced until done
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):     # newest first
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def submit(self, kind, work):
+        with self._lock:
+            job, new = self._add(kind)
+            if new and self._worker is None:
+                self._worker = threading.Thread(target=self._work, name="jobs", daemon=True)
+                self._worker.start()
+        if new:
+            self._queue.put((job, work))
+        return job
+
+    def submit_async(self, kind, work):
+        with self._lock:
+            job, new = self._add(kind)
+        if new:
+            task = asyncio.get_running_loop().create_task(self._run_async(job, work))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return job
+
+    def close(self):    # finishes the queued jobs, then stops the worker
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+
+    def _add(self, kind):   # (job, whether it is new); caller holds _lock
+        for job in self._jobs.values():
+            if job.kind == kind and job.state == QUEUED:
+                return job, False
+        job = Job(kind)
+        self._jobs[job.id] = job
+        finished = [old.id for old in self._jobs.values() if old.state in (DONE, FAILED)]
+        for old in finished[:max(len(finished) - self.keep, 0)]:
+            del self._jobs[old]
+        return job, True
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            job, work = item
+            self._start(job)
+            try:
+                result = work(job)
+            except Exception as error:
+                self._fail(job, error)
+            else:
+                self._finish(job, result)
+
+    async def _run_async(self, job, work):
+        if self._turn is None:
+            self._turn = asyncio.Lock()
+        async with self._turn:
+            self._start(job)
+            try:
+                result = await work(job)
+            except Exception as error:
+                self._fail(job, error)
+            else:
+                self._finish(job, result)
+
+    @staticmethod
+    def _start(job):
+        job.started = _now()
+        job.state = RUNNING
+
+    @staticmethod
+    def _finish(job, result):
+        job.result = result
+        job.finished = _now()
+        job.state = DONE
+
+    @staticmethod
+    def _fail(job, error):
+        log.warning("%s job %s failed: %r", job.kind, job.id, error)
+        job.error = f"{type(error).__name__}: {error}"
+        job.finished = _now()
+        job.state = FAILED
@@ -0,0 +1,108 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+
+LOGGER = "bank"
+QUEUE_SIZE = 10000      # records waiting for the writer thread; more are dropped, not waited for
+_IDS = re.compile(r"(?<![\d-])\d(?:-?\d){9,10}(?![\d-])")      # PESEL (11 digits) or NIP (10, dashes allowed)
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+_sampled = contextvars.ContextVar("sampled", default=True)
+_rate = 1.0
+_listener = None
+
+
+def mask(text):     # every PESEL/NIP-shaped number becomes stars and its last 3 digits
+    return _IDS.sub(_stars, text)
+
+
+def _stars(match):
+    digits = match.group().replace("-", "")
+    return "*" * (len(digits) - 3) + digits[-3:]
+
+
+def sample_request(rate=None):     # decides once per request whether its records below WARNING are written
+    rate = _rate if rate is None else rate
+    sampled = rate >= 1 or random.random() < rate
+    _sampled.set(sampled)
+    return sampled
+
+
+class SamplingFilter(logging.Filter):   # runs in the caller, so dropped records cost almost nothing
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or _sampled.get()
+
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line: ts, level, logger, msg and any extra= fields, all masked
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": mask(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = mask(value) if isinstance(value, str) else value
+        if record.exc_info:
+            entry["exc"] = mask(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class BufferedHandler(logging.handlers.QueueHandler):
+    # hands records to the writer thread as they are: formatting, masking and the write all
+    # happen there. A full queue drops the record instead of blocking the request.
+    def __init__(self, maxsize=QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level=None, sample_rate=None, stream=None):
+    # the "bank" logger writes JSON lines to stream (stderr) from a background thread;
+    # BANK_APP_LOG_LEVEL (INFO) and BANK_APP_LOG_SAMPLE (share of requests logged, 0.01) set the defaults.
+    # Calling it again replaces the previous setup. Returns the BufferedHandler.
+    global _listener, _rate
+    shutdown_logging()
+    level = level or os.getenv("BANK_APP_LOG_LEVEL", "INFO").upper()
+    _rate = float(os.getenv("BANK_APP_LOG_SAMPLE", "0.01") if sample_rate is None else sample_rate)
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(JsonFormatter())
+    handler = BufferedHandler()
+    handler.addFilter(SamplingFilter())
+    logger = logging.getLogger(LOGGER)
+    logger.setLevel(level)
+    logger.propagate = False
+    logger.addHandler(handler)
+    _listener = logging.handlers.QueueListener(handler.queue, writer)
+    _listener.start()
+    return handler
+
+
+def shutdown_logging():     # writes out what is queued and detaches the handlers
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    logger = logging.getLogger(LOGGER)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,106 @@
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
+
+from smtp.smtp import SMTPClient, SMTPConnection
+
+log = logging.getLogger("bank.mail")
+
+
+def default_client():   # real SMTP when BANK_APP_SMTP_HOST is set, the placeholder client otherwise
+    if os.getenv("BANK_APP_SMTP_HOST"):
+        return SMTPConnection()
+    return SMTPClient()
+
+
+class MailQueue:
+    # Bounded queue of (subject, text, address) drained by a pool of worker threads.
+    # Each worker owns one client for its whole life, so an SMTPConnection is reused
+    # across messages. A failed send (False or an SMTP/socket error) is retried with
+    # exponential backoff; submit() returns a Future that resolves to the final result, False
+    # for a message that raised anything else.
+    def __init__(self, client_factory=default_client, workers=4, maxsize=1000, retries=3, backoff=0.1):
+        self.client_factory = client_factory
+        self.retries = retries
+        self.backoff = backoff
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._queue = queue.Queue(maxsize)     # submit() blocks while it is full
+        self._lock = threading.Lock()       # guards the counters
+        self._started = time.perf_counter()
+        self._workers = [threading.Thread(target=self._work, name=f"mail-{i}", daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, subject, text, email_address, attachments=()):
+        # attachments: (filename, open) pairs, open() returns a binary file and is called per attempt
+        future = Future()
+        self._queue.put((subject, text, email_address, attachments, future))
+        return future
+
+    def close(self):    # sends everything already queued, then stops the workers
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def rate(self):     # messages delivered per second since the queue started
+        return self.sent / (time.perf_counter() - self._started)
+
+    def _work(self):
+        # any other error, from the client factory or while rendering a message, fails that one
+        # message; the worker tries to make a client again for the next one
+        client = self._client()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            subject, text, email_address, attachments, future = item
+            try:
+                if client is None:
+                    client = self.client_factory()
+                delivered = self._deliver(client, subject, text, email_address, attachments)
+            except Exception:
+                log.exception("could not send a message")
+                delivered = False
+            with self._lock:
+                if delivered:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+            future.set_result(delivered)
+        if hasattr(client, "close"):
+            client.close()
+
+    def _client(self):
+        try:
+            return self.client_factory()
+        except Exception:
+            log.exception("could not create a mail client")
+            return None
+
+    def _deliver(self, client, subject, text, email_address, attachments):
+        args = (subject, text, email_address, attachments) if attachments else (subject, text, email_address)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self._lock:
+                    self.retried += 1
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                if client.send(*args):
+                    return True
+            except (smtplib.SMTPException, OSError) as error:
+                log.debug("send attempt %d failed: %s", attempt + 1, error)
+        log.warning("giving up on a message after %d attempts", self.retries + 1)
+        return False
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from itertools import repeat
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:     # pragma: no cover - optional, only AsyncNipVerifier (app/asgi.py) needs it
+    aiohttp = None
+
+log = logging.getLogger("bank.nip")
+
+ACTIVE = "Czynny"
+BATCH_LIMIT = 30    # NIPs per /api/search/nips request, the MF API maximum
+
+
+class NipVerifier:
+    # VAT status lookups against the MF whitelist API (BANK_APP_MF_URL) over one pooled session.
+    # The API answers for a given day, so results are cached per (nip, date) in a bounded LRU;
+    # "not registered" answers are cached too, for negative_ttl. Server errors and timeouts
+    # are never cached: 5xx/429 count as not registered for this call, network errors raise.
+    # statuses() checks many NIPs through the batch endpoint, several batches at a time.
+    def __init__(self, base_url=None, timeout=None, ttl=None, negative_ttl=None, max_entries=None,
+                 pool_size=None, clock=time.monotonic):
+        self.base_url = base_url
+        self.timeout = timeout if timeout is not None else float(os.getenv("BANK_APP_MF_TIMEOUT", "5"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("BANK_APP_MF_CACHE_TTL", "3600"))
+        self.negative_ttl = negative_ttl if negative_ttl is not None else float(os.getenv("BANK_APP_MF_NEGATIVE_TTL", "300"))
+        self.max_entries = max_entries or int(os.getenv("BANK_APP_MF_CACHE_SIZE", "10000"))
+        self.pool_size = pool_size or int(os.getenv("BANK_APP_MF_POOL_SIZE", "10"))   # connections and batch workers
+        self._clock = clock
+        self._cache = OrderedDict()     # (nip, day) -> (statusVat or None, expiry)
+        self._lock = threading.Lock()
+        self.session = self._open_session()
+
+    def _open_session(self):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def is_active(self, nip, day=None):
+        return self.status(nip, day) == ACTIVE
+
+    def status(self, nip, day=None):    # statusVat of nip on day (today by default), None when not registered
+        day = (day or date.today()).strftime('%Y-%m-%d')
+        with self._lock:
+            found, status = self._cached((nip, day))
+        if found:
+            return status
+
+        status, cacheable = self._fetch(nip, day)
+        if cacheable:
+            with self._lock:
+                self._store((nip, day), status)
+        return status
+
+    def statuses(self, nips, day=None):
+        # {nip: statusVat or None} for every nip that got an answer; uncached NIPs are looked up
+        # BATCH_LIMIT at a time with up to pool_size requests in flight, failed batches are left out
+        day, result, batches = self._batches(nips, day)
+        if not batches:
+            return result
+
+        with ThreadPoolExecutor(min(self.pool_size, len(batches))) as pool:
+            for answered in pool.map(self._fetch_batch, batches, repeat(day)):
+                self._store_batch(result, answered, day)
+        return result
+
+    def _batches(self, nips, day):     # (day string, cached answers, BATCH_LIMIT-sized lists of the rest)
+        day = (day or date.today()).strftime('%Y-%m-%d')
+        result, missing = {}, []
+        with self._lock:
+            for nip in dict.fromkeys(nips):
+                found, status = self._cached((nip, day))
+                if found:
+                    result[nip] = status
+                else:
+                    missing.append(nip)
+        return day, result, [missing[i:i + BATCH_LIMIT] for i in range(0, len(missing), BATCH_LIMIT)]
+
+    def _store_batch(self, result, answered, day):
+        result.update(answered)
+        with self._lock:
+            for nip, status in answered.items():
+                self._store((nip, day), status)
+
+    def _cached(self, key):     # (found, status), caller holds _lock
+        entry = self._cache.get(key)
+        if entry is None or entry[1] <= self._clock():
+            return False, None
+        self._cache.move_to_end(key)
+        return True, entry[0]
+
+    def _store(self, key, status):     # caller holds _lock
+        ttl = self.ttl if status is not None else self.negative_ttl
+        self._cache[key] = (status, self._clock() + ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _base(self):
+        return self.base_url or os.getenv('BANK_APP_MF_URL', 'https://wl-test.mf.gov.pl')
+
+    def _fetch(self, nip, day):     # (statusVat or None, whether the answer may be cached)
+        response = self.session.get(f"{self._base()}/api/search/nip/{nip}?date={day}", timeout=self.timeout)
+        return _subject_status(response.status_code, response.json() if response.status_code == 200 else None)
+
+    def _fetch_batch(self, nips, day):     # {nip: statusVat or None}, empty when the request failed
+        try:
+            response = self.session.get(f"{self._base()}/api/search/nips/{','.join(nips)}?date={day}", timeout=self.timeout)
+        except requests.RequestException as error:
+            log.warning("MF batch lookup of %d NIPs failed: %s", len(nips), error)
+            return {}
+        return _subject_statuses(nips, response.status_code, response.json() if response.status_code == 200 else None)
+
+
+class AsyncNipVerifier(NipVerifier):
+    # The same lookups and cache for asyncio code (app/asgi.py), over an aiohttp session: a
+    # request waiting on the MF API holds no thread. status(), is_active() and statuses() are
+    # coroutines; statuses() sends its batches concurrently, pool_size at a time. The session
+    # belongs to the event loop it is opened on, so it is opened on first use.
+    def _open_session(self):
+        return None
+
+    def _session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size), timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self.session
+
+    async def aclose(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def is_active(self, nip, day=None):
+        return await self.status(nip, day) == ACTIVE
+
+    async def status(self, nip, day=None):
+        day = (day or date.today()).strftime('%Y-%m-%d')
+        with self._lock:
+            found, status = self._cached((nip, day))
+        if found:
+            return status
+
+        async with self._session().get(f"{self._base()}/api/search/nip/{nip}?date={day}") as response:
+            body = await response.json(content_type=None) if response.status == 200 else None
+        status, cacheable = _subject_status(response.status, body)
+        if cacheable:
+            with self._lock:
+                self._store((nip, day), status)
+        return status
+
+    async def statuses(self, nips, day=None):
+        day, result, batches = self._batches(nips, day)
+        slots = asyncio.Semaphore(self.pool_size)
+
+        async def fetch(batch):
+            async with slots:
+                return await self._fetch_batch(batch, day)
+
+        for answered in await asyncio.gather(*map(fetch, batches)):
+            self._store_batch(result, answered, day)
+        return result
+
+    async def _fetch_batch(self, nips, day):
+        try:
+            async with self._session().get(f"{self._base()}/api/search/nips/{','.join(nips)}?date={day}") as response:
+                body = await response.json(content_type=None) if response.status == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            log.warning("MF batch lookup of %d NIPs failed: %r", len(nips), error)
+            return {}
+        return _subject_statuses(nips, response.status, body)
+
+
+def _subject_status(code, body):     # (statusVat or None, whether the answer may be cached) of a single lookup
+    if code >= 500 or code == 429:
+        return None, False
+    if code != 200:
+        return None, True
+    subject = (body.get("result") or {}).get("subject")
+    return (subject.get("statusVat") if subject else None), True
+
+
+def _subject_statuses(nips, code, body):     # {nip: statusVat or None} of a batch lookup, empty when it failed
+    if code != 200:
+        log.warning("MF batch lookup of %d NIPs answered %d", len(nips), code)
+        return {}
+    subjects = (body.get("result") or {}).get("subjects") or []
+    statuses = dict.fromkeys(nips)
+    statuses.update((subject.get("nip"), subject.get("statusVat")) for subject in subjects if subject.get("nip") in statuses)
+    return statuses
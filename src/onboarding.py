@@ -0,0 +1,41 @@
+from src.account import CompanyAccount, nip_verifier
+from src.nip_verifier import ACTIVE
+
+CREATED, INVALID_NIP, NOT_REGISTERED, EXISTS, UNAVAILABLE = "created", "invalid_nip", "not_registered", "exists", "unavailable"
+
+
+def valid_nip(nip):
+    return isinstance(nip, str) and len(nip) == 10 and nip.isdigit()
+
+
+def onboard_companies(registry, companies, verifier=None, day=None):
+    # (company_name, nip) pairs -> one result per pair, in input order. NIPs are verified
+    # through the batch MF endpoint and the accepted companies are added in one add_accounts.
+    companies = list(companies)
+    verifier = verifier or nip_verifier
+    return _add_verified(registry, companies, verifier.statuses([nip for _, nip in companies if valid_nip(nip)], day))
+
+
+async def onboard_companies_async(registry, companies, verifier, day=None):    # the same through an AsyncNipVerifier
+    companies = list(companies)
+    return _add_verified(registry, companies, await verifier.statuses([nip for _, nip in companies if valid_nip(nip)], day))
+
+
+def _add_verified(registry, companies, statuses):
+    results = [None] * len(companies)
+    accepted = []
+    for i, (name, nip) in enumerate(companies):
+        if not valid_nip(nip):
+            results[i] = INVALID_NIP
+        elif nip not in statuses:
+            results[i] = UNAVAILABLE
+        elif statuses[nip] != ACTIVE:
+            results[i] = NOT_REGISTERED
+        else:
+            accepted.append((i, CompanyAccount.restore(name, nip, 0.0, [])))
+
+    registry.add_accounts(account for _, account in accepted)
+    for i, account in accepted:
+        # add_accounts skips NIPs already in the registry, including repeats within this batch
+        results[i] = CREATED if registry.find_by_nip(account.nip_number) is account else EXISTS
+    return results
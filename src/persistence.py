@@ -0,0 +1,396 @@
+import logging
+import os
+import re
+import struct
+import threading
+import zlib
+from array import array
+from datetime import datetime, timezone
+
+from src.account import Account, CompanyAccount
+
+log = logging.getLogger("bank.persistence")
+
+# Local persistence for AccountRegistry: a segmented write-ahead log of registry
+# mutations plus periodic binary snapshots. Every record either sets absolute state
+# (PUT, DELETE, BALANCE, NAMES, CLEAR) or appends history at a known sequence number
+# (TRANSFERS), so replaying a log segment over a snapshot taken while it was being
+# written gives the same registry as replaying it over an exact one. A TRANSFERS record
+# also carries the types and time of its transfers, for the Mongo transaction log: what
+# is recovered counts as unsaved there, since the WAL cannot tell what was saved.
+
+PUT, DELETE, BALANCE, NAMES, TRANSFERS, CLEAR = range(1, 7)
+PERSONAL, COMPANY = 0, 1
+
+FRAME = struct.Struct("<II")        # payload length, crc32 of payload
+SNAPSHOT_MAGIC = b"BANKSNP1"
+NONE = 0xFFFF
+
+
+U8, U16, U32, U64, F64 = (struct.Struct(fmt) for fmt in ("<B", "<H", "<I", "<Q", "<d"))
+# PUT record: type, kind, key/first/second string lengths, balance, history offset, history length,
+# followed by the three strings and the history doubles, so decoding is one unpack plus slices
+ACCOUNT = struct.Struct("<BBHHHdQI")
+
+
+def _pack_str(value):
+    if value is None:
+        return U16.pack(NONE)
+    data = value.encode()
+    return U16.pack(len(data)) + data
+
+
+def _pack_floats(values):
+    data = array("d", values)
+    return U32.pack(len(data)) + data.tobytes()
+
+
+class _Reader:
+    def __init__(self, payload):
+        self.payload = payload
+        self.pos = 0
+
+    def unpack(self, fmt):
+        (value,) = fmt.unpack_from(self.payload, self.pos)
+        self.pos += fmt.size
+        return value
+
+    def str(self):
+        size = self.unpack(U16)
+        if size == NONE:
+            return None
+        value = str(self.payload[self.pos:self.pos + size], "utf-8")
+        self.pos += size
+        return value
+
+    def floats(self):
+        count = self.unpack(U32)
+        values = array("d")
+        values.frombytes(self.payload[self.pos:self.pos + 8 * count])
+        self.pos += 8 * count
+        return values
+
+
+def encode_account(account):
+    history = account.history
+    if isinstance(account, CompanyAccount):
+        kind, key, first, second = COMPANY, account.nip_number, account.company_name, None
+    else:
+        kind, key, first, second = PERSONAL, account.pesel, account.first_name, account.last_name
+    strings = [None if value is None else value.encode() for value in (key, first, second)]
+    sizes = [NONE if data is None else len(data) for data in strings]
+    return (ACCOUNT.pack(PUT, kind, *sizes, account.balance, history.offset, len(history))
+            + b"".join(data for data in strings if data) + history.tobytes())
+
+
+def decode_account(payload):
+    _, kind, *sizes, balance, offset, count = ACCOUNT.unpack_from(payload)
+    pos = ACCOUNT.size
+    strings = []
+    for size in sizes:
+        if size == NONE:
+            strings.append(None)
+        else:
+            strings.append(str(payload[pos:pos + size], "utf-8"))
+            pos += size
+    key, first, second = strings
+    history = array("d")
+    history.frombytes(payload[pos:pos + 8 * count])
+    if kind == COMPANY:
+        return CompanyAccount.restore(first, key, balance, history, offset)
+    return Account.restore(first, second, key, balance, history, offset)
+
+
+def frame(payload):
+    return FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_frames(data):
+    # yields (payload, end offset) for every intact record, stops at a torn or corrupt tail
+    pos = 0
+    view = memoryview(data)
+    while pos + FRAME.size <= len(data):
+        size, crc = FRAME.unpack_from(data, pos)
+        end = pos + FRAME.size + size
+        if end > len(data):
+            return
+        payload = view[pos + FRAME.size:end]
+        if zlib.crc32(payload) != crc:
+            return
+        yield payload, end
+        pos = end
+
+
+class WriteAheadLog:
+    # Appends only go to an in-memory buffer, so they cost nothing under the registry's locks.
+    # flush() writes and fsyncs everything buffered so far in one go, and wait() blocks until a
+    # flush has covered every record appended before the call: the writers waiting together are
+    # acknowledged by one fsync (group commit). A failed write is not retried - the kernel may
+    # have dropped the pages - every later wait raises instead.
+    def __init__(self, path):
+        self._buffer = bytearray()
+        self._appended = 0      # records appended
+        self._synced = 0        # records on disk
+        self._error = None
+        self._lock = threading.Lock()       # guards the above
+        self._buffered = threading.Condition(self._lock)    # notified by append
+        self._flushed = threading.Condition(self._lock)     # notified by every flush
+        self._io_lock = threading.Lock()    # serialises write + fsync and segment switches
+        self._file = open(path, "ab")
+
+    def append(self, payload):
+        with self._lock:
+            self._buffer += frame(payload)
+            self._appended += 1
+            self._buffered.notify()
+
+    def wait_for_records(self, timeout):    # whether records are buffered, after waiting up to timeout for one
+        with self._lock:
+            return self._buffered.wait_for(lambda: self._buffer, timeout)
+
+    def wait(self):
+        with self._lock:
+            appended = self._appended
+            while self._synced < appended:
+                if self._error is not None:
+                    raise OSError("write-ahead log flush failed") from self._error
+                self._flushed.wait()
+
+    def flush(self):
+        with self._io_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if self._error is not None:
+                raise OSError("write-ahead log flush failed") from self._error
+            data, self._buffer = self._buffer, bytearray()
+            appended = self._appended
+        try:
+            if data:
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        except BaseException as e:
+            self.fail(e)
+            raise
+        with self._lock:
+            self._synced = appended
+            self._flushed.notify_all()
+
+    def fail(self, error):     # nothing logged from now on is acknowledged: waiters raise error
+        with self._lock:
+            if self._error is None:
+                self._error = error
+            self._flushed.notify_all()
+
+    def switch(self, path):
+        with self._io_lock:
+            self._flush()
+            self._file.close()
+            self._file = open(path, "ab")
+
+    def close(self):
+        with self._io_lock:
+            try:
+                self._flush()
+            finally:
+                self._file.close()
+
+
+class PersistenceEngine:
+    SEGMENT = re.compile(r"(wal|snapshot)-(\d{8})\.(log|bin)$")
+    PAGE = 10000
+
+    def __init__(self, directory, sync_interval=0.01, snapshot_every=1_000_000):
+        self.directory = directory
+        self.sync_interval = sync_interval      # seconds between flushes, 0 to flush as soon as records arrive
+        self.snapshot_every = snapshot_every    # WAL records between automatic snapshots
+        self.registry = None
+        self._wal = None
+        self._segment = 1
+        self._records = 0
+        self._snapshot_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._snapshot_due = threading.Event()
+        self._flusher = None
+        self._snapshotter = None
+
+    def _path(self, kind, segment):
+        ext = "log" if kind == "wal" else "bin"
+        return os.path.join(self.directory, f"{kind}-{segment:08d}.{ext}")
+
+    def _segments(self, kind):
+        found = []
+        for name in os.listdir(self.directory):
+            match = self.SEGMENT.match(name)
+            if match and match.group(1) == kind:
+                found.append(int(match.group(2)))
+        return sorted(found)
+
+    def open(self, registry):   # recovers registry from disk, then logs its mutations
+        os.makedirs(self.directory, exist_ok=True)
+        self.registry = registry
+        self._recover()
+        self._wal = WriteAheadLog(self._path("wal", self._segment))
+        registry.subscribe(self)
+        self._flusher = threading.Thread(target=self._flush_loop, name="wal-flusher", daemon=True)
+        self._flusher.start()
+        self._snapshotter = threading.Thread(target=self._snapshot_loop, name="wal-snapshot", daemon=True)
+        self._snapshotter.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        self._snapshot_due.set()
+        self._flusher.join()
+        self._snapshotter.join()
+        self.registry.unsubscribe(self)
+        self._wal.close()
+
+    def _flush_loop(self):
+        # with sync_interval 0 a flush starts once a record is buffered, covering whatever else
+        # arrived during the previous one. Snapshots are left to their own thread so flushes go
+        # on while one is written. If the flusher dies, the WAL fails too: waiters raise, not hang.
+        try:
+            while not self._stop.is_set():
+                if self.sync_interval:
+                    if self._stop.wait(self.sync_interval):
+                        return
+                elif not self._wal.wait_for_records(0.1):
+                    continue
+                self._wal.flush()
+                if self._records >= self.snapshot_every:
+                    self._snapshot_due.set()
+        except BaseException as e:
+            log.exception("WAL flusher stopped")
+            self._wal.fail(e)
+
+    def _snapshot_loop(self):
+        # a failed snapshot loses nothing: the WAL segments it would have replaced are kept
+        while True:
+            self._snapshot_due.wait()
+            self._snapshot_due.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.snapshot()
+            except Exception:
+                log.exception("Snapshot failed, the WAL is kept until the next one")
+
+    def flush(self):
+        self._wal.flush()
+
+    def wait(self):
+        # blocks until every record logged before the call is on disk, flushed by the flusher
+        # thread; writers call it to acknowledge a change, outside the registry's locks
+        self._wal.wait()
+
+    # registry listener
+
+    def _log(self, payload):
+        self._records += 1
+        self._wal.append(payload)
+
+    def on_put(self, account):
+        self._log(encode_account(account))
+
+    def on_delete(self, key):
+        self._log(U8.pack(DELETE) + _pack_str(key))
+
+    def on_balance(self, account):
+        self._log(U8.pack(BALANCE) + _pack_str(self.registry.key(account)) + F64.pack(account.balance))
+
+    def on_names(self, account):
+        self._log(U8.pack(NAMES) + _pack_str(self.registry.key(account))
+                  + _pack_str(account.first_name) + _pack_str(account.last_name))
+
+    def on_transfers(self, account, seq, amounts, kinds, timestamp):
+        self._log(U8.pack(TRANSFERS) + _pack_str(self.registry.key(account)) + U64.pack(seq)
+                  + _pack_floats(amounts) + F64.pack(timestamp.timestamp()) + _pack_str(" ".join(kinds)))
+
+    def on_clear(self):
+        self._log(U8.pack(CLEAR))
+
+    # snapshots and recovery
+
+    def snapshot(self):
+        with self._snapshot_lock:
+            segment = self._segment + 1
+            self._wal.switch(self._path("wal", segment))
+            self._segment = segment
+            self._records = 0
+
+            path = self._path("snapshot", segment)
+            with open(path + ".tmp", "wb") as f:
+                f.write(SNAPSHOT_MAGIC)
+                after = None
+                while True:
+                    page = self.registry.page(after, self.PAGE)
+                    f.write(b"".join(frame(encode_account(account)) for account in page))
+                    if len(page) < self.PAGE:
+                        break
+                    after = self.registry.key(page[-1])
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+
+            for old in self._segments("wal"):
+                if old < segment:
+                    os.remove(self._path("wal", old))
+            for old in self._segments("snapshot"):
+                if old < segment:
+                    os.remove(self._path("snapshot", old))
+
+    def _recover(self):
+        snapshots = self._segments("snapshot")
+        start = snapshots[-1] if snapshots else 0
+        if start:
+            with open(self._path("snapshot", start), "rb") as f:
+                data = f.read()
+            if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError(f"not a registry snapshot: {self._path('snapshot', start)}")
+            body = data[len(SNAPSHOT_MAGIC):]
+            accounts = [decode_account(payload) for payload, _ in read_frames(body)]
+            self.registry.clear()
+            self.registry.add_accounts(accounts)
+
+        segments = [segment for segment in self._segments("wal") if segment >= start]
+        for segment in segments:
+            path = self._path("wal", segment)
+            with open(path, "rb") as f:
+                data = f.read()
+            valid = 0
+            for payload, valid in read_frames(data):
+                self._replay(payload)
+            if valid < len(data):   # torn tail from a crash mid-write
+                with open(path, "r+b") as f:
+                    f.truncate(valid)
+        self._segment = max(segments + [start, 1])
+        self.registry.history_unsaved()
+
+    def _replay(self, payload):
+        record = payload[0]
+        registry = self.registry
+        if record == CLEAR:
+            registry.clear()
+            return
+        if record == PUT:
+            registry.replace_account(decode_account(payload))
+            return
+
+        reader = _Reader(payload)
+        reader.pos = 1
+        key = reader.str()
+        account = registry.find_by_pesel(key)
+        if record == DELETE or account is None:
+            registry.delete_account(key)
+        elif record == BALANCE:
+            account.balance = reader.unpack(F64)
+        elif record == NAMES:
+            account.first_name, account.last_name = reader.str(), reader.str()
+        elif record == TRANSFERS:
+            seq = reader.unpack(U64)
+            amounts = reader.floats()
+            timestamp = datetime.fromtimestamp(reader.unpack(F64), timezone.utc)
+            registry.replay_transfers(account, seq, amounts, reader.str().split(" "), timestamp)
@@ -0,0 +1,57 @@
+import json
+import os
+
+from src.account import CompanyAccount
+
+try:
+    import orjson
+except ImportError:     # pragma: no cover - optional, stdlib json is used without it
+    orjson = None
+
+
+def account_data(account):
+    if isinstance(account, CompanyAccount):
+        return {"company_name": account.company_name, "nip_number": account.nip_number, "balance": account.balance}
+    return {"first_name": account.first_name, "last_name": account.last_name, "pesel": account.pesel, "balance": account.balance}
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, default=str)
+
+
+_encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=str)    # json.dumps would build one per call
+
+
+def _json_dumps(obj):
+    return _encoder.encode(obj).encode()
+
+
+BACKENDS = {"orjson": _orjson_dumps, "json": _json_dumps}
+
+
+class Serializer:
+    # JSON to bytes with orjson when it is installed, stdlib json otherwise; BANK_APP_JSON
+    # (orjson|json) picks one. Accounts are encoded once per version and the bytes kept on
+    # the account (Account._json), so a listing only joins ready fragments.
+    def __init__(self, backend=None):
+        backend = backend or os.getenv("BANK_APP_JSON") or ("orjson" if orjson is not None else "json")
+        if backend not in BACKENDS or (backend == "orjson" and orjson is None):
+            raise ValueError(f"Unknown or unavailable JSON backend: {backend}")
+        self.backend = backend
+        self.dumps = BACKENDS[backend]
+
+    def account(self, account):
+        version = account._version      # read first: a change during encoding leaves the entry outdated
+        cached = account._json
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        fragment = self.dumps(account_data(account))
+        account._json = (version, fragment)
+        return fragment
+
+    def accounts(self, accounts):   # a JSON array of accounts
+        return b"[" + b",".join(map(self.account, accounts)) + b"]"
+
+    def ndjson(self, accounts):     # one line per account, for streaming
+        for account in accounts:
+            yield self.account(account) + b"\n"
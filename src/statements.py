@@ -0,0 +1,134 @@
+import csv
+import io
+import tempfile
+from datetime import datetime, time, timezone
+
+CHUNK = 1000            # entries rendered per chunk
+SPOOL_SIZE = 1 << 20    # CSV attachments above this many bytes spill to a temporary file
+CSV_FIELDS = ("seq", "timestamp", "type", "amount")
+
+
+def transfer_type(amount):      # the log's type for a transfer known only by its amount
+    return "incoming" if amount > 0 else "outgoing"
+
+
+def history_entries(history):
+    # in-memory History as log entries, oldest first; it holds amounts only, so the
+    # type comes from the sign and there is no timestamp
+    for start in range(0, len(history), CHUNK):
+        for seq, amount in enumerate(history[start:start + CHUNK].tolist(), history.offset + start):
+            yield {"seq": seq, "amount": amount, "type": transfer_type(amount), "timestamp": None}
+
+
+def _utc(value):     # dates are midnight UTC, naive datetimes (as pymongo returns them) are UTC
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time())
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+class StatementSummary:
+    def __init__(self):
+        self.count = 0
+        self.credits = 0.0
+        self.debits = 0.0
+        self.by_type = {}       # type -> [count, total]
+        self.first_seq = None
+        self.last_seq = None
+
+    @property
+    def net(self):
+        return self.credits + self.debits
+
+    def add(self, entry):
+        amount = entry["amount"]
+        self.count += 1
+        if amount > 0:
+            self.credits += amount
+        else:
+            self.debits += amount
+        totals = self.by_type.setdefault(entry["type"], [0, 0.0])
+        totals[0] += 1
+        totals[1] += amount
+        if self.first_seq is None:
+            self.first_seq = entry["seq"]
+        self.last_seq = entry["seq"]
+
+    def lines(self):
+        lines = [
+            f"Transfers: {self.count}",
+            f"Credits: {self.credits:.2f}",
+            f"Debits: {self.debits:.2f}",
+            f"Net: {self.net:.2f}",
+        ]
+        lines += [f"  {kind}: {count} totalling {total:.2f}" for kind, (count, total) in sorted(self.by_type.items())]
+        return lines
+
+
+class Statement:
+    # One pass over log entries (dicts with seq, amount, type, timestamp, oldest first),
+    # restricted to [start, end) when a window is given; undated entries only appear in
+    # statements without one. Every rendering fills self.summary as it goes, so the
+    # totals are ready once the output has been consumed.
+    def __init__(self, entries, start=None, end=None):
+        self._entries = entries
+        self.start = _utc(start)
+        self.end = _utc(end)
+        self.summary = StatementSummary()
+
+    def entries(self):
+        windowed = self.start is not None or self.end is not None
+        for entry in self._entries:
+            if windowed:
+                timestamp = _utc(entry.get("timestamp"))
+                if timestamp is None or (self.start and timestamp < self.start) or (self.end and timestamp >= self.end):
+                    continue
+            self.summary.add(entry)
+            yield entry
+
+    def _chunks(self, chunk):
+        batch = []
+        for entry in self.entries():
+            batch.append(entry)
+            if len(batch) == chunk:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def summarize(self):
+        for _ in self.entries():
+            pass
+        return self.summary
+
+    def text_chunks(self, chunk=CHUNK):     # one line per transfer, then the summary
+        for batch in self._chunks(chunk):
+            yield "".join(
+                f"{entry['seq']:>8}  {_format_time(entry.get('timestamp')):<25}  {entry['type']:<9}  {entry['amount']:>12.2f}\n"
+                for entry in batch
+            )
+        yield "\n" + "\n".join(self.summary.lines()) + "\n"
+
+    def csv_chunks(self, chunk=CHUNK):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_FIELDS)
+        for batch in self._chunks(chunk):
+            writer.writerows((entry["seq"], _format_time(entry.get("timestamp")), entry["type"], entry["amount"]) for entry in batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def csv_file(self):     # the CSV as a rewound binary file, on disk once it outgrows SPOOL_SIZE
+        file = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        for chunk in self.csv_chunks():
+            file.write(chunk.encode())
+        file.seek(0)
+        return file
+
+
+def _format_time(timestamp):
+    return _utc(timestamp).isoformat() if timestamp is not None else ""
@@ -1,3 +1,7 @@
+import json
+import time
+import uuid
+
 import pytest
 import requests
 
@@ -10,6 +14,10 @@ def mongo_repo(mocker):
     mock_collection = mocker.Mock()
     repo = MongoAccountsRepository()
     repo.collection = mock_collection
+    repo.companies = mocker.Mock()
+    repo.companies.find.return_value = []
+    repo.companies.estimated_document_count.return_value = 0
+    repo.transactions = mocker.Mock()
     return repo, mock_collection
 
 
@@ -189,6 +197,19 @@ def test_transfer_unknown_type():
     assert res.json() == {"error": "Unknown transfer type"}
 
 
+@pytest.mark.parametrize("amount", [None, "100", True, float("nan"), float("inf")])
+def test_transfer_invalid_amount(amount):
+    pesel = "88010145619"
+    requests.post(f"{r}/api/accounts", json={"first_name": "Jan", "last_name": "Nan", "pesel": pesel})
+    body = json.dumps({"amount": amount, "type": "incoming"})    # NaN and Infinity, which requests' json= refuses
+    res = requests.post(f"{r}/api/accounts/{pesel}/transfer", data=body, headers={"Content-Type": "application/json"})
+    assert res.status_code == 400
+    assert res.json() == {"error": "Invalid amount"}
+    assert requests.get(f"{r}/api/accounts/{pesel}").json()["balance"] == 0.0
+    listed = requests.get(f"{r}/api/accounts", params={"min_balance": 0, "max_balance": 0}).json()
+    assert pesel in [account["pesel"] for account in listed]
+
+
 def test_transfer_incoming_success():
     pesel = f"88010195618"
     account_data = {
@@ -282,33 +303,340 @@ def test_transfer_express_success():
     assert res_get.status_code == 200
     assert res_get.json()["balance"] == 750.0
 
+    res = requests.get(f"{r}/api/accounts/{pesel}/statement")
+    assert res.text.splitlines()[-1] == "  express_in: 1 totalling 750.00"
+
+
+def test_get_accounts_filtered_by_last_name():
+    pesel = "77010112345"
+    res = requests.post(f"{r}/api/accounts", json={"first_name": "Lars", "last_name": "Ulrich", "pesel": pesel})
+    assert res.status_code == 201
+
+    res_get = requests.get(f"{r}/api/accounts", params={"last_name": "Ulrich"})
+    assert res_get.status_code == 200
+    assert [acc["pesel"] for acc in res_get.json()] == [pesel]
+
+
+def test_get_accounts_filtered_by_balance():
+    pesel = "77010112346"
+    res = requests.post(f"{r}/api/accounts", json={"first_name": "Kirk", "last_name": "Hammett", "pesel": pesel})
+    assert res.status_code == 201
+    requests.post(f"{r}/api/accounts/{pesel}/transfer", json={"amount": 123456, "type": "incoming"})
+
+    res_get = requests.get(f"{r}/api/accounts", params={"min_balance": 123456, "max_balance": 123456})
+    assert res_get.status_code == 200
+    assert [acc["pesel"] for acc in res_get.json()] == [pesel]
+
+
+def test_get_accounts_invalid_balance_filter():
+    res_get = requests.get(f"{r}/api/accounts", params={"min_balance": "abc"})
+    assert res_get.status_code == 400
+    assert res_get.json() == {"error": "Invalid balance filter"}
+
+
+def test_get_accounts_paginated():
+    pesels = [f"6601011234{i}" for i in range(3)]
+    for pesel in pesels:
+        requests.post(f"{r}/api/accounts", json={"first_name": "Page", "last_name": "Test", "pesel": pesel})
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2, "last_name": "Test"}
+        if cursor is not None:
+            params["cursor"] = cursor
+        res = requests.get(f"{r}/api/accounts", params=params)
+        assert res.status_code == 200
+        body = res.json()
+        seen += [acc["pesel"] for acc in body["accounts"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert [p for p in seen if p in pesels] == pesels
+    assert seen == sorted(seen)
+
+
+def test_get_accounts_pages_cover_registry():
+    res_all = requests.get(f"{r}/api/accounts")
+    assert res_all.status_code == 200
+
+    seen = []
+    res = requests.get(f"{r}/api/accounts", params={"limit": 3})
+    while True:
+        body = res.json()
+        seen += [acc["pesel"] for acc in body["accounts"]]
+        if body["next_cursor"] is None:
+            break
+        res = requests.get(f"{r}/api/accounts", params={"limit": 3, "cursor": body["next_cursor"]})
+
+    assert seen == sorted(acc["pesel"] for acc in res_all.json())
+
+
+def test_get_accounts_invalid_paging():
+    assert requests.get(f"{r}/api/accounts", params={"limit": 0}).status_code == 400
+    assert requests.get(f"{r}/api/accounts", params={"limit": "abc"}).json() == {"error": "Invalid limit"}
+    assert requests.get(f"{r}/api/accounts", params={"cursor": "%%%"}).json() == {"error": "Invalid cursor"}
+
+
+def test_get_accounts_ndjson():
+    res_all = requests.get(f"{r}/api/accounts")
+    res = requests.get(f"{r}/api/accounts", params={"format": "ndjson"})
+    assert res.status_code == 200
+    assert res.headers["Content-Type"].startswith("application/x-ndjson")
+
+    rows = [json.loads(line) for line in res.text.splitlines()]
+    assert sorted(row["pesel"] for row in rows) == sorted(acc["pesel"] for acc in res_all.json())
+
+
+def test_batch_transfer_statuses():
+    pesel = "77010112347"
+    res = requests.post(f"{r}/api/accounts", json={"first_name": "Cliff", "last_name": "Burton", "pesel": pesel})
+    assert res.status_code == 201
+
+    batch = [
+        {"pesel": pesel, "amount": 100, "type": "incoming"},
+        {"pesel": pesel, "amount": 500, "type": "outgoing"},
+        {"pesel": pesel, "amount": 40, "type": "outgoing"},
+        {"pesel": pesel, "amount": 40, "type": "unknown_type"},
+        {"pesel": "99999999999", "amount": 40, "type": "incoming"},
+    ]
+    res = requests.post(f"{r}/api/transfers/batch", json=batch)
+    assert res.status_code == 200
+
+    statuses = [json.loads(line)["status"] for line in res.text.splitlines()]
+    assert statuses == [200, 422, 200, 400, 404]
+    assert requests.get(f"{r}/api/accounts/{pesel}").json()["balance"] == 60.0
+
+
+def test_batch_transfer_ndjson():
+    pesel = "77010112348"
+    res = requests.post(f"{r}/api/accounts", json={"first_name": "Jason", "last_name": "Newsted", "pesel": pesel})
+    assert res.status_code == 201
+
+    body = "\n".join(json.dumps({"pesel": pesel, "amount": 10, "type": "incoming"}) for _ in range(50))
+    body += "\nnot json\n"
+    res = requests.post(f"{r}/api/transfers/batch", data=body, headers={"Content-Type": "application/x-ndjson"})
+    assert res.status_code == 200
+
+    statuses = [json.loads(line)["status"] for line in res.text.splitlines()]
+    assert statuses == [200] * 50 + [400]
+    assert requests.get(f"{r}/api/accounts/{pesel}").json()["balance"] == 500.0
+
+
+def test_batch_transfer_bad_items_do_not_end_the_stream():
+    pesel = "77010112349"
+    res = requests.post(f"{r}/api/accounts", json={"first_name": "Ron", "last_name": "McGovney", "pesel": pesel})
+    assert res.status_code == 201
+
+    batch = [
+        {"pesel": pesel, "type": "incoming"},
+        {"pesel": pesel, "amount": None, "type": "outgoing"},
+        {"pesel": pesel, "amount": "10", "type": "express"},
+        {"pesel": [pesel], "amount": 10, "type": "incoming"},
+        {"pesel": pesel, "amount": 10, "type": "incoming"},
+    ]
+    res = requests.post(f"{r}/api/transfers/batch", json=batch)
+    assert res.status_code == 200
+
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert [line["status"] for line in lines] == [400, 400, 400, 400, 200]
+    assert lines[0] == {"status": 400, "error": "Invalid amount"}
+    assert requests.get(f"{r}/api/accounts/{pesel}").json()["balance"] == 10.0
+
+
+def test_batch_transfer_requires_list():
+    res = requests.post(f"{r}/api/transfers/batch", json={"pesel": "77010112348"})
+    assert res.status_code == 400
+    assert res.json() == {"error": "Expected a list of transfers"}
+
+
+def test_batch_companies_rejects_invalid_entries():
+    # only NIPs that fail local validation, so the MF registry is never called
+    res = requests.post(f"{r}/api/companies/batch", json=[
+        {"company_name": "Krótki NIP", "nip": "123"},
+        {"nip": "1234567890"},
+        "not a company",
+    ])
+    assert res.status_code == 200
+    assert res.headers["Content-Type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in res.text.splitlines()] == [
+        {"status": 400, "error": "Invalid NIP"},
+        {"status": 400, "error": "Invalid company"},
+        {"status": 400, "error": "Invalid company"},
+    ]
+
+
+def test_batch_companies_ndjson_and_errors():
+    body = json.dumps({"company_name": "Litery", "nip": "12345abcde"}) + "\nnot json\n"
+    res = requests.post(f"{r}/api/companies/batch", data=body, headers={"Content-Type": "application/x-ndjson"})
+    assert [json.loads(line)["status"] for line in res.text.splitlines()] == [400, 400]
+    res = requests.post(f"{r}/api/companies/batch", json={"nip": "1234567890"})
+    assert res.status_code == 400
+    assert res.json() == {"error": "Expected a list of companies"}
+
+
+def test_statement_streams_text_and_csv():
+    pesel = "66010112346"
+    requests.post(f"{r}/api/accounts", json={"first_name": "Cliff", "last_name": "Burton", "pesel": pesel})
+    for amount, kind in ((300, "incoming"), (100, "outgoing")):
+        requests.post(f"{r}/api/accounts/{pesel}/transfer", json={"amount": amount, "type": kind})
+
+    res = requests.get(f"{r}/api/accounts/{pesel}/statement")
+    assert res.status_code == 200
+    assert res.headers["Content-Type"].startswith("text/plain")
+    assert "Transfers: 2\nCredits: 300.00\nDebits: -100.00\nNet: 200.00\n" in res.text
+
+    res = requests.get(f"{r}/api/accounts/{pesel}/statement", params={"format": "csv"})
+    assert res.headers["Content-Disposition"] == f'attachment; filename="statement-{pesel}.csv"'
+    rows = [row.split(",") for row in res.text.splitlines()]
+    assert rows[0] == ["seq", "timestamp", "type", "amount"]
+    assert [(seq, kind, amount) for seq, _, kind, amount in rows[1:]] == [("0", "incoming", "300.0"), ("1", "outgoing", "-100.0")]
+    assert all(timestamp for _, timestamp, _, _ in rows[1:])     # not saved yet: the time comes from the journal
+
+
+def test_statement_errors():
+    assert requests.get(f"{r}/api/accounts/00000000000/statement").status_code == 404
+    pesel = "66010112346"
+    requests.post(f"{r}/api/accounts", json={"first_name": "Cliff", "last_name": "Burton", "pesel": pesel})
+    res = requests.get(f"{r}/api/accounts/{pesel}/statement", params={"format": "pdf"})
+    assert res.status_code == 400
+    res = requests.get(f"{r}/api/accounts/{pesel}/statement", params={"from": "yesterday"})
+    assert res.json() == {"error": "from and to must be ISO dates"}
+
+
+def test_statement_window_reads_the_database_log():
+    pesel = "66010112347"
+    requests.post(f"{r}/api/accounts", json={"first_name": "Cliff", "last_name": "Burton", "pesel": pesel})
+    requests.post(f"{r}/api/accounts/{pesel}/transfer", json={"amount": 40, "type": "incoming"})
+    requests.post(f"{r}/api/accounts/save")
+    res = requests.get(f"{r}/api/accounts/{pesel}/statement", params={"format": "csv", "from": "2000-01-01"})
+    rows = res.text.splitlines()
+    assert rows[0] == "seq,timestamp,type,amount"
+    assert rows[-1].startswith("0,") and rows[-1].endswith(",incoming,40.0")
+
+
+def test_account_etag_and_304():
+    pesel = "55010112349"
+    requests.post(f"{r}/api/accounts", json={"first_name": "Kirk", "last_name": "Hammett", "pesel": pesel})
+    res = requests.get(f"{r}/api/accounts/{pesel}")
+    etag = res.headers["ETag"]
+    res = requests.get(f"{r}/api/accounts/{pesel}", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+    assert res.headers["ETag"] == etag
+
+    requests.post(f"{r}/api/accounts/{pesel}/transfer", json={"amount": 15, "type": "incoming"})
+    res = requests.get(f"{r}/api/accounts/{pesel}", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.json()["balance"] == 15.0
+    assert res.headers["ETag"] != etag
+
+    etag = res.headers["ETag"]
+    requests.patch(f"{r}/api/accounts/{pesel}", json={"first_name": "Kirk Lee"})
+    assert requests.get(f"{r}/api/accounts/{pesel}", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_count_and_listing_etags_follow_the_registry():
+    pesel = "55010112350"
+    count = requests.get(f"{r}/api/accounts/count")
+    listing = requests.get(f"{r}/api/accounts", params={"limit": 5})
+    for res, path, params in ((count, "/api/accounts/count", None), (listing, "/api/accounts", {"limit": 5})):
+        assert requests.get(f"{r}{path}", params=params, headers={"If-None-Match": res.headers["ETag"]}).status_code == 304
+
+    requests.post(f"{r}/api/accounts", json={"first_name": "Lars", "last_name": "Ulrich", "pesel": pesel})
+    res = requests.get(f"{r}/api/accounts/count", headers={"If-None-Match": count.headers["ETag"]})
+    assert res.status_code == 200
+    assert res.json()["count"] == count.json()["count"] + 1
+    requests.delete(f"{r}/api/accounts/{pesel}")
+    res = requests.get(f"{r}/api/accounts", params={"limit": 5}, headers={"If-None-Match": listing.headers["ETag"]})
+    assert res.status_code == 200
+
+
+def test_transfer_idempotency_key_applies_once():
+    pesel = "55010112351"
+    key = str(uuid.uuid4())
+    requests.post(f"{r}/api/accounts", json={"first_name": "Cliff", "last_name": "Lee", "pesel": pesel})
+    transfer = {"amount": 25, "type": "incoming"}
+    first = requests.post(f"{r}/api/accounts/{pesel}/transfer", json=transfer, headers={"Idempotency-Key": key})
+    retry = requests.post(f"{r}/api/accounts/{pesel}/transfer", json=transfer, headers={"Idempotency-Key": key})
+    assert first.status_code == retry.status_code == 200
+    assert first.json() == retry.json() == {"message": "Incoming transfer received"}
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert requests.get(f"{r}/api/accounts/{pesel}").json()["balance"] == 25.0
+
+    res = requests.post(f"{r}/api/accounts/{pesel}/transfer", json={"amount": 30, "type": "incoming"}, headers={"Idempotency-Key": key})
+    assert res.status_code == 422
+    res = requests.post(f"{r}/api/accounts/{pesel}/transfer", json=transfer, headers={"Idempotency-Key": "x" * 256})
+    assert res.status_code == 400
+    assert requests.get(f"{r}/api/accounts/{pesel}").json()["balance"] == 25.0
+
+
+def test_batch_transfer_idempotency_keys():
+    pesel = "55010112352"
+    requests.post(f"{r}/api/accounts", json={"first_name": "Dave", "last_name": "Mustaine", "pesel": pesel})
+    batch = [{"pesel": pesel, "amount": 10, "type": "incoming", "idempotency_key": str(uuid.uuid4())} for _ in range(3)]
+    for _ in range(2):
+        res = requests.post(f"{r}/api/transfers/batch", json=batch)
+        assert [json.loads(line)["status"] for line in res.text.splitlines()] == [200] * 3
+    assert requests.get(f"{r}/api/accounts/{pesel}").json()["balance"] == 30.0
+
+
+def test_registry_image_needs_a_path():
+    res = requests.post(f"{r}/api/accounts/image")
+    assert res.status_code == 400
+    assert res.json() == {"error": "BANK_APP_REGISTRY_IMAGE is not set"}
+
 
 # TESTY DO MONGO
+def wait_for_job(response):
+    assert response.status_code == 202
+    job = response.json()["job"]
+    assert response.headers["Location"] == f"/api/jobs/{job['id']}"
+    for _ in range(200):
+        job = requests.get(f"{r}/api/jobs/{job['id']}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job['id']} still {job['status']}")
+
+
+def test_unknown_job():
+    res = requests.get(f"{r}/api/jobs/not-a-job")
+    assert res.status_code == 404
+    assert res.json() == {"error": "No job with this id found"}
+    assert isinstance(requests.get(f"{r}/api/jobs").json()["jobs"], list)
+
+
 def test_save_accounts_to_database():
     requests.post(f"{r}/api/accounts", json={"first_name": "Walter", "last_name": "White", "pesel": "11122233344"})
     requests.post(f"{r}/api/accounts", json={"first_name": "Saul", "last_name": "Goodman", "pesel": "55566677788"})
 
-    response = requests.post(f"{r}/api/accounts/save")
-    assert response.status_code == 200
+    job = wait_for_job(requests.post(f"{r}/api/accounts/save"))
+    assert job["status"] == "done"
+    assert job["type"] == "save"
+    assert job["done"] == job["total"]
+    assert any(j["id"] == job["id"] for j in requests.get(f"{r}/api/jobs").json()["jobs"])
 
 
 def test_load_accounts_from_database():
     requests.post(f"{r}/api/accounts", json={"first_name": "Jesse", "last_name": "Pinkman", "pesel": "99988877766"})
 
-    requests.post(f"{r}/api/accounts/save")
+    assert wait_for_job(requests.post(f"{r}/api/accounts/save"))["status"] == "done"
 
     requests.delete(f"{r}/api/accounts/99988877766")
 
-    response = requests.post(f"{r}/api/accounts/load")
-    assert response.status_code == 200
+    job = wait_for_job(requests.post(f"{r}/api/accounts/load"))
+    assert job["status"] == "done"
+    assert job["result"]["loaded"] >= 1
 
     res_get = requests.get(f"{r}/api/accounts/99988877766")
     assert res_get.status_code == 200
     assert res_get.json()["pesel"] == "99988877766"
 
 
-
-def test_save_all_clears_collection_and_inserts_accounts(mongo_repo):
+def test_save_all_upserts_accounts(mongo_repo):
     repo, mock_collection = mongo_repo
 
     registry = AccountRegistry()
@@ -319,10 +647,9 @@ def test_save_all_clears_collection_and_inserts_accounts(mongo_repo):
 
     repo.save_all(registry)
 
-    mock_collection.delete_many.assert_called_once_with({})
-    mock_collection.insert_many.assert_called_once()
+    mock_collection.delete_many.assert_not_called()
+    mock_collection.bulk_write.assert_called_once()
 
-    inserted = mock_collection.insert_many.call_args[0][0]
-    assert len(inserted) == 2
-    assert inserted[0]["pesel"] == "12345678901"
-    assert inserted[1]["pesel"] == "98765432109"
+    operations = mock_collection.bulk_write.call_args[0][0]
+    assert len(operations) == 2
+    assert sorted(op._filter["pesel"] for op in operations) == ["12345678901", "98765432109"]
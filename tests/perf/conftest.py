@@ -0,0 +1,65 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import requests
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def mongo_collection():
+    try:
+        client = MongoClient("mongodb://localhost:27017", serverSelectionTimeoutMS=300)
+        client.admin.command("ping")
+    except PyMongoError:
+        pytest.skip("needs a local mongod (docker compose -f mongo.yml up -d)")
+    collection = client["bank_perf"]["accounts"]
+    collection.delete_many({})
+    yield collection
+    collection.delete_many({})
+
+
+@pytest.fixture
+def serve():
+    # serve(command=None, **env) starts the app (python -m app.wsgi by default) on a free port in
+    # a subprocess and returns it with .url set; its output is drained through a pipe, as a log
+    # collector would, counting the app's JSON log records in .lines. Stopped after the test.
+    started = []
+
+    def start(command=None, **env):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        command = [arg.format(port=port) for arg in command or [sys.executable, "-m", "app.wsgi"]]
+        process = subprocess.Popen(
+            command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            env={**os.environ, "PYTHONPATH": ROOT, "BANK_APP_PORT": str(port), "BANK_APP_THREADS": "8", **env},
+        )
+        started.append(process)
+        process.lines = 0
+
+        def drain():
+            for line in process.stdout:
+                process.lines += line.startswith(b'{"ts"')
+
+        threading.Thread(target=drain, daemon=True).start()
+        process.url = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                requests.get(f"{process.url}/api/accounts/count", timeout=0.5)
+                return process
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        pytest.fail(f"{command} did not start")
+
+    yield start
+    for process in started:
+        process.kill()
+        process.wait()
@@ -0,0 +1,107 @@
+import http.client
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+CLIENTS = 400
+REQUESTS = 2000
+LATENCY = 0.02      # per MF request
+ASGI_SERVER = [sys.executable, "-m", "app.asgi"]
+
+
+class SlowMF(BaseHTTPRequestHandler):   # every NIP is an active VAT payer, after LATENCY
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(LATENCY)
+        nips = self.path.split("/")[-1].split("?")[0].split(",")
+        data = json.dumps({"result": {"subjects": [{"nip": nip, "statusVat": "Czynny"} for nip in nips]}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class MFServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+@pytest.fixture
+def slow_mf():
+    server = MFServer(("127.0.0.1", 0), SlowMF)
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def onboarding(url, prefix):
+    # CLIENTS clients at once, each onboarding one company per request over a kept-alive
+    # connection; every request waits LATENCY on the MF API. Returns (requests/s, p99 ms)
+    host, port = url[len("http://"):].split(":")
+    local = threading.local()
+
+    def call(i):
+        if not hasattr(local, "connection"):
+            local.connection = http.client.HTTPConnection(host, int(port), timeout=60)
+        body = json.dumps([{"company_name": f"Async {i}", "nip": f"{prefix}{i:09d}"}])
+        start = time.perf_counter()
+        local.connection.request("POST", "/api/companies/batch", body, {"Content-Type": "application/json"})
+        res = local.connection.getresponse()
+        assert json.loads(res.read())["status"] == 201
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        start = time.perf_counter()
+        latencies = sorted(pool.map(call, range(REQUESTS)))
+        elapsed = time.perf_counter() - start
+    assert requests.get(f"{url}/api/accounts/count").json()["count"] == REQUESTS
+    return REQUESTS / elapsed, latencies[int(REQUESTS * 0.99)] * 1000
+
+
+def test_asyncio_server_onboards_concurrent_clients(serve, slow_mf):
+    # waitress gives each waiting request one of its 8 threads; the asyncio app waits on the MF API in coroutines
+    env = {"BANK_APP_MF_URL": slow_mf, "BANK_APP_MF_POOL_SIZE": str(CLIENTS)}
+    threaded, threaded_p99 = onboarding(serve(**env).url, 1)
+    asynchronous, asynchronous_p99 = onboarding(serve(ASGI_SERVER, **env).url, 2)
+    print(f"{CLIENTS} clients onboarding {REQUESTS} companies, MF latency {LATENCY * 1000:.0f}ms: "
+          f"app.wsgi {threaded:.0f} req/s (p99 {threaded_p99:.0f}ms), "
+          f"app.asgi {asynchronous:.0f} req/s (p99 {asynchronous_p99:.0f}ms)")
+    assert asynchronous > threaded * 2
+
+
+def test_asyncio_server_serves_the_flask_routes(serve):
+    # everything but save/load/companies is app.api's view behind the WSGI adapter: the cost of that hop
+    results = {}
+    for name, server in (("app.wsgi", serve()), ("app.asgi", serve(ASGI_SERVER))):
+        pesel = "99060112345"
+        requests.post(f"{server.url}/api/accounts", json={"first_name": "Asgi", "last_name": "Test", "pesel": pesel})
+        host, port = server.url[len("http://"):].split(":")
+        local = threading.local()
+
+        def call(i):
+            if not hasattr(local, "connection"):
+                local.connection = http.client.HTTPConnection(host, int(port))
+            local.connection.request("GET", f"/api/accounts/{pesel}")
+            res = local.connection.getresponse()
+            res.read()
+            return res.status
+
+        with ThreadPoolExecutor(16) as pool:
+            start = time.perf_counter()
+            assert set(pool.map(call, range(REQUESTS))) == {200}
+            results[name] = REQUESTS / (time.perf_counter() - start)
+    print(", ".join(f"{name} {rate:.0f} req/s" for name, rate in results.items()))
+    assert results["app.asgi"] > results["app.wsgi"] / 3
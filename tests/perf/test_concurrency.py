@@ -0,0 +1,74 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+r = os.getenv("BANK_APP_URL", "http://127.0.0.1:5000")     # the server under test, see app/wsgi.py
+TRANSFERS = 400
+
+local = threading.local()
+
+
+def session():
+    if not hasattr(local, "session"):
+        local.session = requests.Session()
+    return local.session
+
+
+def create_account(prefix):
+    pesel = f"{prefix}{random.randint(10000, 99999)}"
+    res_create = requests.post(
+        f"{r}/api/accounts",
+        json={"first_name": "Stress", "last_name": "Test", "pesel": pesel},
+        timeout=0.5
+    )
+    assert res_create.status_code == 201
+    return pesel
+
+
+def run_transfers(pesels, threads):
+    def send(i):
+        res = session().post(
+            f"{r}/api/accounts/{pesels[i % len(pesels)]}/transfer",
+            json={"amount": 10, "type": "incoming"},
+            timeout=5
+        )
+        return res.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(send, range(TRANSFERS)))
+    return statuses, TRANSFERS / (time.perf_counter() - start)
+
+
+def test_concurrent_transfers_stay_exact():
+    throughput = {}
+    for threads in (1, 4, 8):
+        pesels = [create_account("970101"), create_account("970102")]
+
+        statuses, throughput[threads] = run_transfers(pesels, threads)
+        assert statuses == [200] * TRANSFERS
+
+        for pesel in pesels:
+            res_get = requests.get(f"{r}/api/accounts/{pesel}", timeout=0.5)
+            assert res_get.json()["balance"] == TRANSFERS / len(pesels) * 10.0
+
+    print(" ".join(f"{threads} threads: {rate:.0f} transfers/s" for threads, rate in throughput.items()))
+    # the lock must not serialise requests into a convoy; real scaling needs several worker processes
+    assert throughput[8] > throughput[1] * 0.5
+
+
+def test_concurrent_creates_do_not_duplicate():
+    pesel = f"980101{random.randint(10000, 99999)}"
+    data = {"first_name": "Race", "last_name": "Test", "pesel": pesel}
+
+    def create(_):
+        return session().post(f"{r}/api/accounts", json=data, timeout=5).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(create, range(16)))
+
+    assert sorted(statuses) == [201] + [409] * 15
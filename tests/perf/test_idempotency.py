@@ -0,0 +1,64 @@
+import http.client
+import json
+import statistics
+import time
+
+import requests
+
+from src.idempotency import NEW, REPLAY, IdempotencyStore
+
+TRANSFERS = 2000
+KEYS = 100000
+
+
+def latencies(url, pesel, keyed, retry=False):
+    # median and p99 of sequential transfers over one kept-alive connection, in ms
+    host, port = url[len("http://"):].split(":")
+    connection = http.client.HTTPConnection(host, int(port))
+    transfer = json.dumps({"amount": 1, "type": "incoming"})
+    samples = []
+    for i in range(TRANSFERS):
+        headers = {"Content-Type": "application/json"}
+        if keyed:
+            headers["Idempotency-Key"] = f"{pesel}-{0 if retry else i}"
+        start = time.perf_counter()
+        connection.request("POST", f"/api/accounts/{pesel}/transfer", transfer, headers)
+        res = connection.getresponse()
+        res.read()
+        samples.append((time.perf_counter() - start) * 1000)
+        assert res.status == 200
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)]
+
+
+def test_idempotency_key_latency(serve, tmp_path):
+    # a keyed transfer is a dict lookup plus an appended log line; a retry skips the transfer
+    server = serve(BANK_APP_IDEMPOTENCY_FILE=str(tmp_path / "idempotency.log"))
+    for pesel in ("99080112345", "99080112346", "99080112347"):
+        requests.post(f"{server.url}/api/accounts", json={"first_name": "Key", "last_name": "Test", "pesel": pesel})
+    latencies(server.url, "99080112345", False)     # warm up
+    plain = latencies(server.url, "99080112345", False)
+    keyed = latencies(server.url, "99080112346", True)
+    retried = latencies(server.url, "99080112347", True, retry=True)
+    print(f"{TRANSFERS} transfers, median/p99 ms: no key {plain[0]:.3f}/{plain[1]:.3f}, "
+          f"new keys {keyed[0]:.3f}/{keyed[1]:.3f}, retries {retried[0]:.3f}/{retried[1]:.3f}")
+    assert requests.get(f"{server.url}/api/accounts/99080112346").json()["balance"] == TRANSFERS
+    assert requests.get(f"{server.url}/api/accounts/99080112347").json()["balance"] == 1
+    assert keyed[0] < plain[0] * 1.25 + 0.1
+
+
+def test_store_operations():
+    store = IdempotencyStore(ttl=60, max_keys=KEYS // 2)
+    start = time.perf_counter()
+    for i in range(KEYS):
+        assert store.begin(str(i), "f")[0] == NEW
+        store.finish(str(i), ({"message": "ok"}, 200))
+    claimed = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(KEYS // 2, KEYS):
+        assert store.begin(str(i), "f")[0] == REPLAY
+    replayed = time.perf_counter() - start
+    print(f"{KEYS} keys over a {KEYS // 2} bound: {KEYS / claimed:.0f} claims/s, {KEYS // 2 / replayed:.0f} replays/s")
+    assert len(store) == KEYS // 2
+    assert store.evicted == KEYS // 2
+    assert claimed / KEYS < 20e-6
@@ -0,0 +1,42 @@
+import time
+
+from src.account import Account, AccountRegistry
+from src.columnar import MappedAccountRegistry, export_registry
+
+ACCOUNTS = 200000
+HISTORY = 10
+
+
+def test_startup_from_image(tmp_path):
+    registry = AccountRegistry()
+    registry.add_accounts(
+        Account.restore("Image", f"Test{i % 1000}", f"9904{i:07d}", float(i), [float(j) for j in range(HISTORY)])
+        for i in range(ACCOUNTS)
+    )
+    path = str(tmp_path / "registry.img")
+    start = time.perf_counter()
+    export_registry(registry, path)
+    export_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rebuilt = AccountRegistry()
+    rebuilt.add_accounts(
+        Account.restore(a.first_name, a.last_name, a.pesel, a.balance, a.history) for a in registry.all_accounts()
+    )
+    rebuild_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mapped = MappedAccountRegistry(path)
+    found = mapped.find_by_pesel(f"9904{ACCOUNTS // 2:07d}")
+    count = mapped.account_count()
+    startup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mapped.hydrate_all()
+    hydrate_time = time.perf_counter() - start
+
+    print(f"{ACCOUNTS} accounts: export {export_time:.2f}s, object rebuild {rebuild_time:.2f}s, "
+          f"image open + lookup {startup_time * 1000:.1f}ms, full hydration {hydrate_time:.2f}s")
+    assert found.balance == float(ACCOUNTS // 2)
+    assert count == ACCOUNTS
+    assert startup_time < rebuild_time / 10
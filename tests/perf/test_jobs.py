@@ -0,0 +1,105 @@
+import threading
+import time
+
+import requests
+
+from src.account import Account, AccountRegistry, MongoAccountsRepository
+from src.columnar import export_registry
+
+ACCOUNTS = 200000
+
+
+class Collection:   # the part of a pymongo collection load_all reads, over a list
+    def __init__(self, documents):
+        self.documents = documents
+
+    def estimated_document_count(self):
+        return len(self.documents)
+
+    def find(self, query, projection, batch_size):
+        return iter(self.documents)
+
+
+def documents(last_name):
+    return [{"first_name": "Job", "last_name": last_name, "pesel": f"9905{i:07d}", "balance": 1.0, "history": []}
+            for i in range(ACCOUNTS)]
+
+
+def readings(registry, load):
+    # account counts seen by a reader thread while load() runs, and its slowest read in ms
+    seen, slowest = [], 0.0
+    done = threading.Event()
+
+    def read():
+        nonlocal slowest
+        while not done.is_set():
+            start = time.perf_counter()
+            seen.append(registry.account_count() if registry.find_by_pesel("99050000042") else 0)
+            slowest = max(slowest, time.perf_counter() - start)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    load()
+    done.set()
+    reader.join()
+    return seen, slowest * 1000
+
+
+def test_load_swaps_the_registry_in_whole():
+    repo = MongoAccountsRepository()
+    registry = AccountRegistry()
+    registry.add_accounts(Account.restore("Job", "Old", f"9905{i:07d}", 0.0, []) for i in range(ACCOUNTS))
+
+    def clear_and_add():    # the previous load path, kept for comparison
+        loaded = [repo._from_document(doc) for doc in documents("Before")]
+        registry.clear()
+        registry.add_accounts(loaded)
+        registry.mark_clean()
+
+    before, before_slowest = readings(registry, clear_and_add)
+    repo.collection = Collection(documents("After"))
+    repo.companies = Collection([])
+    progress = []
+    after, after_slowest = readings(registry, lambda: repo.load_all(registry, lambda *p: progress.append(p)))
+
+    partial_before = sum(count != ACCOUNTS for count in before)
+    print(f"reads of a partly loaded registry during a load of {ACCOUNTS}: clear + add {partial_before} of {len(before)}, "
+          f"shadow swap {sum(count != ACCOUNTS for count in after)} of {len(after)}; "
+          f"slowest read {before_slowest:.1f}ms / {after_slowest:.1f}ms")
+    assert partial_before > 0
+    assert set(after) == {ACCOUNTS}
+    assert registry.find_by_last_name("After") and not registry.find_by_last_name("Before")
+    assert progress[-1] == (ACCOUNTS, ACCOUNTS) and len(progress) == ACCOUNTS // repo.LOAD_BATCH_SIZE + 1
+
+
+def test_save_and_load_jobs_do_not_hold_requests(serve, mongo_collection, tmp_path):
+    # the server starts from an image of the accounts stored in Mongo; a batch of transfers gives the save work
+    mongo_collection.insert_many(documents("Test"))
+    registry = AccountRegistry()
+    registry.add_accounts(MongoAccountsRepository._from_document(doc) for doc in documents("Test"))
+    image = str(tmp_path / "registry.img")
+    export_registry(registry, image)
+    server = serve(BANK_APP_REGISTRY_IMAGE=image, BANK_APP_MONGO_DB=mongo_collection.database.name)
+    batch = [{"pesel": f"9905{i:07d}", "amount": 1, "type": "incoming"} for i in range(0, ACCOUNTS, 10)]
+    assert requests.post(f"{server.url}/api/transfers/batch", json=batch).status_code == 200
+
+    for path in ("save", "load"):
+        start = time.perf_counter()
+        res = requests.post(f"{server.url}/api/accounts/{path}")
+        accepted = (time.perf_counter() - start) * 1000
+        assert res.status_code == 202
+        counts, done = set(), []
+        while True:
+            job = requests.get(f"{server.url}{res.headers['Location']}").json()
+            counts.add(requests.get(f"{server.url}/api/accounts/count").json()["count"])
+            done.append(job["done"])
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.05)
+        print(f"{path} job over {ACCOUNTS} accounts: accepted in {accepted:.1f}ms, "
+              f"finished after {len(done)} polls, counts seen {sorted(counts)}")
+        assert job["status"] == "done"
+        assert accepted < 100
+        assert done == sorted(done)
+        assert counts == {ACCOUNTS}
+    assert requests.get(f"{server.url}/api/accounts/99050000010").json()["balance"] == 2.0
@@ -0,0 +1,74 @@
+import socketserver
+import threading
+import time
+
+import pytest
+
+from src.account import Account, AccountRegistry
+from src.mailer import MailQueue
+from smtp.smtp import SMTPConnection
+
+MESSAGES = 2000
+SERIAL_SAMPLE = 200
+LATENCY = 0.002     # per accepted message
+
+
+class StubSMTP(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 stub")
+        while line := self.rfile.readline():
+            command = line[:4].upper()
+            if command == b"QUIT":
+                self.reply("221 bye")
+                return
+            if command == b"DATA":
+                self.reply("354 go ahead")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                time.sleep(LATENCY)
+                self.server.delivered += 1
+            self.reply("250 ok")
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), StubSMTP)
+    server.daemon_threads = True
+    server.delivered = 0
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+    monkeypatch.setenv("BANK_APP_SMTP_HOST", "127.0.0.1")
+    monkeypatch.setenv("BANK_APP_SMTP_PORT", str(server.server_address[1]))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_statement_run_throughput(smtp_server):
+    registry = AccountRegistry()
+    registry.add_accounts(Account.restore("Mail", "Test", f"9905{i:07d}", 0.0, [1.0, 2.0]) for i in range(MESSAGES))
+    addresses = {registry.key(account): f"{registry.key(account)}@example.com" for account in registry.all_accounts()}
+
+    # the old path: a new client, and so a new connection, per message, in the caller
+    accounts = list(registry.all_accounts())[:SERIAL_SAMPLE]
+    start = time.perf_counter()
+    for account in accounts:
+        client = SMTPConnection()
+        assert client.send(*account.history_email(), addresses[account.pesel])
+        client.close()
+    serial = SERIAL_SAMPLE / (time.perf_counter() - start)
+
+    with MailQueue(workers=8) as mailer:
+        start = time.perf_counter()
+        sent, failed = registry.send_all_statements(addresses, mailer)
+        queued = MESSAGES / (time.perf_counter() - start)
+
+    print(f"serial, connection per message: {serial:.0f} msgs/s; "
+          f"MailQueue with 8 workers: {queued:.0f} msgs/s ({mailer.rate():.0f} since start)")
+    assert (sent, failed) == (MESSAGES, 0)
+    assert smtp_server.delivered == SERIAL_SAMPLE + MESSAGES
+    assert queued > serial
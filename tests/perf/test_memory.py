@@ -0,0 +1,38 @@
+import tracemalloc
+
+from src.account import Account
+
+N = 10000
+HISTORY = 50
+
+
+class LegacyAccount:    # pre-__slots__ layout: instance __dict__ and a list of floats
+    def __init__(self, first_name, last_name, pesel):
+        self.first_name = first_name
+        self.last_name = last_name
+        self.balance = 0.0
+        self.pesel = pesel
+        self.promoCode = None
+        self.history = []
+
+
+def bytes_per_account(factory):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    accounts = []
+    for i in range(N):
+        account = factory("Memory", "Test", f"900101{i:05d}")
+        for j in range(HISTORY):
+            account.history.append(float(j + i))
+        accounts.append(account)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return total / N
+
+
+def test_memory_per_account():
+    legacy = bytes_per_account(LegacyAccount)
+    compact = bytes_per_account(Account)
+    print(f"bytes per account with {HISTORY} transfers: before {legacy:.0f}, after {compact:.0f}")
+    assert compact < legacy
@@ -0,0 +1,48 @@
+import time
+
+import pytest
+
+from src.account import Account, AccountRegistry, MongoAccountsRepository
+
+ACCOUNTS = 100000
+HISTORY = 20
+
+
+@pytest.fixture
+def repo(mongo_collection):
+    repo = MongoAccountsRepository()
+    repo.collection = mongo_collection
+    repo.companies = mongo_collection.database["companies"]
+    documents = [
+        {"first_name": "Load", "last_name": "Test", "pesel": f"9902{i:07d}", "balance": 100.0,
+         "history": [float(j) for j in range(1, HISTORY + 1)]}
+        for i in range(ACCOUNTS)
+    ]
+    mongo_collection.insert_many(documents)
+    return repo
+
+
+def load_one_by_one(collection, registry):    # the previous load path, kept for comparison
+    for acc_data in collection.find():
+        account = Account(acc_data["first_name"], acc_data["last_name"], acc_data["pesel"])
+        account.balance = acc_data["balance"]
+        account.history = acc_data["history"]
+        registry.add_account(account)
+
+
+def test_load_throughput(repo):
+    registry = AccountRegistry()
+    start = time.perf_counter()
+    load_one_by_one(repo.collection, registry)
+    before = ACCOUNTS / (time.perf_counter() - start)
+
+    registry = AccountRegistry()
+    start = time.perf_counter()
+    loaded = repo.load_all(registry)
+    after = ACCOUNTS / (time.perf_counter() - start)
+
+    print(f"load throughput: one by one {before:.0f} accounts/s, load_all {after:.0f} accounts/s")
+    assert loaded == ACCOUNTS
+    assert registry.account_count() == ACCOUNTS
+    assert registry.find_by_pesel("99020000042").history == [float(j) for j in range(1, HISTORY + 1)]
+    assert after > before
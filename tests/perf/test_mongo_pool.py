@@ -0,0 +1,47 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pymongo import MongoClient
+
+from src.account import Account, AccountRegistry, MongoAccountsRepository, mongo_settings
+
+WORKERS = 8
+ACCOUNTS_PER_WORKER = 2000
+
+
+def registries():
+    result = []
+    for worker in range(WORKERS):
+        registry = AccountRegistry()
+        registry.add_accounts(
+            Account.restore("Pool", "Test", f"99{worker:02d}{i:07d}", 100.0, [100.0]) for i in range(ACCOUNTS_PER_WORKER)
+        )
+        result.append(registry)
+    return result
+
+
+def timed(pool, function, items):
+    start = time.perf_counter()
+    list(pool.map(function, items))
+    return time.perf_counter() - start
+
+
+@pytest.mark.parametrize("pool_size", [1, 4, 16, 64])
+def test_save_and_load_by_pool_size(mongo_collection, pool_size):
+    settings = dict(mongo_settings(), maxPoolSize=pool_size)
+    client = MongoClient(**settings)
+    repo = MongoAccountsRepository(client=client, database=mongo_collection.database.name)
+    repo.transactions.delete_many({})
+
+    with ThreadPoolExecutor(WORKERS) as pool:
+        # every worker saves its own registry, then all of them load the whole collection at once
+        save_time = timed(pool, repo.save_all, registries())
+        load_time = timed(pool, repo.load_all, [AccountRegistry() for _ in range(WORKERS)])
+
+    total = WORKERS * ACCOUNTS_PER_WORKER
+    print(f"maxPoolSize={pool_size}: {WORKERS} concurrent saves of {ACCOUNTS_PER_WORKER} accounts "
+          f"{save_time * 1000:.0f} ms, {WORKERS} concurrent loads of {total} {load_time * 1000:.0f} ms")
+    assert repo.collection.count_documents({}) == total
+    repo.transactions.delete_many({})
+    client.close()
@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+from src.account import Account, AccountRegistry, MongoAccountsRepository
+
+ACCOUNTS = 20000
+
+
+@pytest.fixture
+def repo(mongo_collection):
+    repo = MongoAccountsRepository()
+    repo.collection = mongo_collection
+    repo.companies = mongo_collection.database["companies"]
+    repo.transactions = mongo_collection.database["transactions"]     # not the app's bank.transactions
+    repo.transactions.delete_many({})
+    yield repo
+    repo.transactions.delete_many({})
+
+
+def test_save_time_follows_modified_accounts(repo):
+    registry = AccountRegistry()
+    accounts = [Account("Save", "Test", f"9901{i:07d}") for i in range(ACCOUNTS)]
+    registry.add_accounts(accounts)
+
+    start = time.perf_counter()
+    repo.save_all(registry)
+    full = time.perf_counter() - start
+
+    timings = {}
+    for modified in (10, 100, 1000):
+        for account in accounts[:modified]:
+            account.transferIn(1)
+        start = time.perf_counter()
+        written = repo.save_all(registry)
+        timings[modified] = time.perf_counter() - start
+        assert written == modified
+
+    print(f"full save of {ACCOUNTS}: {full * 1000:.1f} ms; " +
+          ", ".join(f"{n} modified: {t * 1000:.1f} ms" for n, t in timings.items()))
+    assert repo.collection.count_documents({}) == ACCOUNTS
+    assert repo.collection.find_one({"pesel": accounts[0].pesel})["balance"] == 3.0
+    assert timings[10] < full
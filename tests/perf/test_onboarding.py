@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.account import AccountRegistry, CompanyAccount, nip_verifier
+from src.onboarding import CREATED, onboard_companies
+
+COMPANIES = 10000
+SEQUENTIAL_SAMPLE = 200
+LATENCY = 0.005     # per MF request, single or batch
+
+
+class StubMF(BaseHTTPRequestHandler):   # every NIP is an active VAT payer
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(LATENCY)
+        nips = self.path.split("/")[-1].split("?")[0].split(",")
+        if "/nips/" in self.path:
+            body = {"result": {"subjects": [{"nip": nip, "statusVat": "Czynny"} for nip in nips]}}
+        else:
+            body = {"result": {"subject": {"statusVat": "Czynny"}}}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_mf(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubMF)
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+    monkeypatch.setenv("BANK_APP_MF_URL", f"http://127.0.0.1:{server.server_port}")
+    nip_verifier.clear()
+    yield server
+    nip_verifier.clear()
+    server.shutdown()
+    server.server_close()
+
+
+def test_bulk_onboarding_throughput(stub_mf):
+    registry = AccountRegistry()
+    start = time.perf_counter()
+    for i in range(SEQUENTIAL_SAMPLE):
+        registry.add_account(CompanyAccount(f"Seq {i}", f"8{i:09d}"))
+    sequential = SEQUENTIAL_SAMPLE / (time.perf_counter() - start)
+
+    companies = [(f"Bulk {i}", f"9{i:09d}") for i in range(COMPANIES)]
+    start = time.perf_counter()
+    results = onboard_companies(registry, companies)
+    bulk = COMPANIES / (time.perf_counter() - start)
+
+    print(f"one CompanyAccount at a time: {sequential:.0f} companies/s, "
+          f"onboard_companies with {COMPANIES}: {bulk:.0f} companies/s")
+    assert results == [CREATED] * COMPANIES
+    assert registry.account_count() == SEQUENTIAL_SAMPLE + COMPANIES
+    assert bulk > sequential * 10
@@ -1,7 +1,9 @@
-import requests
+import os
 import random
 
-r = "http://127.0.0.1:5000"
+import requests
+
+r = os.getenv("BANK_APP_URL", "http://127.0.0.1:5000")     # the server under test, see app/wsgi.py
 
 
 def test_create_delete_100_times():
@@ -59,4 +61,34 @@ def test_create_and_100_transfers():
 
     res_get = requests.get(f"{r}/api/accounts/{pesel}", timeout=0.5)
     assert res_get.status_code == 200
-    assert res_get.json()["balance"] == 1000.0
\ No newline at end of file
+    assert res_get.json()["balance"] == 1000.0
+
+
+def test_create_and_100_transfers_in_one_batch():
+    pesel = f"960101{random.randint(10000, 99999)}"
+
+    data = {
+        "first_name": "Batch",
+        "last_name": "Test",
+        "pesel": pesel
+    }
+
+    res_create = requests.post(
+        f"{r}/api/accounts",
+        json=data,
+        timeout=0.5
+    )
+    assert res_create.status_code == 201
+
+    batch = [{"pesel": pesel, "amount": 10, "type": "incoming"} for i in range(100)]
+    res_batch = requests.post(
+        f"{r}/api/transfers/batch",
+        json=batch,
+        timeout=0.5
+    )
+    assert res_batch.status_code == 200
+    assert res_batch.text.count('"status": 200') == 100
+
+    res_get = requests.get(f"{r}/api/accounts/{pesel}", timeout=0.5)
+    assert res_get.status_code == 200
+    assert res_get.json()["balance"] == 1000.0
@@ -0,0 +1,72 @@
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from src.account import Account, AccountRegistry
+from src.columnar import export_registry
+
+ACCOUNTS = 5000
+CLIENTS = 8
+WATCHED = 100       # accounts on each dashboard
+ROUNDS = 4          # a batch of transfers to 1% of the accounts starts every round
+POLLS = 5           # dashboard refreshes per round
+
+
+def poll(url, conditional):
+    # every refresh reads the dashboard's accounts, the count and the full listing;
+    # returns (requests per second, share of 304s, bytes received)
+    host, port = url[len("http://"):].split(":")
+    local = threading.local()
+    stats = {"requests": 0, "not_modified": 0, "bytes": 0}
+    lock = threading.Lock()
+
+    def dashboard(n):
+        if not hasattr(local, "connection"):
+            local.connection, local.etags = http.client.HTTPConnection(host, int(port)), {}
+        watched = [f"/api/accounts/9909{(n * WATCHED + i) % ACCOUNTS:07d}" for i in range(WATCHED)]
+        paths = watched + ["/api/accounts/count", "/api/accounts"]
+        not_modified = received = 0
+        for _ in range(POLLS):
+            for path in paths:
+                headers = {"If-None-Match": local.etags[path]} if conditional and path in local.etags else {}
+                local.connection.request("GET", path, headers=headers)
+                res = local.connection.getresponse()
+                received += len(res.read())
+                assert res.status in (200, 304)
+                not_modified += res.status == 304
+                local.etags[path] = res.getheader("ETag")
+        with lock:
+            stats["requests"] += POLLS * len(paths)
+            stats["not_modified"] += not_modified
+            stats["bytes"] += received
+
+    elapsed = 0.0
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        for round_ in range(ROUNDS):
+            batch = [{"pesel": f"9909{i:07d}", "amount": 1, "type": "incoming"} for i in range(round_, ACCOUNTS, 100)]
+            assert requests.post(f"{url}/api/transfers/batch", json=batch).status_code == 200
+            start = time.perf_counter()
+            list(pool.map(dashboard, range(CLIENTS)))
+            elapsed += time.perf_counter() - start
+    return stats["requests"] / elapsed, stats["not_modified"] / stats["requests"], stats["bytes"]
+
+
+def test_conditional_polling(serve, tmp_path):
+    registry = AccountRegistry()
+    registry.add_accounts(Account.restore("Poll", "Test", f"9909{i:07d}", 0.0, []) for i in range(ACCOUNTS))
+    image = str(tmp_path / "registry.img")
+    export_registry(registry, image)
+
+    # before: every poll answered in full and listings rebuilt; after: If-None-Match and the response cache
+    plain, _, plain_bytes = poll(serve(BANK_APP_REGISTRY_IMAGE=image, BANK_APP_RESPONSE_CACHE_BYTES="0").url, False)
+    conditional, not_modified, conditional_bytes = poll(serve(BANK_APP_REGISTRY_IMAGE=image).url, True)
+
+    print(f"{CLIENTS} dashboards x {WATCHED + 2} endpoints x {POLLS} polls x {ROUNDS} rounds over {ACCOUNTS} accounts: "
+          f"plain {plain:.0f} req/s ({plain_bytes / 1e6:.1f}MB), If-None-Match {conditional:.0f} req/s "
+          f"({not_modified:.0%} 304, {conditional_bytes / 1e6:.1f}MB)")
+    assert not_modified > 0.7
+    assert conditional_bytes < plain_bytes / 3
+    assert conditional > plain
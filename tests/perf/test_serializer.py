@@ -0,0 +1,39 @@
+import json
+import time
+
+from src.account import Account, AccountRegistry
+from src.serializer import Serializer, account_data
+
+ACCOUNTS = 100000
+
+
+def timed(encode, repeat=1):    # (body, best time of repeat runs)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return body, best
+
+
+def test_listing_serialisation():
+    registry = AccountRegistry()
+    registry.add_accounts(Account.restore("Lista", f"Test{i % 100}", f"9908{i:07d}", float(i), []) for i in range(ACCOUNTS))
+    accounts = list(registry.all_accounts())
+    serializer = Serializer()
+
+    # the old path: a dict per account through stdlib json, as jsonify did
+    old, old_time = timed(lambda: json.dumps([account_data(account) for account in accounts]).encode(), 3)
+    cold, cold_time = timed(lambda: serializer.accounts(accounts))
+    warm, warm_time = timed(lambda: serializer.accounts(accounts), 3)
+    for account in accounts[::10]:
+        account.balance += 1     # a tenth of the accounts changed since the last listing
+    changed, changed_time = timed(lambda: serializer.accounts(accounts))
+
+    print(f"{ACCOUNTS} accounts ({serializer.backend}): dicts + json {old_time * 1000:.0f}ms, "
+          f"first listing {cold_time * 1000:.0f}ms, cached {warm_time * 1000:.0f}ms, "
+          f"10% changed {changed_time * 1000:.0f}ms; cached listing {old_time / warm_time:.1f}x faster")
+    assert json.loads(warm) == json.loads(old)
+    assert json.loads(changed)[10]["balance"] == 11.0
+    assert warm_time < old_time     # the speedup itself depends on the machine, it is reported above
@@ -0,0 +1,60 @@
+import http.client
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CLIENTS = 16
+REQUESTS = 3000
+DEBUG_SERVER = [sys.executable, "-m", "flask", "--app", "app/api.py", "run", "--debug", "--no-reload", "--port", "{port}"]
+
+
+def throughput(url):
+    pesel = "99070112345"
+    requests.post(f"{url}/api/accounts", json={"first_name": "Serve", "last_name": "Test", "pesel": pesel})
+    host, port = url[len("http://"):].split(":")
+    local = threading.local()
+    transfer = json.dumps({"amount": 1, "type": "incoming"})
+
+    def call(i):    # http.client over one kept-alive connection per client: requests would be the bottleneck
+        if not hasattr(local, "connection"):
+            local.connection = http.client.HTTPConnection(host, int(port))
+        if i % 4 == 0:
+            local.connection.request("POST", f"/api/accounts/{pesel}/transfer", transfer, {"Content-Type": "application/json"})
+        else:
+            local.connection.request("GET", f"/api/accounts/{pesel}")
+        res = local.connection.getresponse()
+        res.read()
+        return res.status
+
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        start = time.perf_counter()
+        statuses = list(pool.map(call, range(REQUESTS)))
+        elapsed = time.perf_counter() - start
+    assert statuses == [200] * REQUESTS
+    assert requests.get(f"{url}/api/accounts/{pesel}").json()["balance"] == REQUESTS // 4
+    return REQUESTS / elapsed
+
+
+def test_production_server_outperforms_debug_server(serve):
+    # flask run in debug mode is what the perf workflow used to measure
+    production = throughput(serve().url)
+    debug = throughput(serve(DEBUG_SERVER, BANK_APP_DEBUG="1").url)
+    print(f"{CLIENTS} clients, {REQUESTS} requests: app.wsgi {production:.0f} req/s, flask run --debug {debug:.0f} req/s")
+    assert production > debug
+
+
+def test_sampled_logging_overhead(serve):
+    # every request logged with its debug trace, against the default 1% sample
+    full = serve(BANK_APP_LOG_LEVEL="DEBUG", BANK_APP_LOG_SAMPLE="1")
+    sampled = serve()
+    full_rate = throughput(full.url)
+    sampled_rate = throughput(sampled.url)
+    print(f"every request logged: {full_rate:.0f} req/s ({full.lines} lines); "
+          f"1% sampled: {sampled_rate:.0f} req/s ({sampled.lines} lines)")
+    assert full.lines > REQUESTS
+    assert sampled.lines < REQUESTS / 10
+    assert sampled_rate > full_rate
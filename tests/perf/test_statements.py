@@ -0,0 +1,36 @@
+import time
+import tracemalloc
+
+from src.account import Account
+
+HISTORY = 500000
+
+
+def peak(render):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = render()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+
+def test_streamed_csv_memory():
+    account = Account.restore("Statement", "Test", "99060112345", 0.0, [float(i % 200 - 100) for i in range(HISTORY)])
+
+    # the old way: the whole history rendered into one string
+    def whole():
+        rows = [f"{seq},,{'incoming' if amount > 0 else 'outgoing'},{amount}" for seq, amount in enumerate(account.history)]
+        return len("seq,timestamp,type,amount\r\n" + "\r\n".join(rows) + "\r\n")
+
+    def streamed():
+        return sum(len(chunk) for chunk in account.statement().csv_chunks())
+
+    whole_size, whole_time, whole_peak = peak(whole)
+    streamed_size, streamed_time, streamed_peak = peak(streamed)
+
+    print(f"{HISTORY} transfers, {streamed_size / 1e6:.1f}MB of CSV: whole string {whole_peak / 1e6:.1f}MB peak "
+          f"in {whole_time:.2f}s, streamed {streamed_peak / 1e6:.2f}MB peak in {streamed_time:.2f}s")
+    assert streamed_size == whole_size
+    assert streamed_peak < whole_peak / 20
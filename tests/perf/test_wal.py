@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from src.account import Account, AccountRegistry
+from src.persistence import PersistenceEngine
+
+ACCOUNTS = 100000
+TRANSFERS = 20000
+
+
+def populated(directory, sync_interval):
+    registry = AccountRegistry()
+    registry.add_accounts(
+        Account.restore("Wal", "Test", f"9903{i:07d}", 100.0, [1.0, 2.0, 3.0]) for i in range(ACCOUNTS)
+    )
+    engine = PersistenceEngine(str(directory), sync_interval=sync_interval).open(registry)
+    return registry, engine
+
+
+def transfer_rate(registry, count):
+    accounts = list(registry.page(limit=1000))
+    start = time.perf_counter()
+    for i in range(count):
+        accounts[i % len(accounts)].transferIn(1.0)
+    return count / (time.perf_counter() - start)
+
+
+def acknowledged_rate(registry, engine, writers, seconds=1.0):
+    # transfers/s when every writer waits for the WAL to hold its transfer, as the API does
+    accounts = list(registry.page(limit=1000))
+    counts = [0] * writers
+    deadline = time.perf_counter() + seconds
+
+    def write(n):
+        while time.perf_counter() < deadline:
+            accounts[(n * 61 + counts[n]) % len(accounts)].transferIn(1.0)
+            engine.wait()
+            counts[n] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+@pytest.mark.parametrize("sync_interval", [0, 0.001, 0.01, 0.1])
+def test_wal_throughput_by_sync_interval(tmp_path, sync_interval):
+    registry, engine = populated(tmp_path, sync_interval)
+    rate = transfer_rate(registry, TRANSFERS)
+    # one fsync acknowledges every writer waiting on it, so more writers get more done per flush
+    acknowledged = {writers: acknowledged_rate(registry, engine, writers) for writers in (1, 16)}
+    engine.close()
+    print(f"sync_interval={sync_interval}: {rate:.0f} transfers/s, acknowledged "
+          + ", ".join(f"{rate:.0f}/s by {writers}" for writers, rate in acknowledged.items()))
+    assert rate > 0
+    assert acknowledged[16] > acknowledged[1]
+
+
+def test_recovery_time(tmp_path):
+    registry, engine = populated(tmp_path, 0.01)
+    start = time.perf_counter()
+    engine.snapshot()
+    snapshot_time = time.perf_counter() - start
+    transfer_rate(registry, TRANSFERS)
+    engine.close()
+
+    recovered = AccountRegistry()
+    start = time.perf_counter()
+    engine = PersistenceEngine(str(tmp_path)).open(recovered)
+    recovery_time = time.perf_counter() - start
+    engine.close()
+
+    print(f"{ACCOUNTS} accounts: snapshot {snapshot_time:.2f}s, "
+          f"recovery with {TRANSFERS} logged transfers {recovery_time:.2f}s")
+    assert recovered.account_count() == ACCOUNTS
+    assert recovery_time < 30
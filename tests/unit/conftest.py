@@ -0,0 +1,126 @@
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.account import nip_verifier
+
+
+@pytest.fixture(autouse=True)
+def empty_nip_cache():
+    # the verifier is shared by every CompanyAccount, so cached answers would leak between tests
+    nip_verifier.clear()
+    yield
+    nip_verifier.clear()
+
+
+ANSWERS = {
+    "1234567890": (200, {"result": {"subject": {"statusVat": "Czynny"}}}),
+    "9999999999": (200, {"result": {"subject": {"statusVat": "Zwolniony"}}}),
+    "5555555555": (200, {"result": {"subject": None}}),
+    "4444444444": (400, {"code": "WL-113"}),
+    "5000000000": (503, {}),
+}
+
+
+class StubMF(BaseHTTPRequestHandler):   # minimal /api/search/nip/<nip>?date=... endpoint
+    protocol_version = "HTTP/1.1"       # keep-alive, so connection reuse is visible
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address))
+        nips = self.path.split("/")[-1].split("?")[0].split(",")
+        if "7777777777" in nips:
+            time.sleep(0.5)
+        if "/nips/" in self.path:
+            status, body = self._batch(nips)
+        else:
+            status, body = ANSWERS.get(nips[0], (200, {"result": {"subject": None}}))
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def _batch(nips):
+        if "5000000000" in nips:
+            return 503, {}
+        subjects = []
+        for nip in nips:
+            status, body = ANSWERS.get(nip, (404, {}))
+            subject = body.get("result", {}).get("subject") if status == 200 else None
+            if subject:
+                subjects.append({"nip": nip, **subject})
+        return 200, {"result": {"subjects": subjects}}
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_mf(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubMF)
+    server.requests = []
+    server.handle_error = lambda request, client_address: None    # clients that timed out and hung up
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    monkeypatch.setenv("BANK_APP_MF_URL", f"http://127.0.0.1:{server.server_port}")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class StubSMTP(socketserver.StreamRequestHandler):    # just enough SMTP for smtplib
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 stub")
+        while True:
+            line = self.rfile.readline()
+            command = line[:4].upper()
+            if not line:
+                return
+            if command == b"QUIT":
+                self.reply("221 bye")
+                return
+            if command == b"RCPT" and b"reject" in line:
+                self.reply("550 no such user")
+            elif command == b"DATA":
+                self.reply("354 go ahead")
+                data = b""
+                while (line := self.rfile.readline()) not in (b".\r\n", b""):
+                    data += line
+                if self.server.fail_next:
+                    self.server.fail_next -= 1
+                    self.reply("451 try again later")
+                else:
+                    self.server.messages.append(data)
+                    self.reply("250 queued")
+                if self.server.drop_after_message:
+                    self.server.drop_after_message = False
+                    return
+            else:
+                self.reply("250 ok")
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), StubSMTP)
+    server.daemon_threads = True
+    server.connections = 0
+    server.messages = []
+    server.fail_next = 0
+    server.drop_after_message = False
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+    monkeypatch.setenv("BANK_APP_SMTP_HOST", "127.0.0.1")
+    monkeypatch.setenv("BANK_APP_SMTP_PORT", str(server.server_address[1]))
+    yield server
+    server.shutdown()
+    server.server_close()
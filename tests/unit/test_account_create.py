@@ -1,9 +1,15 @@
+import asyncio
+import threading
+from datetime import datetime, timezone
 from threading import active_count
 from typing import final
-from unittest.mock import patch, Mock
+from unittest.mock import AsyncMock, patch, Mock, MagicMock
 
-from src.account import Account,CompanyAccount,AccountRegistry, MongoAccountsRepository
+from src.account import Account,CompanyAccount,AccountRegistry, AsyncMongoAccountsRepository, MongoAccountsRepository, History, SortedBuckets
+from src import account as account_module
 import pytest
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import BulkWriteError
 
 @pytest.fixture
 def account():
@@ -11,7 +17,7 @@ def account():
 
 @pytest.fixture
 def mock_nip_verification(mocker):
-    mock_get = mocker.patch('src.account.requests.get')
+    mock_get = mocker.patch('src.account.nip_verifier.session.get')
     mock_response = mocker.Mock()
     mock_response.status_code = 200
     mock_response.json.return_value = {
@@ -26,6 +32,10 @@ def mock_repo(mocker):
     mock_collection = mocker.Mock()
     repo = MongoAccountsRepository()
     repo.collection = mock_collection
+    repo.companies = mocker.Mock()
+    repo.companies.find.return_value = []
+    repo.companies.estimated_document_count.return_value = 0
+    repo.transactions = mocker.Mock()
     return repo, mock_collection
 
 
@@ -275,6 +285,19 @@ class TestAccountHistory:
         result = account._last_three_plus()
         assert result is False
 
+    def test_history_is_packed(self):
+        account = Account("John", "Doe", "59031412345", None)
+        account.history = [100, -50]
+        assert account.history.typecode == "d"
+        assert account.history == History([100.0, -50.0])
+        assert not account.history != [100.0, -50.0]
+        assert account.history != [100.0] and account.history != History([100.0])
+        assert History.__ne__(account.history, "x") is NotImplemented
+        assert repr(account.history) == "[100.0, -50.0]"
+
+    def test_account_has_no_instance_dict(self, account):
+        assert not hasattr(account, "__dict__")
+
 #testowanie pożyczek dla konta osobistego
 class TestAccountLoan:
     @pytest.mark.parametrize(
@@ -296,6 +319,43 @@ class TestAccountLoan:
 
         assert account.balance == final_balance
 
+    def test_rolling_state_follows_appends(self, account):
+        account.balance = 10000.0
+        for amount in [100, 200, 300, 400, 500, 600]:
+            account.transferIn(amount)
+        assert account.history.window_sum == 2000.0
+        assert account.history.positive_run == 5
+
+        account.transferOut(50)
+        assert account.history.window_sum == 1750.0
+        assert account.history.positive_run == 0
+        assert account._last_three_plus() is False
+        assert account._last_five_sum_larger(1700) is True
+        assert account._last_five_sum_larger(1750) is False
+
+    def test_window_sum_does_not_drift(self, account):
+        account.balance = 1e18
+        account.transferIn(1e17)
+        for amount in [100, 100]:
+            account.transferIn(amount)
+        for _ in range(3):
+            account.transferOut(1)
+        account.transferIn(50)
+        assert account.history.window_sum == 147.0
+        assert account.submit_for_loan(145) is True
+
+    def test_evaluate_loans(self, account):
+        reg = AccountRegistry()
+        poor = Account("Jack", "Doe", "59031425345", None)
+        account.history = [10, 20, 30]
+        reg.add_accounts([account, poor])
+
+        decisions = reg.evaluate_loans([("59031412345", 500), ("59031425345", 500), ("00000000000", 500)])
+
+        assert decisions == [True, False, False]
+        assert account.balance == 500.0
+        assert poor.balance == 0.0
+
 #testowanie dla pożyczek dla konta firmowego
 class TestCompanyLoan:
     @pytest.fixture(autouse=True)
@@ -319,6 +379,16 @@ class TestCompanyLoan:
         assert result is False
         assert account.balance == 5000.0
 
+    def test_company_take_loan_finds_zus_in_the_log(self):
+        account = CompanyAccount.restore("XYZ", "1234567890", 10000.0, [100.0], history_offset=1)
+        registry = AccountRegistry()
+        registry.add_account(account)
+        registry.transaction_log = Mock()
+        registry.transaction_log.iter_history.return_value = [{"seq": 0, "amount": -1775.0, "type": "outgoing", "timestamp": None}]
+
+        assert account.take_loan(4000) is True
+        registry.transaction_log.iter_history.assert_called_once_with("1234567890", before=1)
+
     def test_company_take_loan_no_special_transaction(self):
         account = CompanyAccount("XYZ", "1234567890")
         account.balance = 10000
@@ -370,7 +440,27 @@ class TestAccountRegistry:
         reg.add_account(account1)
         reg.add_account(account2)
         res = reg.all_accounts()
-        assert res == [account1,account2]
+        assert list(res) == [account1,account2]
+
+    def test_page_in_pesel_order(self):
+        reg = AccountRegistry()
+        accounts = [Account("Jack", "Doe", f"590314{i:05d}", None) for i in (3, 1, 4, 2)]
+        reg.add_accounts(accounts)
+        first = reg.page(limit=2)
+        assert [a.pesel for a in first] == ["59031400001", "59031400002"]
+        rest = reg.page(after=first[-1].pesel, limit=5)
+        assert [a.pesel for a in rest] == ["59031400003", "59031400004"]
+
+    def test_page_after_single_adds_and_delete(self, account):
+        reg = AccountRegistry()
+        for i in range(100):
+            reg.add_account(Account("Jack", "Doe", f"590314{i:05d}", None))
+        reg.add_accounts([Account("Jack", "Doe", "59031499999", None)])
+        reg.delete_account("59031400000")
+        page = reg.page(limit=200)
+        assert len(page) == 100
+        assert page[0].pesel == "59031400001"
+        assert page[-1].pesel == "59031499999"
 
     def test_count_accounts(self,account):
         reg = AccountRegistry()
@@ -390,9 +480,361 @@ class TestAccountRegistry:
         assert result is False
         assert len(registry.accounts) == 1
 
+    def test_delete_account(self, account):
+        reg = AccountRegistry()
+        reg.add_account(account)
+        assert reg.delete_account("59031412345") is True
+        assert reg.find_by_pesel("59031412345") is None
+        assert reg.account_count() == 0
+
+    def test_delete_account_missing(self):
+        reg = AccountRegistry()
+        assert reg.delete_account("59031412345") is False
+
+    def test_add_accounts_skips_duplicates(self, account):
+        reg = AccountRegistry()
+        duplicate = Account("Jack", "Doe", "59031412345", None)
+        other = Account("Jack", "Doe", "59031425345", None)
+        added = reg.add_accounts([account, duplicate, other])
+        assert added == 2
+        assert list(reg.all_accounts()) == [account, other]
+        assert reg.find_by_pesel("59031412345") is account
+
+    def test_clear(self, account):
+        reg = AccountRegistry()
+        reg.add_account(account)
+        reg.clear()
+        assert reg.accounts == []
+        assert reg.find_by_pesel("59031412345") is None
+
+    def test_find_by_last_name(self, account):
+        reg = AccountRegistry()
+        other = Account("Jack", "Smith", "59031425345", None)
+        reg.add_accounts([account, other])
+        assert reg.find_by_last_name("Doe") == [account]
+        assert reg.find_by_last_name("Nobody") == []
+
+    def test_last_name_index_follows_rename(self, account):
+        reg = AccountRegistry()
+        reg.add_account(account)
+        account.last_name = "Smith"
+        assert reg.find_by_last_name("Doe") == []
+        assert reg.find_by_last_name("Smith") == [account]
+
+    def test_find_by_nip(self, account):
+        reg = AccountRegistry()
+        company = CompanyAccount("XYZ", "1234567890")
+        reg.add_accounts([account, company])
+        assert reg.find_by_nip("1234567890") is company
+        assert reg.find_by_nip("0987654321") is None
+        assert reg.delete_account("1234567890") is True
+        assert reg.find_by_nip("1234567890") is None
+
+    def test_find_by_balance_range(self, account):
+        reg = AccountRegistry()
+        rich = Account("Jack", "Doe", "59031425345", None)
+        rich.balance = 1000.0
+        account.balance = 100.0
+        reg.add_accounts([account, rich])
+        assert reg.find_by_balance_range(50, 100) == [account]
+        assert reg.find_by_balance_range(100, 1000) == [account, rich]
+        assert reg.find_by_balance_range(low=500) == [rich]
+        assert reg.find_by_balance_range(high=99.99) == []
+
+    def test_balance_index_follows_transfers(self, account):
+        reg = AccountRegistry()
+        reg.add_account(account)
+        account.transferIn(300.0)
+        assert reg.find_by_balance_range(300, 300) == [account]
+        account.transferOut(100.0)
+        assert reg.find_by_balance_range(200, 200) == [account]
+        account.expressTransferOut(100.0)
+        assert reg.find_by_balance_range(99, 99) == [account]
+        assert reg.find_by_balance_range(200, 300) == []
+
+    def test_set_balances_small_batch(self, account):
+        reg = AccountRegistry()     # enough accounts that one update is a small part of its shard
+        reg.add_accounts(Account.restore("Jack", "Doe", f"590314{i:05d}", 0.0, []) for i in range(10000))
+        reg.add_accounts([account])
+        target = reg.find_by_pesel("59031400007")
+        reg.set_balances([(target, 70.0)])
+        assert target.balance == 70.0
+        assert reg.find_by_balance_range(70, 70) == [target]
+        assert reg.find_by_balance_range(0, 0)[:2] == [reg.find_by_pesel("59031400000"), reg.find_by_pesel("59031400001")]
+
+    def test_set_balances_rebuilds_index(self, account):
+        reg = AccountRegistry()
+        other = Account("Jack", "Doe", "59031425345", None)
+        reg.add_accounts([account, other])
+        outsider = Account("Jack", "Doe", "59031425346", None)
+        reg.set_balances([(account, 30.0), (other, 20.0), (outsider, 10.0)])
+        assert account.balance == 30.0
+        assert outsider.balance == 10.0
+        assert reg.find_by_balance_range() == [other, account]
+
+    def test_deleted_account_is_unindexed(self, account):
+        reg = AccountRegistry()
+        reg.add_account(account)
+        reg.delete_account(account.pesel)
+        account.transferIn(100.0)
+        assert reg.find_by_last_name("Doe") == []
+        assert reg.find_by_balance_range() == []
+
+    def test_replace_account_keeps_the_log_of_the_key(self):
+        reg = AccountRegistry()
+        reg.add_account(Account.restore("Jan", "Kowalski", "12345678901", 10.0, [10.0]))
+        reg.mark_clean()
+        replacement = Account.restore("Jan", "Kowalski", "12345678901", 20.0, [10.0, 10.0])
+        reg.replace_account(replacement)
+        assert reg.take_changes() == ([replacement], [])
+
+        reg.delete_account("12345678901")
+        reg.replace_account(Account.restore("Anna", "Nowak", "12345678901", 0.0, []))   # a new owner: its log goes
+        reg.replace_account(Account.restore("Anna", "Nowak", "12345678901", 5.0, [5.0]))
+        assert reg.take_changes()[1] == ["12345678901"]
+
+#testowanie posortowanego indeksu
+class TestVersions:
+    def test_every_account_change_renews_the_version(self):
+        account = Account.restore("Jan", "Kowalski", "89092909825", 100.0, [])
+        changes = [
+            lambda: account.transferIn(10), lambda: account.transferOut(5), lambda: account.expressTransferOut(5),
+            lambda: setattr(account, "first_name", "Anna"), lambda: setattr(account, "last_name", "Nowak"),
+            lambda: setattr(account, "history", []), lambda: account._record_many([1.0], ["incoming"]),
+        ]
+        seen = {account.version}
+        for change in changes:
+            change()
+            assert account.version not in seen
+            seen.add(account.version)
+
+    def test_reads_keep_the_version(self):
+        account = Account.restore("Jan", "Kowalski", "89092909825", 100.0, [])
+        version = account.version
+        account.transferOut(1000)      # refused, nothing changes
+        account.statement().summarize()
+        assert account.version == version
+
+    def test_registry_version_follows_accounts_and_membership(self):
+        registry = AccountRegistry()
+        account = Account.restore("Jan", "Kowalski", "89092909825", 0.0, [])
+        seen = {registry.version}
+        for change in (lambda: registry.add_account(account), lambda: account.transferIn(10),
+                       lambda: setattr(account, "last_name", "Nowak"), lambda: registry.set_balances([(account, 3.0)]),
+                       lambda: registry.delete_account("89092909825"), lambda: registry.add_accounts([account]),
+                       registry.clear):
+            change()
+            assert registry.version not in seen
+            seen.add(registry.version)
+        version = registry.version
+        registry.find_by_pesel("89092909825")
+        registry.page(None, 10)
+        assert registry.version == version
+
+
+class TestSortedBuckets:
+    @pytest.fixture(autouse=True)
+    def small_runs(self, monkeypatch):
+        monkeypatch.setattr(SortedBuckets, "LOAD", 4)
+
+    def test_add_keeps_order_and_splits_runs(self):
+        items = SortedBuckets()
+        for value in [5, 3, 9, 1, 7, 2, 8, 6, 4, 0, 11, 10]:
+            items.add(value)
+        assert list(items) == list(range(12))
+        assert len(items) == 12
+        assert all(len(run) <= 8 for run in items._runs)
+        assert len(items._runs) > 1
+
+    def test_remove_drops_empty_runs(self):
+        items = SortedBuckets(range(10))
+        for value in [0, 1, 2, 3, 9]:
+            items.remove(value)
+        assert list(items) == [4, 5, 6, 7, 8]
+        assert len(items) == 5
+        assert items._maxes == [run[-1] for run in items._runs]
+
+    def test_from_left_and_from_right(self):
+        items = SortedBuckets([1, 3, 3, 5, 7, 9, 11, 13, 15])
+        assert list(items.from_left(3)) == [3, 3, 5, 7, 9, 11, 13, 15]
+        assert list(items.from_right(3)) == [5, 7, 9, 11, 13, 15]
+        assert list(items.from_left(8)) == [9, 11, 13, 15]
+        assert list(items.from_right(15)) == []
+        assert list(items.from_left(16)) == []
+        assert list(SortedBuckets().from_left(0)) == []
+
+    def test_clear(self):
+        items = SortedBuckets(range(5))
+        items.clear()
+        assert list(items) == [] and len(items) == 0
+        items.add(1)
+        assert list(items) == [1]
+
+#testowanie registry pod wieloma wątkami
+class TestAccountRegistryConcurrency:
+    def test_concurrent_adds_do_not_duplicate(self):
+        reg = AccountRegistry()
+        pesels = [f"590314{i:05d}" for i in range(200)]
+
+        def add_all():
+            for pesel in pesels:
+                reg.add_account(Account("Jack", "Doe", pesel, None))
+
+        threads = [threading.Thread(target=add_all) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert reg.account_count() == 200
+        assert len(reg.page(limit=1000)) == 200
+        assert len(reg.find_by_last_name("Doe")) == 200
+
+    def test_concurrent_transfers_are_exact(self):
+        reg = AccountRegistry()
+        accounts = [Account("Jack", "Doe", f"590314{i:05d}", None) for i in range(4)]
+        reg.add_accounts(accounts)
+
+        def transfer_many():
+            for i in range(2000):
+                account = accounts[i % 4]
+                with reg.lock_for(account.pesel):
+                    account.balance += 1
+
+        threads = [threading.Thread(target=transfer_many) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert [a.balance for a in accounts] == [4000.0] * 4
+        assert reg.find_by_balance_range(4000, 4000) == sorted(accounts, key=lambda a: a.pesel)
+
+    def test_account_methods_take_their_stripe(self):
+        reg = AccountRegistry()
+        accounts = [Account("Jack", "Doe", f"590314{i:05d}", None) for i in range(2)]
+        reg.add_accounts(accounts)
+        accounts[1].balance = 1e9
+
+        def transfer_many():
+            for _ in range(5000):
+                accounts[0].transferIn(1)
+                accounts[1].transferOut(1)
+                accounts[1].submit_for_loan(0)
+
+        threads = [threading.Thread(target=transfer_many) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert accounts[0].balance == 20000.0 and len(accounts[0].history) == 20000
+        assert accounts[1].balance == 1e9 - 20000
+        assert reg.find_by_balance_range(20000, 20000) == [accounts[0]]
+
+    def test_balance_writes_do_not_wait_for_the_registry_lock(self, account):
+        reg = AccountRegistry()
+        reg.add_account(account)
+        done = threading.Event()
+        with reg._lock:     # held, as by a bulk load, while another thread transfers
+            writer = threading.Thread(target=lambda: (account.transferIn(10), done.set()))
+            writer.start()
+            assert done.wait(5)
+        writer.join()
+        assert reg.find_by_balance_range(10, 10) == [account]
+        assert len(reg.take_journal()) == 1
+
+    def test_accounts_is_a_snapshot(self):
+        reg = AccountRegistry()
+        reg.add_accounts(Account.restore("Jack", "Doe", f"590314{i:05d}", 0.0, []) for i in range(1000))
+        stop = threading.Event()
+
+        def add_more():
+            for i in range(1000, 20000):
+                if stop.is_set():
+                    return
+                reg.add_account(Account.restore("Jack", "Doe", f"590314{i:05d}", 0.0, []))
+
+        writer = threading.Thread(target=add_more)
+        writer.start()
+        try:
+            for _ in range(50):
+                assert sum(1 for _ in reg.accounts) >= 1000
+        finally:
+            stop.set()
+            writer.join()
+
+    def test_locked_holds_every_stripe(self):
+        reg = AccountRegistry()
+        keys = ["59031412345", "59031425345"]
+        with reg.locked(keys):
+            assert all(reg.lock_for(key).locked() for key in keys)
+        assert not any(reg.lock_for(key).locked() for key in keys)
+
+    def test_set_balance_of_removed_account(self, account):
+        reg = AccountRegistry()
+        reg._set_balance(account, 10.0)
+        assert account.balance == 10.0
+        assert reg.find_by_balance_range() == []
+
+    def test_readers_never_see_a_partial_swap(self):
+        reg = AccountRegistry()
+        reg.add_accounts(Account.restore("Jack", "Doe", f"590314{i:05d}", 0.0, []) for i in range(2000))
+        seen = set()
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                seen.update((reg.account_count(), len(reg.find_by_balance_range()), len(reg.page(limit=5000))))
+                seen.add(len(reg.find_by_last_name("Doe")) or "no Doe")
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        for round_ in range(10):
+            shadow = AccountRegistry()
+            shadow.add_accounts(Account.restore("Jack", "Roe" if round_ % 2 else "Doe", f"590314{i:05d}", 0.0, []) for i in range(2000))
+            reg.swap_in(shadow)
+        done.set()
+        reader.join()
+        assert seen == {2000, "no Doe"}
+
+
+#testowanie podmiany rejestru (ładowanie z bazy)
+class TestSwapIn:
+    def test_replaces_accounts_and_indexes(self):
+        reg = AccountRegistry()
+        old = Account.restore("Jan", "Kowalski", "12345678901", 10.0, [])
+        reg.add_account(old)
+        listener = Mock()
+        reg.subscribe(listener)
+        version = reg.version
+
+        shadow = AccountRegistry()
+        new = [Account.restore("Anna", "Nowak", "98765432109", 5.0, []), CompanyAccount.restore("Firma", "1234567890", 7.0, [])]
+        shadow.add_accounts(new)
+        reg.swap_in(shadow)
+
+        assert reg.accounts == new
+        assert reg.find_by_pesel("12345678901") is None
+        assert reg.find_by_last_name("Nowak") == [new[0]]
+        assert reg.find_by_nip("1234567890") is new[1]
+        assert reg.find_by_balance_range(0, 100) == new
+        assert [reg.key(a) for a in reg.page()] == ["1234567890", "98765432109"]
+        assert reg.take_changes() == ([], []) and reg.take_journal() == []
+        assert reg.version != version
+        assert [call[0] for call in listener.method_calls] == ["on_clear", "on_put", "on_put"]
+        assert shadow.account_count() == 0 and shadow.take_changes() == ([], [])
+
+        old.transferIn(100)     # a request still holding the old account changes nothing here
+        assert reg.find_by_balance_range(0, 100) == new
+        new[0].transferIn(100)
+        assert reg.find_by_balance_range(100, 200) == [new[0]]
+        assert reg.take_changes() == ([new[0]], [])
+
+
 #testowanie walidacji nip
 class TestCompanyAccountNIPValidation:
-    @patch('src.account.requests.get')
+    @patch('src.account.nip_verifier.session.get')
     def test_valid_nip_creates_account(self, mock_get):
         mock_response = Mock()
         mock_response.status_code = 200
@@ -412,7 +854,7 @@ class TestCompanyAccountNIPValidation:
         assert account.nip_number == "1234567890"
         mock_get.assert_called_once()
 
-    @patch('src.account.requests.get')
+    @patch('src.account.nip_verifier.session.get')
     def test_invalid_nip_raises_error(self, mock_get):
         mock_response = Mock()
         mock_response.status_code = 200
@@ -430,7 +872,7 @@ class TestCompanyAccountNIPValidation:
 
         mock_get.assert_called_once()
 
-    @patch('src.account.requests.get')
+    @patch('src.account.nip_verifier.session.get')
     def test_nip_not_found_raises_error(self, mock_get):
         mock_response = Mock()
         mock_response.status_code = 404
@@ -468,7 +910,7 @@ class TestEmailHistory:
         assert result is False
 
     def test_company_account_send_email_success(self, mocker):
-        mock_get = mocker.patch('src.account.requests.get')
+        mock_get = mocker.patch('src.account.nip_verifier.session.get')
         mock_get.return_value.status_code = 200
         mock_get.return_value.json.return_value = {
             "result": {"subject": {"statusVat": "Czynny"}}
@@ -482,7 +924,7 @@ class TestEmailHistory:
         assert result is True
 
     def test_company_account_send_email_failure(self, mocker):
-        mock_get = mocker.patch('src.account.requests.get') #to to mockowanie walidacji nipu
+        mock_get = mocker.patch('src.account.nip_verifier.session.get') #to to mockowanie walidacji nipu
         mock_get.return_value.status_code = 200
         mock_get.return_value.json.return_value = {
             "result": {"subject": {"statusVat": "Czynny"}}
@@ -496,7 +938,7 @@ class TestEmailHistory:
         assert result is False
 
 class TestMongo:
-    def test_save_clears_and_inserts(self, mock_repo):
+    def test_save_upserts_new_accounts(self, mock_repo):
         repo, mock_collection = mock_repo
 
         registry = AccountRegistry()
@@ -505,25 +947,74 @@ class TestMongo:
         registry.add_account(acc1)
         registry.add_account(acc2)
 
-        repo.save_all(registry)
-
-        mock_collection.delete_many.assert_called_once_with({})
-        assert mock_collection.insert_many.call_count == 1
+        assert repo.save_all(registry) == 2
 
-        call_args = mock_collection.insert_many.call_args[0][0]
-        assert len(call_args) == 2
-        assert call_args[0]["pesel"] == "12345678901"
-        assert call_args[1]["pesel"] == "98765432109"
+        mock_collection.delete_many.assert_not_called()
+        mock_collection.create_index.assert_called_once_with("pesel", unique=True)
+        operations = mock_collection.bulk_write.call_args[0][0]
+        assert mock_collection.bulk_write.call_args[1] == {"ordered": False}
+        assert sorted(op._filter["pesel"] for op in operations) == ["12345678901", "98765432109"]
+        assert all(isinstance(op, ReplaceOne) and op._upsert for op in operations)
 
     def test_save_with_empty_reg(self, mock_repo):
         repo, mock_collection = mock_repo
 
         registry = AccountRegistry()
 
+        assert repo.save_all(registry) == 0
+
+        mock_collection.delete_many.assert_not_called()
+        mock_collection.bulk_write.assert_not_called()
+
+    def test_save_sends_only_changes(self, mock_repo):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        accounts = [Account("Jan", "Kowalski", f"1234567890{i}") for i in range(5)]
+        registry.add_accounts(accounts)
+        repo.save_all(registry)
+
+        accounts[0].transferIn(100)
+        accounts[1].first_name = "Janusz"
+        registry.delete_account(accounts[2].pesel)
         repo.save_all(registry)
 
-        mock_collection.delete_many.assert_called_once_with({})
-        mock_collection.insert_many.assert_not_called()
+        operations = mock_collection.bulk_write.call_args[0][0]
+        upserts = sorted(op._filter["pesel"] for op in operations if isinstance(op, ReplaceOne))
+        deletes = [op._filter["pesel"] for op in operations if isinstance(op, DeleteOne)]
+        assert upserts == [accounts[0].pesel, accounts[1].pesel]
+        assert deletes == [accounts[2].pesel]
+        assert repo.save_all(registry) == 0
+
+    def test_failed_save_keeps_changes(self, mock_repo):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        registry.add_account(Account("Jan", "Kowalski", "12345678901"))
+        mock_collection.bulk_write.side_effect = RuntimeError("mongo down")
+
+        with pytest.raises(RuntimeError):
+            repo.save_all(registry)
+
+        mock_collection.bulk_write.side_effect = None
+        assert repo.save_all(registry) == 1
+
+    def test_dirty_tracking_ignores_removed_accounts(self):
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        registry.delete_account(account.pesel)
+        registry.restore_changes([account], [account.pesel])
+        account.history = [10]
+        changed, deleted = registry.take_changes()
+        assert changed == []
+        assert deleted == [account.pesel]
+
+    def test_history_assignment_marks_dirty(self):
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        registry.mark_clean()
+        account.history = [10]
+        assert registry.take_changes() == ([account], [])
 
     def test_load_all_loads_accounts(self,mock_repo):
         repo, mock_collection = mock_repo
@@ -533,7 +1024,7 @@ class TestMongo:
                 "last_name": "White",
                 "pesel": "11111111111",
                 "balance": 500,
-                "history": ["+500"]
+                "history": [500]
             }
         ]
 
@@ -541,3 +1032,507 @@ class TestMongo:
         repo.load_all(registry)
         account = registry.accounts[0]
         assert account.pesel == "11111111111"
+        assert account.balance == 500
+        assert account.history == [500.0]
+        assert registry.take_changes() == ([], [])
+
+    def test_companies_are_saved_and_loaded_by_nip(self, mock_repo):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        company = CompanyAccount.restore("Firma", "1234567890", 0.0, [])
+        registry.add_accounts([Account("Jan", "Kowalski", "12345678901"), company])
+        company.transferIn(100)
+
+        assert repo.save_all(registry) == 2
+        operation = repo.companies.bulk_write.call_args[0][0][0]
+        assert operation._filter == {"nip": "1234567890"}
+        assert operation._doc == {
+            "kind": "company", "company_name": "Firma", "nip": "1234567890",
+            "balance": 100.0, "history_cursor": 1, "history_tail": [100.0],
+        }
+        assert [op._filter for op in mock_collection.bulk_write.call_args[0][0]] == [{"pesel": "12345678901"}]
+        repo.companies.create_index.assert_called_once_with("nip", unique=True)
+
+        registry.delete_account("1234567890")
+        assert repo.save_all(registry) == 1
+        assert [op._filter for op in repo.companies.bulk_write.call_args[0][0]] == [{"nip": "1234567890"}]
+        assert [op._filter for op in mock_collection.bulk_write.call_args[0][0]] == [{"pesel": "1234567890"}]
+
+        mock_collection.find.return_value = []
+        repo.companies.find.return_value = [operation._doc]
+        assert repo.load_all(registry) == 1
+        loaded = registry.find_by_nip("1234567890")
+        assert isinstance(loaded, CompanyAccount)
+        assert (loaded.company_name, loaded.balance, loaded.history, loaded.history.offset) == ("Firma", 100.0, [100.0], 0)
+
+    def test_transfers_feed_the_journal(self):
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        account.transferIn(100)
+        account.transferOut(30)
+        account.expressTransferOut(20)
+
+        journal = registry.take_journal()
+        assert [(pesel, seq, amount, kind) for pesel, seq, amount, kind, _ in journal] == [
+            ("12345678901", 0, 100, "incoming"),
+            ("12345678901", 1, -30, "outgoing"),
+            ("12345678901", 2, -20, "express"),
+            ("12345678901", 3, -1, "fee"),
+        ]
+        assert registry.take_journal() == []
+
+    def test_save_inserts_transactions_and_cursor(self, mock_repo):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        account.transferIn(100)
+
+        repo.save_all(registry)
+
+        repo.transactions.create_index.assert_called_once_with([("pesel", 1), ("seq", 1)], unique=True)
+        inserted = repo.transactions.insert_many.call_args[0][0]
+        assert [(t["pesel"], t["seq"], t["amount"], t["type"]) for t in inserted] == [("12345678901", 0, 100, "incoming")]
+        document = mock_collection.bulk_write.call_args[0][0][0]._doc
+        assert "history" not in document
+        assert document["history_cursor"] == 1
+        assert document["history_tail"] == [100.0]
+
+    def test_save_ignores_already_stored_transactions(self, mock_repo):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        account.transferIn(100)
+        stored = {"pesel": "12345678901", "seq": 0, "amount": 100.0}
+        repo.transactions.insert_many.side_effect = BulkWriteError({"writeErrors": [{"code": 11000, "op": stored}]})
+        repo.transactions.find.return_value = [stored]
+
+        assert repo.save_all(registry) == 1
+        repo.transactions.find.assert_called_once_with(
+            {"$or": [{"pesel": "12345678901", "seq": 0}]}, MongoAccountsRepository.STORED_PROJECTION)
+
+    def test_save_refuses_another_transfer_under_a_stored_seq(self, mock_repo):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        account.transferIn(7)
+        repo.transactions.insert_many.side_effect = BulkWriteError({"writeErrors": [
+            {"code": 11000, "op": {"pesel": "12345678901", "seq": 0, "amount": 7.0}}]})
+        repo.transactions.find.return_value = [{"pesel": "12345678901", "seq": 0, "amount": 100.0}]
+
+        with pytest.raises(BulkWriteError):
+            repo.save_all(registry)
+        assert len(registry.take_journal()) == 1
+
+    def test_deleted_key_loses_its_log_before_a_new_owner_writes(self, mock_repo):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        old = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(old)
+        old.transferIn(100)
+        registry.delete_account("12345678901")
+        assert registry.take_journal() == []
+        old.transferIn(100)
+        new = Account("Anna", "Nowak", "12345678901")
+        registry.add_account(new)
+        new.transferIn(7)
+        order = []
+        repo.transactions.bulk_write.side_effect = lambda batch, ordered: order.append(("purge", batch))
+        repo.transactions.insert_many.side_effect = lambda documents, ordered: order.append(("insert", documents))
+        mock_collection.bulk_write.side_effect = lambda batch, ordered: order.append(("accounts", batch))
+
+        assert repo.save_all(registry) == 2
+        assert [kind for kind, _ in order] == ["purge", "insert", "accounts"]
+        assert order[0][1][0]._filter == {"pesel": "12345678901"}
+        assert [(t["seq"], t["amount"]) for t in order[1][1]] == [(0, 7.0)]
+        assert [type(op).__name__ for op in order[2][1]] == ["ReplaceOne"]     # no DeleteOne for the new owner
+        repo.companies.bulk_write.assert_not_called()
+
+    def test_failed_save_drops_the_journal_of_keys_deleted_meanwhile(self, mock_repo):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        account.transferIn(100)
+
+        def fail(documents, ordered):
+            registry.delete_account("12345678901")
+            raise BulkWriteError({"writeErrors": [{"code": 121}]})
+
+        repo.transactions.insert_many.side_effect = fail
+        with pytest.raises(BulkWriteError):
+            repo.save_all(registry)
+        assert registry.take_journal() == []
+        assert registry.take_changes() == ([], ["12345678901"])
+
+    def test_save_restores_journal_on_failure(self, mock_repo):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        account.transferIn(100)
+        repo.transactions.insert_many.side_effect = BulkWriteError({"writeErrors": [{"code": 121}]})
+
+        with pytest.raises(BulkWriteError):
+            repo.save_all(registry)
+        assert len(registry.take_journal()) == 1
+
+    def test_save_restores_changes_when_documents_fail(self, mock_repo, mocker):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        account.transferIn(100)
+        registry.delete_account("12345678901")
+        registry.add_account(Account("Anna", "Nowak", "98765432109"))
+        mocker.patch.object(MongoAccountsRepository, "_to_document", side_effect=AttributeError("pesel"))
+
+        with pytest.raises(AttributeError):
+            repo.save_all(registry)
+        mock_collection.bulk_write.assert_not_called()
+        changed, deleted = registry.take_changes()
+        assert [a.pesel for a in changed] == ["98765432109"] and deleted == ["12345678901"]
+        assert registry.take_journal() == []    # the deleted account's transfer went with it
+
+    def test_save_journal_only(self, mock_repo):
+        repo, mock_collection = mock_repo
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        registry.mark_clean()
+        registry._journal_entries(account, 0, [5.0], ["incoming"])
+
+        assert repo.save_all(registry) == 0
+        repo.transactions.insert_many.assert_called_once()
+        mock_collection.bulk_write.assert_not_called()
+
+    def test_load_keeps_history_cursor(self, mock_repo):
+        repo, mock_collection = mock_repo
+        mock_collection.find.return_value = [{
+            "first_name": "Walter", "last_name": "White", "pesel": "11111111111", "balance": 500,
+            "history_cursor": 40, "history_tail": [10, 20, 30, 40, 50],
+        }]
+        registry = AccountRegistry()
+        repo.load_all(registry)
+        account = registry.find_by_pesel("11111111111")
+
+        assert account.history.offset == 35
+        assert account.submit_for_loan(100) is True
+        account.transferIn(10)
+        assert registry.take_journal()[0][1] == 40
+
+    def test_statement_pages_in_older_history_from_the_log(self, mock_repo):
+        repo, mock_collection = mock_repo
+        mock_collection.find.return_value = [{
+            "first_name": "Walter", "last_name": "White", "pesel": "11111111111", "balance": 500,
+            "history_cursor": 8, "history_tail": [10, 20, 30, 40, 50],
+        }]
+        log = [{"pesel": "11111111111", "seq": i, "amount": 1.0, "type": "incoming", "timestamp": None} for i in range(8)]
+
+        def find(query, projection):
+            cursor = Mock()
+            seq = query["seq"]
+            cursor.sort.return_value.limit.side_effect = lambda n: [t for t in log if seq["$gt"] < t["seq"] < seq["$lt"]][:n]
+            return cursor
+
+        repo.transactions.find.side_effect = find
+        registry = AccountRegistry()
+        repo.load_all(registry)
+
+        summary = registry.find_by_pesel("11111111111").statement().summarize()
+        assert (summary.count, summary.credits) == (8, 153.0)
+        assert repo.transactions.find.call_args[0][0]["seq"] == {"$gt": -1, "$lt": 3}
+
+    def test_statement_of_older_history_needs_the_log(self):
+        registry = AccountRegistry()
+        registry.add_account(Account.restore("Jan", "Kowalski", "12345678901", 0.0, [1.0], history_offset=3))
+        with pytest.raises(LookupError):
+            registry.find_by_pesel("12345678901").statement().summarize()
+
+    def test_full_journal_keeps_where_transfers_begin(self, monkeypatch):
+        monkeypatch.setattr(AccountRegistry, "JOURNAL_LIMIT", 2 * AccountRegistry.STRIPES)
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        for amount in (100, 200, 300):
+            account.transferIn(amount)
+        account.transferOut(50)
+        account.transferIn(5)
+
+        journal = registry.take_journal()
+        assert [(seq, amount, kind) for _, seq, amount, kind, _ in journal] == [
+            (4, 5, "incoming"), (0, 100, "incoming"), (1, 200, "incoming"), (2, 300, "incoming"), (3, -50, "outgoing"),
+        ]
+        assert [timestamp is None for *_, timestamp in journal] == [False, True, True, True, True]
+        assert registry.take_journal() == []
+
+    def test_iter_history_reads_pages(self, mock_repo):
+        repo, mock_collection = mock_repo
+        log = [{"pesel": "11111111111", "seq": i, "amount": 1.0, "type": "incoming"} for i in range(5)]
+
+        def find(query, projection):
+            cursor = Mock()
+            cursor.sort.return_value.limit.side_effect = lambda n: [t for t in log if t["seq"] > query["seq"]["$gt"]][:n]
+            return cursor
+
+        repo.transactions.find.side_effect = find
+
+        assert [t["seq"] for t in repo.iter_history("11111111111", page_size=2)] == [0, 1, 2, 3, 4]
+        assert repo.transactions.find.call_count == 3
+
+    def test_history_page_window(self, mock_repo):
+        repo, mock_collection = mock_repo
+        start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        repo.transactions.find.return_value.sort.return_value.limit.return_value = []
+        repo.history_page("11111111111", start=start)
+        repo.history_page("11111111111", 4, 10, start, start)
+        queries = [call.args[0] for call in repo.transactions.find.call_args_list]
+        assert queries[0]["timestamp"] == {"$gte": start}
+        assert queries[1] == {"pesel": "11111111111", "seq": {"$gt": 4}, "timestamp": {"$gte": start, "$lt": start}}
+
+    def test_load_all_uses_projection_and_batches(self, mock_repo):
+        repo, mock_collection = mock_repo
+        mock_collection.find.return_value = []
+
+        repo.load_all(AccountRegistry())
+
+        mock_collection.find.assert_called_once_with(
+            {}, MongoAccountsRepository.LOAD_PROJECTION, batch_size=MongoAccountsRepository.LOAD_BATCH_SIZE
+        )
+
+    def test_save_in_batches_with_progress(self, mock_repo, monkeypatch):
+        repo, mock_collection = mock_repo
+        monkeypatch.setattr(MongoAccountsRepository, "SAVE_BATCH_SIZE", 2)
+        sleep = Mock()
+        monkeypatch.setattr(account_module.time, "sleep", sleep)
+        registry = AccountRegistry()
+        accounts = [Account("Jan", "Kowalski", f"1234567890{i}") for i in range(3)]
+        registry.add_accounts(accounts)
+        accounts[0].transferIn(10)
+        progress = []
+
+        assert repo.save_all(registry, lambda done, total: progress.append((done, total)), pause=0.5) == 3
+
+        assert [len(call.args[0]) for call in repo.transactions.insert_many.call_args_list] == [1]
+        assert [len(call.args[0]) for call in mock_collection.bulk_write.call_args_list] == [2, 1]
+        assert progress == [(1, 4), (3, 4), (4, 4)]
+        assert sleep.call_count == 2
+
+    def test_load_reports_progress_and_keeps_the_registry_until_done(self, mock_repo, monkeypatch):
+        repo, mock_collection = mock_repo
+        monkeypatch.setattr(MongoAccountsRepository, "LOAD_BATCH_SIZE", 2)
+        sleep = Mock()
+        monkeypatch.setattr(account_module.time, "sleep", sleep)
+        registry = AccountRegistry()
+        registry.add_account(Account("Jan", "Kowalski", "12345678901"))
+
+        def documents():
+            for i in range(5):
+                assert registry.account_count() == 1 and registry.find_by_pesel("12345678901")
+                yield {"first_name": "Walter", "last_name": "White", "pesel": f"1111111111{i}", "balance": 0, "history": []}
+
+        mock_collection.find.return_value = documents()
+        mock_collection.estimated_document_count.return_value = 4
+        progress = []
+
+        assert repo.load_all(registry, lambda done, total: progress.append((done, total)), pause=0.5) == 5
+        assert progress == [(2, 4), (4, 4), (5, 5)]
+        assert sleep.call_count == 2
+        assert registry.account_count() == 5
+        assert registry.find_by_pesel("12345678901") is None
+
+    def test_restore_skips_validation(self):
+        account = Account.restore("Jan", "Kowalski", "60010112345", 10.0, [10.0])
+        assert account.pesel == "60010112345"
+        assert account.balance == 10.0
+        assert account.history.positive_run == 1
+        assert account.promoCode is None
+
+
+class AsyncCursor:     # what AsyncCollection.find returns, enough for async for
+    def __init__(self, documents):
+        self._documents = iter(documents)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+@pytest.fixture
+def async_repo():
+    repo = AsyncMongoAccountsRepository(client=MagicMock())
+    repo.collection = AsyncMock()
+    repo.companies = AsyncMock()
+    repo.companies.find = MagicMock(side_effect=lambda *args, **kwargs: AsyncCursor([]))
+    repo.companies.estimated_document_count.return_value = 0
+    repo.transactions = AsyncMock()
+    return repo
+
+
+#testowanie asynchronicznego repozytorium (app/asgi.py)
+class TestAsyncMongo:
+    def test_save_writes_changes_and_transactions(self, async_repo):
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        account.transferIn(100)
+
+        assert asyncio.run(async_repo.save_all(registry)) == 1
+        assert asyncio.run(async_repo.save_all(registry)) == 0
+
+        async_repo.collection.create_index.assert_awaited_once_with("pesel", unique=True)
+        async_repo.transactions.create_index.assert_awaited_once()
+        inserted = async_repo.transactions.insert_many.call_args[0][0]
+        assert [(t["pesel"], t["seq"], t["amount"]) for t in inserted] == [("12345678901", 0, 100)]
+        operations = async_repo.collection.bulk_write.call_args[0][0]
+        assert [op._filter["pesel"] for op in operations] == ["12345678901"]
+
+    def test_save_journal_only(self, async_repo):
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "12345678901")
+        registry.add_account(account)
+        registry.mark_clean()
+        registry._journal_entries(account, 0, [5.0], ["incoming"])
+
+        assert asyncio.run(async_repo.save_all(registry)) == 0
+        async_repo.collection.bulk_write.assert_not_awaited()
+
+    def test_failed_save_keeps_changes(self, async_repo):
+        registry = AccountRegistry()
+        registry.add_account(Account("Jan", "Kowalski", "12345678901"))
+        registry.find_by_pesel("12345678901").transferIn(10)
+        async_repo.transactions.insert_many.side_effect = BulkWriteError({"writeErrors": [{"code": 121}]})
+
+        with pytest.raises(BulkWriteError):
+            asyncio.run(async_repo.save_all(registry))
+
+        stored = {"pesel": "12345678901", "seq": 0, "amount": 10.0}
+        async_repo.transactions.insert_many.side_effect = BulkWriteError({"writeErrors": [{"code": 11000, "op": stored}]})
+        async_repo.transactions.find = MagicMock(side_effect=lambda *args, **kwargs: AsyncCursor([stored]))
+        assert asyncio.run(async_repo.save_all(registry)) == 1
+
+    def test_cancelled_save_keeps_changes(self, async_repo):
+        registry = AccountRegistry()
+        registry.add_account(Account("Jan", "Kowalski", "12345678901"))
+        async_repo.collection.bulk_write.side_effect = asyncio.CancelledError    # the job's task cancelled at shutdown
+
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(async_repo.save_all(registry))
+        assert [a.pesel for a in registry.take_changes()[0]] == ["12345678901"]
+
+    def test_load_replaces_the_registry(self, async_repo):
+        async_repo.collection = MagicMock()
+        async_repo.collection.find.return_value = AsyncCursor([{
+            "first_name": "Walter", "last_name": "White", "pesel": "11111111111", "balance": 500,
+            "history_cursor": 40, "history_tail": [10, 20, 30, 40, 50],
+        }])
+        registry = AccountRegistry()
+        registry.add_account(Account("Jan", "Kowalski", "12345678901"))
+
+        assert asyncio.run(async_repo.load_all(registry)) == 1
+        assert [account.pesel for account in registry.accounts] == ["11111111111"]
+        assert registry.find_by_pesel("11111111111").history.offset == 35
+        assert type(registry.transaction_log) is MongoAccountsRepository
+        assert registry.take_changes() == ([], [])
+        async_repo.collection.find.assert_called_once_with(
+            {}, MongoAccountsRepository.LOAD_PROJECTION, batch_size=MongoAccountsRepository.LOAD_BATCH_SIZE
+        )
+
+    def test_companies(self, async_repo):
+        registry = AccountRegistry()
+        registry.add_account(CompanyAccount.restore("Firma", "1234567890", 5.0, []))
+        assert asyncio.run(async_repo.save_all(registry)) == 1
+        document = async_repo.companies.bulk_write.call_args[0][0][0]._doc
+
+        async_repo.collection = MagicMock()
+        async_repo.collection.find.return_value = AsyncCursor([])
+        async_repo.companies.find = MagicMock(return_value=AsyncCursor([document]))
+        assert asyncio.run(async_repo.load_all(registry)) == 1
+        assert registry.find_by_nip("1234567890").company_name == "Firma"
+
+    def test_batches_progress_and_pauses(self, async_repo, monkeypatch):
+        monkeypatch.setattr(MongoAccountsRepository, "SAVE_BATCH_SIZE", 1)
+        monkeypatch.setattr(MongoAccountsRepository, "LOAD_BATCH_SIZE", 1)
+        registry = AccountRegistry()
+        registry.add_accounts([Account("Jan", "Kowalski", "12345678901"), Account("Jan", "Kowalski", "12345678902")])
+        progress = []
+        assert asyncio.run(async_repo.save_all(registry, lambda *p: progress.append(p), pause=0.001)) == 2
+        assert progress == [(1, 2), (2, 2)]
+
+        async_repo.collection = MagicMock()
+        async_repo.collection.estimated_document_count = AsyncMock(return_value=2)
+        async_repo.collection.find.return_value = AsyncCursor([
+            {"first_name": "Walter", "last_name": "White", "pesel": f"1111111111{i}", "balance": 0, "history": []} for i in range(2)
+        ])
+        progress.clear()
+        assert asyncio.run(async_repo.load_all(registry, lambda *p: progress.append(p), pause=0.001)) == 2
+        assert progress == [(1, 2), (2, 2), (2, 2)]
+
+    def test_own_client_per_repository(self, mocker):
+        factory = mocker.patch("src.account.AsyncMongoClient", side_effect=lambda **kwargs: AsyncMock(name="client"))
+        repo = AsyncMongoAccountsRepository()
+        asyncio.run(repo.close())
+        factory.assert_not_called()
+        assert repo.client is repo.client
+        assert AsyncMongoAccountsRepository().client is not repo.client
+        assert factory.call_args.kwargs["host"] == "mongodb://localhost:27017"
+        asyncio.run(repo.close())
+        repo.client.close.assert_awaited_once()
+
+
+#testowanie klienta mongo
+class TestMongoClient:
+    @pytest.fixture
+    def client_factory(self, mocker, monkeypatch):
+        monkeypatch.setattr(account_module, "_mongo_client", None)
+        return mocker.patch("src.account.MongoClient", side_effect=lambda **kwargs: MagicMock(name="client"))
+
+    def test_repository_does_not_connect_until_used(self, client_factory):
+        repo = MongoAccountsRepository()
+        client_factory.assert_not_called()
+        assert repo.collection is repo.client["bank"]["accounts"]
+        assert repo.transactions is repo.client["bank"]["transactions"]
+        assert repo.companies is repo.client["bank"]["companies"]
+        client_factory.assert_called_once()
+
+    def test_repositories_share_one_client_per_process(self, client_factory, monkeypatch):
+        first, second = MongoAccountsRepository(), MongoAccountsRepository()
+        parent = first.client
+        assert second.client is parent
+        monkeypatch.setattr(account_module.os, "getpid", lambda: -1)    # as seen from a forked worker
+        assert first.client is not parent
+        assert first.client is second.client
+        assert client_factory.call_count == 2
+
+    def test_settings_from_environment(self, client_factory, monkeypatch):
+        monkeypatch.setenv("BANK_APP_MONGO_URI", "mongodb://db:27018")
+        monkeypatch.setenv("BANK_APP_MONGO_POOL_SIZE", "8")
+        monkeypatch.setenv("BANK_APP_MONGO_TIMEOUT_MS", "250")
+        monkeypatch.setenv("BANK_APP_MONGO_W", "majority")
+        monkeypatch.setenv("BANK_APP_MONGO_DB", "bank_test")
+        repo = MongoAccountsRepository()
+        repo.collection
+        settings = client_factory.call_args.kwargs
+        assert settings["host"] == "mongodb://db:27018"
+        assert settings["maxPoolSize"] == 8
+        assert settings["serverSelectionTimeoutMS"] == settings["connectTimeoutMS"] == 250
+        assert settings["w"] == "majority"
+        assert repo.database == "bank_test"
+
+    def test_default_write_concern_is_numeric(self, client_factory):
+        MongoAccountsRepository().client
+        assert client_factory.call_args.kwargs["w"] == 1
+
+    def test_explicit_client(self, client_factory):
+        client = MagicMock()
+        repo = MongoAccountsRepository(client=client, database="other")
+        assert repo.collection is client["other"]["accounts"]
+        client_factory.assert_not_called()
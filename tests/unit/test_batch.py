@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+from src.account import Account, AccountRegistry, CompanyAccount
+from src.batch import BatchTransferEngine
+
+
+@pytest.fixture
+def mock_nip_verification(mocker):
+    mock_get = mocker.patch('src.account.nip_verifier.session.get')
+    mock_get.return_value.status_code = 200
+    mock_get.return_value.json.return_value = {"result": {"subject": {"statusVat": "Czynny"}}}
+    return mock_get
+
+
+def make_registry(pesels, balance=0.0):
+    registry = AccountRegistry()
+    for pesel in pesels:
+        account = Account("Batch", "Test", pesel)
+        account.balance = balance
+        registry.add_account(account)
+    return registry
+
+
+def apply_sequentially(registry, transfers):
+    results = []
+    for pesel, transfer_type, amount in transfers:
+        account = registry.find_by_pesel(pesel)
+        if account is None or transfer_type not in ("incoming", "outgoing", "express"):
+            results.append(False)
+            continue
+        before = len(account.history)
+        if transfer_type == "incoming":
+            account.transferIn(amount)
+        elif transfer_type == "outgoing":
+            account.transferOut(amount)
+        else:
+            account.expressTransferOut(amount)
+        results.append(len(account.history) > before)
+    return results
+
+
+class TestBatchTransferEngine:
+    def test_single_account_rules(self):
+        registry = make_registry(["60010112345"])
+        engine = BatchTransferEngine(registry)
+
+        result = engine.apply([
+            ("60010112345", "outgoing", 10.0),
+            ("60010112345", "incoming", 100.0),
+            ("60010112345", "express", 50.0),
+            ("60010112345", "outgoing", 50.0),
+            ("60010112345", "outgoing", 49.0),
+            ("60010112345", "incoming", -5.0),
+            ("60010112345", "wire", 5.0),
+            ("00000000000", "incoming", 5.0),
+        ])
+
+        account = registry.find_by_pesel("60010112345")
+        assert result.tolist() == [False, True, True, False, True, False, False, False]
+        assert account.balance == 0.0
+        assert account.history == [100.0, -50.0, -1.0, -49.0]
+        journal = registry.take_journal()
+        assert [(seq, kind) for _, seq, _, kind, _ in journal] == [(0, "incoming"), (1, "express"), (2, "fee"), (3, "outgoing")]
+
+    def test_company_express_fee(self, mock_nip_verification):
+        registry = AccountRegistry()
+        company = CompanyAccount("XYZ", "1234567890")
+        company.balance = 100.0
+        registry.add_account(company)
+
+        result = BatchTransferEngine(registry).apply([("1234567890", "express", 100.0)])
+
+        assert result.tolist() == [True]
+        assert company.balance == -5.0
+        assert company.history == [-100.0, -5.0]
+
+    def test_empty_and_unknown_batches(self):
+        registry = make_registry(["60010112345"])
+        engine = BatchTransferEngine(registry)
+        assert engine.apply([]).tolist() == []
+        assert engine.apply([("00000000000", "incoming", 5.0)]).tolist() == [False]
+        assert engine.apply([("60010112345", "incoming", 0.0)]).tolist() == [False]
+        assert engine.apply([("60010112345", "outgoing", 5.0)]).tolist() == [False]
+
+    def test_balance_index_is_updated(self):
+        registry = make_registry(["60010112345"])
+        BatchTransferEngine(registry).apply([("60010112345", "incoming", 70.0)])
+        assert [a.pesel for a in registry.find_by_balance_range(70, 70)] == ["60010112345"]
+
+    @pytest.mark.parametrize("accounts,rows", [(50, 2000), (3, 3000)])
+    def test_matches_sequential_transfers(self, accounts, rows):
+        rng = random.Random(accounts * rows)
+        pesels = [f"6001011{i:04d}" for i in range(accounts)]
+        transfers = [
+            (rng.choice(pesels + ["00000000000"]),
+             rng.choice(["incoming", "outgoing", "express", "wire"]),
+             rng.choice([-1.0, 0.0, round(rng.uniform(0.01, 300), 2)]))
+            for _ in range(rows)
+        ]
+        expected_registry = make_registry(pesels, balance=100.0)
+        batch_registry = make_registry(pesels, balance=100.0)
+
+        expected = apply_sequentially(expected_registry, transfers)
+        result = BatchTransferEngine(batch_registry).apply(transfers)
+
+        assert result.tolist() == expected
+        for pesel in pesels:
+            assert batch_registry.find_by_pesel(pesel).balance == expected_registry.find_by_pesel(pesel).balance
+            batch_history = batch_registry.find_by_pesel(pesel).history
+            expected_history = expected_registry.find_by_pesel(pesel).history
+            assert batch_history == expected_history.tolist()
+            assert batch_history.positive_run == expected_history.positive_run
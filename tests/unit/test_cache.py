@@ -0,0 +1,51 @@
+import threading
+
+from src.cache import LRUCache
+
+
+class TestLRUCache:
+    def test_hits_and_misses(self):
+        cache = LRUCache(100)
+        assert cache.get("a") is None
+        cache.put("a", b"1234")
+        assert cache.get("a") == b"1234"
+        assert (cache.hits, cache.misses, cache.size, len(cache)) == (1, 1, 4, 1)
+
+    def test_evicts_least_recently_used_by_size(self):
+        cache = LRUCache(40)
+        for key in "abcd":
+            cache.put(key, b"x" * 10)
+        cache.get("a")
+        cache.put("e", b"x" * 10)
+        assert cache.get("b") is None
+        assert all(cache.get(key) for key in "acde")
+        assert cache.size == 40
+
+    def test_replacing_a_key_keeps_the_size_right(self):
+        cache = LRUCache(100)
+        cache.put("a", b"x" * 20)
+        cache.put("a", b"x" * 5)
+        assert (cache.size, len(cache)) == (5, 1)
+
+    def test_large_values_are_not_kept(self):
+        cache = LRUCache(100)
+        cache.put("big", b"x" * 26)
+        assert cache.get("big") is None
+        cache.put("a", b"x")
+        cache.clear()
+        assert (cache.size, len(cache)) == (0, 0)
+
+    def test_concurrent_use(self):
+        cache = LRUCache(1000)
+
+        def work(n):
+            for i in range(500):
+                cache.put((n, i % 50), b"x" * 10)
+                cache.get((n, (i * 7) % 50))
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert cache.size == 10 * len(cache) <= 1000
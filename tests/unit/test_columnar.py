@@ -0,0 +1,131 @@
+import pytest
+
+from src.account import Account, AccountRegistry, CompanyAccount
+from src.columnar import MappedAccountRegistry, export_registry
+
+
+@pytest.fixture
+def image(tmp_path):
+    registry = AccountRegistry()
+    registry.add_accounts([
+        Account.restore("Jan", "Kowalski", "60010112345", 100.0, [50.0, 50.0], 7),
+        Account.restore("Żaneta", "Kowalski", "60010112346", 0.0, []),
+        Account.restore(None, "Nowak", "60010112347", -5.0, [-5.0]),
+        CompanyAccount.restore("Firma", "1234567890", 250.0, [300.0, -50.0]),
+    ])
+    path = str(tmp_path / "registry.img")
+    assert export_registry(registry, path) == 4
+    return path
+
+
+def state(registry):
+    return sorted(
+        (registry.key(a), getattr(a, "first_name", None), getattr(a, "last_name", None),
+         getattr(a, "company_name", None), a.balance, a.history.offset, a.history.tolist())
+        for a in registry.all_accounts()
+    )
+
+
+class TestRegistryImage:
+    def test_round_trip(self, image):
+        original = AccountRegistry()
+        original.add_accounts([
+            Account.restore("Jan", "Kowalski", "60010112345", 100.0, [50.0, 50.0], 7),
+            Account.restore("Żaneta", "Kowalski", "60010112346", 0.0, []),
+            Account.restore(None, "Nowak", "60010112347", -5.0, [-5.0]),
+            CompanyAccount.restore("Firma", "1234567890", 250.0, [300.0, -50.0]),
+        ])
+        assert state(MappedAccountRegistry(image)) == state(original)
+
+    def test_empty_registry(self, tmp_path):
+        path = str(tmp_path / "empty.img")
+        assert export_registry(AccountRegistry(), path) == 0
+        registry = MappedAccountRegistry(path)
+        assert registry.account_count() == 0
+        assert registry.find_by_pesel("60010112345") is None
+
+    def test_rejects_foreign_file(self, tmp_path):
+        path = tmp_path / "other.img"
+        path.write_bytes(b"\0" * 64)
+        with pytest.raises(ValueError):
+            MappedAccountRegistry(str(path))
+
+
+class TestMappedAccountRegistry:
+    def test_lookups_hydrate_one_account(self, image):
+        registry = MappedAccountRegistry(image)
+        assert registry.account_count() == 4
+        account = registry.find_by_pesel("60010112345")
+        assert account.first_name == "Jan"
+        assert account.history == [50.0, 50.0]
+        assert account.history.offset == 7
+        assert registry.find_by_pesel("60010112345") is account
+        assert registry.find_by_nip("1234567890").company_name == "Firma"
+        assert len(registry._by_pesel) == 2
+        assert registry.account_count() == 4
+
+    def test_missing_keys(self, image):
+        registry = MappedAccountRegistry(image)
+        assert registry.find_by_pesel("60010112399") is None
+        assert registry.find_by_pesel("600101123450000") is None
+        assert registry.find_by_pesel("") is None
+        assert registry.find_by_pesel(None) is None
+        assert registry.find_by_nip("0000000000") is None
+        assert registry.account_count() == 4
+
+    def test_hydrated_accounts_are_clean_until_changed(self, image):
+        registry = MappedAccountRegistry(image)
+        account = registry.find_by_pesel("60010112345")
+        assert registry.take_changes() == ([], [])
+        account.transferIn(10.0)
+        changed, _ = registry.take_changes()
+        assert changed == [account]
+        assert registry.find_by_balance_range(110, 110) == [account]
+
+    def test_queries_over_all_accounts_hydrate_the_rest(self, image):
+        registry = MappedAccountRegistry(image)
+        registry.find_by_pesel("60010112346")
+        assert sorted(a.first_name for a in registry.find_by_last_name("Kowalski")) == ["Jan", "Żaneta"]
+        assert len(registry._by_pesel) == 4
+        assert registry.account_count() == 4
+        assert [registry.key(a) for a in registry.page(limit=10)] == [
+            "1234567890", "60010112345", "60010112346", "60010112347"]
+        assert [a.pesel for a in registry.find_by_balance_range(-10, 0)] == ["60010112347", "60010112346"]
+        assert len(registry.accounts) == 4
+
+    def test_add_and_delete(self, image):
+        registry = MappedAccountRegistry(image)
+        assert not registry.add_account(Account("Jan", "Kowalski", "60010112345"))
+        assert registry.add_account(Account("Anna", "Nowak", "60010112348"))
+        assert registry.delete_account("60010112346")
+        assert not registry.delete_account("60010112346")
+        assert registry.find_by_pesel("60010112346") is None
+        assert registry.account_count() == 4
+        _, deleted = registry.take_changes()
+        assert deleted == ["60010112346"]
+
+    def test_add_accounts_and_clear(self, image):
+        registry = MappedAccountRegistry(image)
+        assert registry.add_accounts([
+            Account.restore("Jan", "Kowalski", "60010112345", 0.0, []),
+            Account.restore("Anna", "Nowak", "60010112348", 0.0, []),
+        ]) == 1
+        assert registry.account_count() == 5
+        registry.clear()
+        assert registry.account_count() == 0
+        assert registry.find_by_pesel("60010112345") is None
+
+    def test_swap_in_replaces_the_image(self, image):
+        registry = MappedAccountRegistry(image)
+        registry.find_by_pesel("60010112345")
+        shadow = AccountRegistry()
+        shadow.add_account(Account.restore("Anna", "Nowak", "60010112348", 0.0, []))
+        registry.swap_in(shadow)
+        assert registry.account_count() == 1
+        assert registry.find_by_pesel("60010112346") is None
+        assert [registry.key(a) for a in registry.page()] == ["60010112348"]
+
+    def test_evaluate_loans_hydrates(self, image):
+        registry = MappedAccountRegistry(image)
+        assert registry.evaluate_loans([("60010112345", 100), ("60010112399", 100)]) == [False, False]
+        assert "60010112345" in registry._by_pesel
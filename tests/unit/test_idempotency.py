@@ -0,0 +1,129 @@
+import json
+import threading
+
+import pytest
+
+from src.idempotency import BUSY, MISMATCH, NEW, REPLAY, FileBackend, IdempotencyStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+class TestIdempotencyStore:
+    def test_first_request_runs_and_retries_replay(self, clock):
+        store = IdempotencyStore(ttl=60, max_keys=10, clock=clock)
+        assert store.begin("k", "f") == (NEW, None)
+        assert store.begin("k", "f") == (BUSY, None)
+        store.finish("k", ({"message": "ok"}, 200))
+        assert store.begin("k", "f") == (REPLAY, ({"message": "ok"}, 200))
+        assert store.begin("k", "other") == (MISMATCH, None)
+        assert len(store) == 1
+
+    def test_entries_expire(self, clock):
+        store = IdempotencyStore(ttl=60, max_keys=10, clock=clock)
+        store.begin("k", "f")
+        store.finish("k", ({}, 200))
+        clock.now += 60
+        assert store.begin("k", "other") == (NEW, None)
+        store.begin("later", "f")
+        clock.now += 61
+        store.begin("last", "f")
+        assert len(store) == 1
+        assert store.evicted == 0
+
+    def test_max_keys_evicts_the_oldest(self, clock):
+        store = IdempotencyStore(ttl=60, max_keys=3, clock=clock)
+        for key in "abcd":
+            store.begin(key, "f")
+            store.finish(key, ({}, 200))
+        assert len(store) == 3
+        assert store.evicted == 1
+        assert store.begin("a", "f") == (NEW, None)
+        assert store.begin("d", "f")[0] == REPLAY
+
+    def test_abandon_lets_a_retry_run(self, clock):
+        store = IdempotencyStore(ttl=60, max_keys=10, clock=clock)
+        store.begin("k", "f")
+        store.abandon("k")
+        assert store.begin("k", "f") == (NEW, None)
+        store.finish("k", ({}, 200))
+        store.abandon("k")      # finished entries stay
+        assert store.begin("k", "f")[0] == REPLAY
+
+    def test_finish_after_eviction_is_ignored(self, clock):
+        store = IdempotencyStore(ttl=60, max_keys=1, clock=clock)
+        store.begin("a", "f")
+        store.begin("b", "f")
+        store.finish("a", ({}, 200))
+        assert store.begin("a", "f") == (NEW, None)
+
+    def test_defaults_from_environment(self, monkeypatch):
+        monkeypatch.setenv("BANK_APP_IDEMPOTENCY_TTL", "5")
+        monkeypatch.setenv("BANK_APP_IDEMPOTENCY_MAX_KEYS", "7")
+        store = IdempotencyStore()
+        assert (store.ttl, store.max_keys) == (5.0, 7)
+        store.close()
+
+    def test_concurrent_retries_run_once(self, clock):
+        store = IdempotencyStore(ttl=60, max_keys=100, clock=clock)
+        runs = []
+
+        def work():
+            for i in range(200):
+                state, _ = store.begin(f"k{i % 20}", "f")
+                if state == NEW:
+                    runs.append(i % 20)
+                    store.finish(f"k{i % 20}", ({}, 200))
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(runs) == list(range(20))
+
+
+class TestFileBackend:
+    def test_responses_survive_a_restart(self, clock, tmp_path):
+        path = str(tmp_path / "idempotency.log")
+        store = IdempotencyStore(ttl=60, max_keys=10, backend=FileBackend(path), clock=clock)
+        store.begin("done", "f")
+        store.finish("done", ({"message": "ok"}, 200))
+        store.begin("running", "f")
+        store.close()
+
+        store = IdempotencyStore(ttl=60, max_keys=10, backend=FileBackend(path), clock=clock)
+        assert store.begin("done", "f") == (REPLAY, ({"message": "ok"}, 200))
+        assert store.begin("running", "f") == (NEW, None)
+        store.close()
+
+    def test_load_drops_expired_and_torn_lines(self, clock, tmp_path):
+        path = tmp_path / "idempotency.log"
+        path.write_text(
+            json.dumps(["old", "f", [{}, 200], clock.now - 1]) + "\n"
+            + json.dumps(["kept", "f", [{}, 201], clock.now + 10]) + "\n"
+            + '["torn", "f", [{}, 2'
+        )
+        assert FileBackend(str(path)).load(clock.now) == [("kept", "f", ({}, 201), clock.now + 10)]
+        assert path.read_text() == json.dumps(["kept", "f", [{}, 201], clock.now + 10]) + "\n"
+
+    def test_load_keeps_max_keys(self, clock, tmp_path):
+        path = str(tmp_path / "idempotency.log")
+        backend = FileBackend(path)
+        for i in range(5):
+            backend.save(f"k{i}", "f", ({}, 200), clock.now + 10)
+        backend.close()
+        backend.close()
+        store = IdempotencyStore(ttl=60, max_keys=2, backend=FileBackend(path), clock=clock)
+        assert len(store) == 2
+        assert store.begin("k4", "f")[0] == REPLAY
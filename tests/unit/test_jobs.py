@@ -0,0 +1,104 @@
+import asyncio
+import threading
+
+from src.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue
+
+
+def wait(job, states=(DONE, FAILED)):
+    for _ in range(500):
+        if job.state in states:
+            return job
+        threading.Event().wait(0.01)
+    raise AssertionError(f"{job.kind} job still {job.state}")
+
+
+class TestJobQueue:
+    def test_runs_work_in_the_background(self):
+        jobs = JobQueue()
+        release, halfway = threading.Event(), threading.Event()
+
+        def work(job):
+            job.progress(1, 2)
+            halfway.set()
+            release.wait()
+            job.progress(2)
+            return {"saved": 2}
+
+        job = jobs.submit("save", work)
+        assert jobs.get(job.id) is job
+        halfway.wait()
+        assert (job.state, job.done, job.total) == (RUNNING, 1, 2)
+        release.set()
+        assert wait(job).result == {"saved": 2}
+        status = job.to_dict()
+        assert (status["type"], status["status"], status["done"], status["total"], status["error"]) == ("save", DONE, 2, 2, None)
+        assert status["created"] <= status["started"] <= status["finished"]
+        jobs.close()
+        jobs.close()
+
+    def test_failures_are_reported(self):
+        jobs = JobQueue()
+
+        def work(job):
+            raise ConnectionError("mongo down")
+
+        job = wait(jobs.submit("load", work))
+        assert job.state == FAILED
+        assert job.error == "ConnectionError: mongo down"
+        assert job.to_dict()["finished"] is not None
+        jobs.close()
+
+    def test_one_at_a_time_and_queued_jobs_are_shared(self):
+        jobs = JobQueue()
+        release = threading.Event()
+        order = []
+
+        def slow(job):
+            release.wait()
+            order.append(job.kind)
+
+        first = wait(jobs.submit("save", slow), [RUNNING])
+        load = jobs.submit("load", lambda job: order.append(job.kind))
+        second = jobs.submit("save", lambda job: order.append("second save"))
+        assert jobs.submit("save", lambda job: None) is second is not first
+        assert jobs.submit("load", lambda job: None) is load
+        assert load.state == QUEUED
+        release.set()
+        jobs.close()
+        assert order == ["save", "load", "second save"]
+        assert [job.id for job in jobs.jobs()] == [second.id, load.id, first.id]
+
+    def test_keeps_the_newest_finished_jobs(self):
+        jobs = JobQueue(keep=2)
+        submitted = []
+        for i in range(5):
+            submitted.append(wait(jobs.submit("save", lambda job: {})))
+        jobs.close()
+        assert [job.id for job in jobs.jobs()] == [job.id for job in reversed(submitted[2:])]
+        assert jobs.get(submitted[0].id) is None
+
+    def test_coroutine_jobs(self):
+        jobs = JobQueue()
+        order = []
+
+        async def work(job):
+            order.append(("start", job.kind))
+            await asyncio.sleep(0.01)
+            job.progress(5, 5)
+            order.append(("end", job.kind))
+            if job.kind == "load":
+                raise ValueError("bad document")
+            return {"saved": 5}
+
+        async def main():
+            save = jobs.submit_async("save", work)
+            load = jobs.submit_async("load", work)
+            assert jobs.submit_async("load", work) is load
+            while jobs._tasks:
+                await asyncio.sleep(0.01)
+            return save, load
+
+        save, load = asyncio.run(main())
+        assert (save.state, save.result, save.done) == (DONE, {"saved": 5}, 5)
+        assert (load.state, load.error) == (FAILED, "ValueError: bad document")
+        assert order == [("start", "save"), ("end", "save"), ("start", "load"), ("end", "load")]
@@ -0,0 +1,102 @@
+import io
+import json
+import logging
+import threading
+
+import pytest
+
+from src import logs
+from src.logs import BufferedHandler, configure_logging, mask, sample_request, shutdown_logging
+
+
+@pytest.fixture
+def output():
+    stream = io.StringIO()
+    yield stream
+    shutdown_logging()
+    sample_request(1)
+
+
+def lines(stream):
+    shutdown_logging()      # waits for the writer thread
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class TestMask:
+    def test_pesel_and_nip(self):
+        assert mask("pesel 89092909825, nip 8461627563") == "pesel ********825, nip *******563"
+
+    def test_dashed_nip(self):
+        assert mask("NIP 846-162-75-63.") == "NIP *******563."
+
+    def test_other_numbers_stay(self):
+        assert mask("amount 123456789, id 123456789012, balance 500.0") == "amount 123456789, id 123456789012, balance 500.0"
+
+
+class TestLogging:
+    def test_json_lines_with_extras_masked(self, output):
+        configure_logging("INFO", 1, output)
+        log = logging.getLogger("bank.test")
+        log.info("Find account with pesel: %s", "89092909825", extra={"path": "/api/accounts/89092909825", "status": 200})
+        log.debug("not at INFO")
+        [entry] = lines(output)
+        assert entry["level"] == "INFO"
+        assert entry["logger"] == "bank.test"
+        assert entry["msg"] == "Find account with pesel: ********825"
+        assert entry["path"] == "/api/accounts/********825"
+        assert entry["status"] == 200
+        assert entry["ts"].endswith("+00:00")
+
+    def test_exceptions(self, output):
+        configure_logging("INFO", 1, output)
+        try:
+            raise ValueError("bad nip 8461627563")
+        except ValueError:
+            logging.getLogger("bank.test").exception("failed")
+        [entry] = lines(output)
+        assert "ValueError: bad nip *******563" in entry["exc"]
+
+    def test_unsampled_requests_keep_only_warnings(self, output):
+        configure_logging("DEBUG", 0, output)
+        log = logging.getLogger("bank.test")
+        assert not sample_request()
+        log.info("dropped")
+        log.warning("kept")
+        assert sample_request(1)
+        log.debug("kept too")
+        assert [entry["msg"] for entry in lines(output)] == ["kept", "kept too"]
+
+    def test_sampling_is_per_request_context(self, output):
+        configure_logging("INFO", 0, output)
+        sample_request()
+        worker = threading.Thread(target=logging.getLogger("bank.test").info, args=("outside any request",))
+        worker.start()
+        worker.join()
+        assert [entry["msg"] for entry in lines(output)] == ["outside any request"]
+
+    def test_defaults_from_environment(self, output, monkeypatch):
+        monkeypatch.setenv("BANK_APP_LOG_LEVEL", "warning")
+        monkeypatch.setenv("BANK_APP_LOG_SAMPLE", "0.5")
+        configure_logging(stream=output)
+        assert logging.getLogger("bank").level == logging.WARNING
+        assert logs._rate == 0.5
+
+    def test_reconfiguring_replaces_the_handler(self, output):
+        configure_logging("INFO", 1, output)
+        handler = configure_logging("INFO", 1, output)
+        assert logging.getLogger("bank").handlers == [handler]
+        logging.getLogger("bank").info("once")
+        assert len(lines(output)) == 1
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = BufferedHandler(maxsize=2)
+        log = logging.getLogger("bank.unwired")
+        log.addHandler(handler)
+        try:
+            for i in range(5):
+                log.warning("record %d", i)
+        finally:
+            log.removeHandler(handler)
+        assert handler.queue.qsize() == 2
+        assert handler.dropped == 3
+        assert handler.queue.get().getMessage() == "record 0"      # handed over unformatted
@@ -0,0 +1,224 @@
+import email
+import email.header
+import io
+import smtplib
+import socket
+import threading
+import time
+
+from src.account import Account, AccountRegistry
+from src.mailer import MailQueue, default_client
+from smtp.smtp import SMTPClient, SMTPConnection
+
+
+class FakeClient:
+    def __init__(self, outcomes=()):
+        self.outcomes = list(outcomes)     # results to return first (True/False or an exception), then True
+        self.sent = []
+        self.closed = False
+
+    def send(self, subject, text, email_address, attachments=()):
+        outcome = self.outcomes.pop(0) if self.outcomes else True
+        if isinstance(outcome, Exception):
+            raise outcome
+        if outcome:
+            self.sent.append((subject, text, email_address))
+            self.attachments = [(name, opener().read()) for name, opener in attachments]
+        return outcome
+
+    def close(self):
+        self.closed = True
+
+
+class TestSMTPConnection:
+    def test_reuses_one_connection(self, smtp_server):
+        client = SMTPConnection()
+        assert all(client.send("Subject", f"text {i}", "jan@example.com") for i in range(3))
+        client.close()
+        assert smtp_server.connections == 1
+        assert len(smtp_server.messages) == 3
+        assert b"Subject: Subject" in smtp_server.messages[0]
+        assert b"To: jan@example.com" in smtp_server.messages[0]
+
+    def test_non_ascii_text(self, smtp_server):
+        client = SMTPConnection()
+        assert client.send("Wyciąg", "Zażółć gęślą jaźń", "jan@example.com")
+        client.close()
+        assert b'charset="utf-8"' in smtp_server.messages[0]
+
+    def test_reconnects_after_the_server_hangs_up(self, smtp_server):
+        client = SMTPConnection()
+        smtp_server.drop_after_message = True
+        assert client.send("a", "a", "jan@example.com")
+        assert client.send("b", "b", "jan@example.com")
+        assert smtp_server.connections == 2
+        client.close()
+
+    def test_failures(self, smtp_server):
+        client = SMTPConnection()
+        assert not client.send("a", "a", "reject@example.com")
+        smtp_server.fail_next = 1
+        assert not client.send("a", "a", "jan@example.com")
+        assert client.send("a", "a", "jan@example.com")
+        client.close()
+        client.close()
+
+    def test_streams_attachments(self, smtp_server, monkeypatch):
+        monkeypatch.setattr("smtp.smtp.ATTACHMENT_CHUNK", 57)
+        payload = b"seq,amount\r\n" + b".1,2\r\n" * 100
+        client = SMTPConnection()
+        assert client.send("Wyciąg", ".leading dot", "jan@example.com", [("history.csv", lambda: io.BytesIO(payload))])
+        client.close()
+        message = email.message_from_bytes(smtp_server.messages[0].replace(b"\r\n..", b"\r\n."))
+        assert str(email.header.make_header(email.header.decode_header(message["Subject"]))) == "Wyciąg"
+        body, attachment = message.get_payload()
+        assert body.get_payload() == ".leading dot"
+        assert attachment.get_content_type() == "text/csv"
+        assert attachment.get_filename() == "history.csv"
+        assert attachment.get_payload(decode=True) == payload
+
+    def test_attachment_failures(self, smtp_server):
+        client = SMTPConnection()
+        opener = lambda: io.BytesIO(b"x")
+        assert not client.send("a", "a", "reject@example.com", [("a.bin", opener)])
+        smtp_server.fail_next = 1
+        assert not client.send("a", "a", "jan@example.com", [("a.bin", opener)])
+        assert client.send("a", "a", "jan@example.com", [("a.bin", opener)])
+        client.close()
+        assert b"Content-Type: application/octet-stream" in smtp_server.messages[0]
+
+    def test_unreachable_server(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        assert not SMTPConnection("127.0.0.1", port, timeout=1).send("a", "a", "jan@example.com")
+
+
+class TestMailQueue:
+    def test_delivers_with_one_client_per_worker(self):
+        clients = []
+
+        def factory():
+            clients.append(FakeClient())
+            return clients[-1]
+
+        with MailQueue(factory, workers=3) as mailer:
+            futures = [mailer.submit("s", f"t{i}", "jan@example.com") for i in range(30)]
+        assert all(future.result() for future in futures)
+        assert len(clients) == 3
+        assert sum(len(client.sent) for client in clients) == 30
+        assert all(client.closed for client in clients)
+        assert (mailer.sent, mailer.failed) == (30, 0)
+        assert mailer.rate() > 0
+
+    def test_retries_with_backoff(self, mocker):
+        sleep = mocker.patch("src.mailer.time.sleep")
+        client = FakeClient([False, smtplib.SMTPServerDisconnected(), True])
+        with MailQueue(lambda: client, workers=1, retries=3, backoff=0.5) as mailer:
+            assert mailer.submit("s", "t", "jan@example.com").result()
+        assert [call.args[0] for call in sleep.call_args_list] == [0.5, 1.0]
+        assert (mailer.sent, mailer.failed, mailer.retried) == (1, 0, 2)
+
+    def test_gives_up_after_retries(self):
+        client = FakeClient([False, OSError(), False])
+        with MailQueue(lambda: client, workers=1, retries=2, backoff=0) as mailer:
+            assert not mailer.submit("s", "t", "jan@example.com").result()
+            assert mailer.submit("s", "t", "jan@example.com").result()
+        assert (mailer.sent, mailer.failed, mailer.retried) == (1, 1, 2)
+
+    def test_unexpected_errors_fail_only_their_message(self):
+        client = FakeClient([LookupError("no transaction log")])
+        with MailQueue(lambda: client, workers=1, backoff=0) as mailer:
+            assert not mailer.submit("s", "t", "jan@example.com").result(5)
+            assert mailer.submit("s", "t", "jan@example.com").result(5)
+        assert (mailer.sent, mailer.failed, mailer.retried) == (1, 1, 0)
+
+    def test_client_factory_failures_fail_messages_until_a_client_is_made(self):
+        outcomes = [RuntimeError("no server"), RuntimeError("no server")]
+
+        def factory():
+            if outcomes:
+                raise outcomes.pop(0)
+            return FakeClient()
+
+        with MailQueue(factory, workers=1) as mailer:
+            assert not mailer.submit("s", "t", "jan@example.com").result(5)
+            assert mailer.submit("s", "t", "jan@example.com").result(5)
+        assert (mailer.sent, mailer.failed) == (1, 1)
+
+    def test_submit_blocks_while_the_queue_is_full(self):
+        release = threading.Event()
+
+        class SlowClient(FakeClient):
+            def send(self, *args):
+                release.wait()
+                return True
+
+        mailer = MailQueue(SlowClient, workers=1, maxsize=1)
+        mailer.submit("s", "t", "a")     # taken by the worker
+        time.sleep(0.05)
+        mailer.submit("s", "t", "b")     # fills the queue
+        blocked = threading.Thread(target=mailer.submit, args=("s", "t", "c"))
+        blocked.start()
+        time.sleep(0.05)
+        assert blocked.is_alive()
+        release.set()
+        blocked.join()
+        mailer.close()
+        assert mailer.sent == 3
+
+    def test_default_client(self, monkeypatch):
+        monkeypatch.delenv("BANK_APP_SMTP_HOST", raising=False)
+        assert isinstance(default_client(), SMTPClient)
+        monkeypatch.setenv("BANK_APP_SMTP_HOST", "127.0.0.1")
+        assert isinstance(default_client(), SMTPConnection)
+
+    def test_placeholder_client_without_close(self, mocker):
+        mocker.patch("src.mailer.SMTPClient.send", return_value=True)
+        with MailQueue(SMTPClient, workers=1) as mailer:
+            assert mailer.submit("s", "t", "jan@example.com").result()
+
+
+class TestSendAllStatements:
+    def test_sends_to_accounts_with_an_address(self, smtp_server):
+        registry = AccountRegistry()
+        registry.add_accounts(Account.restore("Jan", "Kowalski", f"6001011{i:04d}", 0.0, [float(i)]) for i in range(5))
+        addresses = {"60010110001": "jan1@example.com", "60010110003": "reject@example.com", "99999999999": "x@example.com"}
+        assert registry.send_all_statements(addresses) == (1, 1)
+        assert len(smtp_server.messages) == 1
+        assert b"Personal account history\nTransfers: 1\nCredits: 1.00" in smtp_server.messages[0]
+
+    def test_attaches_the_history_as_csv(self):
+        registry = AccountRegistry()
+        registry.add_account(Account.restore("Jan", "Kowalski", "60010112345", 0.0, [5.0, -2.0]))
+        client = FakeClient()
+        with MailQueue(lambda: client, workers=1) as mailer:
+            assert registry.send_all_statements({"60010112345": "jan@example.com"}, mailer, attach_csv=True) == (1, 0)
+        assert client.attachments == [("history.csv", b"seq,timestamp,type,amount\r\n0,,incoming,5.0\r\n1,,outgoing,-2.0\r\n")]
+
+    def test_a_retry_gets_the_whole_csv_again(self):
+        registry = AccountRegistry()
+        registry.add_account(Account.restore("Jan", "Kowalski", "60010112345", 0.0, [5.0, -2.0]))
+        opened = []
+
+        class RenderingClient(FakeClient):
+            def send(self, subject, text, email_address, attachments=()):
+                opened.extend(opener().read() for _, opener in attachments)
+                return super().send(subject, text, email_address, attachments)
+
+        client = RenderingClient([False])
+        with MailQueue(lambda: client, workers=1, backoff=0) as mailer:
+            assert registry.send_all_statements({"60010112345": "jan@example.com"}, mailer, attach_csv=True) == (1, 0)
+        csv = b"seq,timestamp,type,amount\r\n0,,incoming,5.0\r\n1,,outgoing,-2.0\r\n"
+        assert opened == [csv, csv]
+        assert client.attachments == [("history.csv", csv)]
+
+    def test_walks_every_page_with_a_given_mailer(self):
+        registry = AccountRegistry()
+        registry.add_accounts(Account.restore("Jan", "Kowalski", f"600101{i:05d}", 0.0, []) for i in range(2500))
+        client = FakeClient()
+        with MailQueue(lambda: client, workers=1) as mailer:
+            addresses = {f"600101{i:05d}": f"{i}@example.com" for i in range(0, 2500, 100)}
+            assert registry.send_all_statements(addresses, mailer) == (25, 0)
+            assert mailer.submit("s", "t", "still open").result()
+        assert len(client.sent) == 26
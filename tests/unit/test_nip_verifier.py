@@ -0,0 +1,174 @@
+import asyncio
+from datetime import date
+
+import pytest
+import requests
+
+from src.account import CompanyAccount
+from src.nip_verifier import AsyncNipVerifier, NipVerifier
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestNipVerifier:
+    def test_statuses(self, stub_mf):
+        verifier = NipVerifier()
+        assert verifier.is_active("1234567890")
+        assert not verifier.is_active("9999999999")
+        assert verifier.status("9999999999") == "Zwolniony"
+        assert verifier.status("5555555555") is None
+        assert verifier.status("4444444444") is None
+
+    def test_repeated_lookups_are_cached_per_date(self, stub_mf):
+        verifier = NipVerifier()
+        for _ in range(3):
+            verifier.is_active("1234567890")
+        verifier.is_active("1234567890", date(2024, 1, 2))
+        assert len(stub_mf.requests) == 2
+        assert stub_mf.requests[0][0] == f"/api/search/nip/1234567890?date={date.today():%Y-%m-%d}"
+        assert stub_mf.requests[1][0] == "/api/search/nip/1234567890?date=2024-01-02"
+
+    def test_session_reuses_connections(self, stub_mf):
+        verifier = NipVerifier()
+        for nip in ("1234567890", "9999999999", "5555555555"):
+            verifier.status(nip)
+        assert len({address for _, address in stub_mf.requests}) == 1
+
+    def test_positive_and_negative_ttl(self, stub_mf):
+        clock = FakeClock()
+        verifier = NipVerifier(ttl=100, negative_ttl=10, clock=clock)
+        verifier.status("1234567890")
+        verifier.status("5555555555")
+        clock.now = 50
+        verifier.status("1234567890")
+        verifier.status("5555555555")
+        assert len(stub_mf.requests) == 3      # only the negative entry expired
+        clock.now = 150
+        verifier.status("1234567890")
+        assert len(stub_mf.requests) == 4
+
+    def test_server_errors_are_not_cached(self, stub_mf):
+        verifier = NipVerifier()
+        assert verifier.status("5000000000") is None
+        assert verifier.status("5000000000") is None
+        assert len(stub_mf.requests) == 2
+
+    def test_lru_eviction(self, stub_mf):
+        verifier = NipVerifier(max_entries=2)
+        verifier.status("1234567890")
+        verifier.status("9999999999")
+        verifier.status("1234567890")      # now most recently used
+        verifier.status("5555555555")      # evicts 9999999999
+        assert len(verifier._cache) == 2
+        verifier.status("1234567890")
+        verifier.status("9999999999")
+        assert len(stub_mf.requests) == 4
+
+    def test_timeout(self, stub_mf):
+        verifier = NipVerifier(timeout=0.1)
+        with pytest.raises(requests.Timeout):
+            verifier.status("7777777777")
+        assert verifier._cache == {}
+
+    def test_settings_from_environment(self, monkeypatch):
+        monkeypatch.setenv("BANK_APP_MF_TIMEOUT", "2.5")
+        monkeypatch.setenv("BANK_APP_MF_CACHE_TTL", "60")
+        monkeypatch.setenv("BANK_APP_MF_NEGATIVE_TTL", "6")
+        monkeypatch.setenv("BANK_APP_MF_CACHE_SIZE", "50")
+        verifier = NipVerifier()
+        assert (verifier.timeout, verifier.ttl, verifier.negative_ttl, verifier.max_entries) == (2.5, 60, 6, 50)
+
+    def test_company_accounts_share_the_cache(self, stub_mf):
+        CompanyAccount("Firma", "1234567890")
+        CompanyAccount("Firma 2", "1234567890")
+        with pytest.raises(ValueError, match="Company not registered!!"):
+            CompanyAccount("Zamknięta", "9999999999")
+        assert len(stub_mf.requests) == 2
+
+
+class TestNipVerifierBatches:
+    def test_statuses_in_batches(self, stub_mf):
+        verifier = NipVerifier()
+        nips = [f"{i:010d}" for i in range(65)] + ["1234567890", "9999999999", "1234567890"]
+        statuses = verifier.statuses(nips)
+        assert len(statuses) == 67
+        assert statuses["1234567890"] == "Czynny"
+        assert statuses["9999999999"] == "Zwolniony"
+        assert statuses["0000000001"] is None
+        assert len(stub_mf.requests) == 3
+        assert all(path.startswith("/api/search/nips/") for path, _ in stub_mf.requests)
+
+    def test_statuses_use_and_fill_the_cache(self, stub_mf):
+        verifier = NipVerifier()
+        verifier.status("1234567890")
+        assert verifier.statuses(["1234567890", "9999999999"]) == {"1234567890": "Czynny", "9999999999": "Zwolniony"}
+        assert verifier.statuses(["1234567890", "9999999999"]) == {"1234567890": "Czynny", "9999999999": "Zwolniony"}
+        assert verifier.status("9999999999") == "Zwolniony"
+        assert len(stub_mf.requests) == 2
+        assert verifier.statuses([]) == {}
+
+    def test_failed_batches_are_left_out(self, stub_mf):
+        verifier = NipVerifier(timeout=0.1)
+        statuses = verifier.statuses(["5000000000", "1234567890"] + [f"{i:010d}" for i in range(40)] + ["7777777777"])
+        assert "5000000000" not in statuses and "1234567890" not in statuses
+        assert "7777777777" not in statuses
+        assert verifier.statuses(["5000000000"]) == {}
+        assert len(verifier._cache) == 0
+
+
+def run(verifier, *calls):      # awaits calls(verifier) in order on one event loop, then closes the client
+    async def main():
+        try:
+            return [await call(verifier) for call in calls]
+        finally:
+            await verifier.aclose()
+    return asyncio.run(main())
+
+
+class TestAsyncNipVerifier:
+    def test_statuses_and_cache(self, stub_mf):
+        results = run(
+            AsyncNipVerifier(),
+            lambda v: v.is_active("1234567890"),
+            lambda v: v.status("9999999999"),
+            lambda v: v.status("4444444444"),
+            lambda v: v.status("5000000000"),
+            lambda v: v.is_active("1234567890"),
+        )
+        assert results == [True, "Zwolniony", None, None, True]
+        assert len(stub_mf.requests) == 4
+
+    def test_server_errors_are_not_cached(self, stub_mf):
+        verifier = AsyncNipVerifier()
+        run(verifier, lambda v: v.status("5000000000"), lambda v: v.status("5000000000"))
+        assert len(stub_mf.requests) == 2
+        assert verifier._cache == {}
+
+    def test_timeout(self, stub_mf):
+        verifier = AsyncNipVerifier(timeout=0.1)
+        with pytest.raises(asyncio.TimeoutError):
+            run(verifier, lambda v: v.status("7777777777"))
+        assert verifier._cache == {}
+        asyncio.run(verifier.aclose())      # closed already
+
+    def test_statuses_in_concurrent_batches(self, stub_mf):
+        verifier = AsyncNipVerifier(pool_size=2)
+        nips = [f"{i:010d}" for i in range(65)] + ["1234567890", "9999999999"]
+        first, second = run(verifier, lambda v: v.statuses(nips), lambda v: v.statuses(["1234567890"]))
+        assert len(first) == 67
+        assert first["1234567890"] == "Czynny" and first["0000000001"] is None
+        assert second == {"1234567890": "Czynny"}
+        assert len(stub_mf.requests) == 3
+        assert len({address for _, address in stub_mf.requests}) <= 2
+
+    def test_failed_batches_are_left_out(self, stub_mf):
+        verifier = AsyncNipVerifier(timeout=0.1)
+        statuses, = run(verifier, lambda v: v.statuses(["5000000000", "1234567890"] + [f"{i:010d}" for i in range(40)] + ["7777777777"]))
+        assert "5000000000" not in statuses and "1234567890" not in statuses
+        assert "7777777777" not in statuses
+        assert len(verifier._cache) == 0
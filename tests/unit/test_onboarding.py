@@ -0,0 +1,58 @@
+import asyncio
+
+from src.account import AccountRegistry, CompanyAccount
+from src.nip_verifier import AsyncNipVerifier
+from src.onboarding import CREATED, EXISTS, INVALID_NIP, NOT_REGISTERED, UNAVAILABLE, onboard_companies, onboard_companies_async
+
+
+class TestOnboardCompanies:
+    def test_results_follow_input_order(self, stub_mf):
+        registry = AccountRegistry()
+        registry.add_account(CompanyAccount.restore("Stara", "1111111111", 0.0, []))
+        results = onboard_companies(registry, [
+            ("Firma", "1234567890"),
+            ("Zwolniona", "9999999999"),
+            ("Krótki", "123"),
+            ("Litery", "12345abcde"),
+            ("Brak", None),
+            ("Firma bis", "1234567890"),
+        ])
+        assert results == [CREATED, NOT_REGISTERED, INVALID_NIP, INVALID_NIP, INVALID_NIP, EXISTS]
+        company = registry.find_by_nip("1234567890")
+        assert company.company_name == "Firma"
+        assert company.balance == 0.0 and company.history == []
+        assert registry.account_count() == 2
+        assert len(stub_mf.requests) == 1
+
+    def test_existing_accounts(self, mocker):
+        registry = AccountRegistry()
+        mocker.patch("src.account.nip_verifier.statuses", return_value={"1111111111": "Czynny"})
+        registry.add_account(CompanyAccount.restore("Stara", "1111111111", 0.0, []))
+        assert onboard_companies(registry, [("Nowa", "1111111111")]) == [EXISTS]
+        assert registry.find_by_nip("1111111111").company_name == "Stara"
+
+    def test_unavailable_registry(self, stub_mf):
+        registry = AccountRegistry()
+        assert onboard_companies(registry, [("Firma", "5000000000"), ("Firma", "1234567890")]) == [UNAVAILABLE, UNAVAILABLE]
+        assert registry.account_count() == 0
+
+    def test_new_companies_are_changes(self, stub_mf):
+        registry = AccountRegistry()
+        onboard_companies(registry, [("Firma", "1234567890")])
+        changed, _ = registry.take_changes()
+        assert [registry.key(account) for account in changed] == ["1234567890"]
+
+    def test_async_onboarding(self, stub_mf):
+        registry = AccountRegistry()
+        companies = [("Firma", "1234567890"), ("Zwolniona", "9999999999"), ("Krótki", "123"), ("Firma bis", "1234567890")]
+
+        async def onboard():
+            verifier = AsyncNipVerifier()
+            try:
+                return await onboard_companies_async(registry, companies, verifier)
+            finally:
+                await verifier.aclose()
+
+        assert asyncio.run(onboard()) == [CREATED, NOT_REGISTERED, INVALID_NIP, EXISTS]
+        assert registry.find_by_nip("1234567890").company_name == "Firma"
+        assert len(stub_mf.requests) == 1
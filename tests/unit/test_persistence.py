@@ -0,0 +1,327 @@
+import os
+import threading
+import time
+
+import pytest
+
+from src.account import Account, AccountRegistry, CompanyAccount
+from src.batch import BatchTransferEngine
+from src import persistence
+from src.persistence import PersistenceEngine, SNAPSHOT_MAGIC
+
+
+def open_engine(directory, **kwargs):
+    registry = AccountRegistry()
+    engine = PersistenceEngine(str(directory), **kwargs).open(registry)
+    return registry, engine
+
+
+def crash(engine):
+    # the process dies: whatever was flushed survives, the rest of the buffer is lost
+    engine._stop.set()
+    engine._snapshot_due.set()
+    if engine._flusher is not None:
+        engine._flusher.join()
+        engine._snapshotter.join()
+    engine.registry.unsubscribe(engine)
+    engine._wal._file.close()
+
+
+def state(registry):
+    return sorted(
+        (registry.key(a), getattr(a, "first_name", None), getattr(a, "last_name", None), a.balance,
+         a.history.offset, a.history.tolist())
+        for a in registry.all_accounts()
+    )
+
+
+class TestPersistenceEngine:
+    def test_recovers_mutations_from_wal(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        account = Account("Jan", "Kowalski", "60010112345")
+        registry.add_account(account)
+        registry.add_account(Account("Anna", "Nowak", "60010112346"))
+        account.transferIn(100)
+        account.expressTransferOut(30)
+        account.first_name = "Janusz"
+        account.last_name = "Nowak"
+        registry.delete_account("60010112346")
+        expected = state(registry)
+        engine.wait()
+        crash(engine)
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert state(recovered) == expected
+        assert recovered.find_by_last_name("Nowak")[0].pesel == "60010112345"
+        assert recovered.find_by_pesel("60010112345").history.positive_run == 0
+        engine.close()
+
+    def test_cleared_name_survives_recovery(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        account = Account("Jan", "Kowalski", "60010112345")
+        registry.add_account(account)
+        account.first_name = None
+        engine.wait()
+        crash(engine)
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert recovered.find_by_pesel("60010112345").first_name is None
+        assert recovered.find_by_last_name("Kowalski")[0].pesel == "60010112345"
+        engine.close()
+
+    def test_unflushed_tail_is_lost_but_log_stays_usable(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=60)
+        account = Account("Jan", "Kowalski", "60010112345")
+        registry.add_account(account)
+        engine.flush()
+        account.transferIn(100)
+        crash(engine)
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert recovered.find_by_pesel("60010112345").balance == 0.0
+        recovered.find_by_pesel("60010112345").transferIn(5)
+        engine.wait()
+        crash(engine)
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert recovered.find_by_pesel("60010112345").balance == 5.0
+        engine.close()
+
+    def test_torn_record_is_truncated(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        registry.add_account(Account("Jan", "Kowalski", "60010112345"))
+        registry.find_by_pesel("60010112345").transferIn(100)
+        engine.wait()
+        crash(engine)
+
+        wal = tmp_path / "wal-00000001.log"
+        intact = wal.stat().st_size
+        with open(wal, "ab") as f:
+            f.write(b"\x40\x00\x00\x00garbage")
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert recovered.find_by_pesel("60010112345").balance == 100.0
+        assert wal.stat().st_size == intact
+        engine.close()
+
+    def test_corrupt_record_stops_replay(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        registry.add_account(Account("Jan", "Kowalski", "60010112345"))
+        registry.find_by_pesel("60010112345").transferIn(100)
+        engine.wait()
+        crash(engine)
+
+        wal = tmp_path / "wal-00000001.log"
+        data = bytearray(wal.read_bytes())
+        data[-1] ^= 0xFF    # flips a bit in the last record, the TRANSFERS entry
+        wal.write_bytes(bytes(data))
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        account = recovered.find_by_pesel("60010112345")
+        assert account.balance == 100.0
+        assert account.history == []
+        engine.close()
+
+    def test_snapshot_plus_wal_tail(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        for i in range(25):
+            registry.add_account(Account("Jan", "Kowalski", f"600101123{i:02d}"))
+        registry.find_by_pesel("60010112300").transferIn(10)
+        engine.PAGE = 10
+        engine.snapshot()
+        registry.find_by_pesel("60010112300").transferIn(5)
+        engine.snapshot()
+        registry.find_by_pesel("60010112300").transferIn(20)
+        registry.delete_account("60010112324")
+        expected = state(registry)
+        engine.wait()
+        crash(engine)
+
+        assert sorted(os.listdir(tmp_path)) == ["snapshot-00000003.bin", "wal-00000003.log"]
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert state(recovered) == expected
+        engine.close()
+
+    def test_wal_replay_over_fuzzy_snapshot_is_idempotent(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        account = Account("Jan", "Kowalski", "60010112345")
+        registry.add_account(account)
+        engine._wal.switch(engine._path("wal", 2))
+        engine._segment = 2
+        account.transferIn(10)
+        account.transferIn(20)
+        engine.snapshot()   # snapshot 3 already holds both transfers
+        engine.wait()
+        crash(engine)
+        os.rename(tmp_path / "snapshot-00000003.bin", tmp_path / "snapshot-00000002.bin")
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert recovered.find_by_pesel("60010112345").history == [10.0, 20.0]
+        assert recovered.find_by_pesel("60010112345").balance == 30.0
+        engine.close()
+
+    def test_batch_transfers_and_history_replacement(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        account = Account("Jan", "Kowalski", "60010112345")
+        registry.add_account(account)
+        BatchTransferEngine(registry).apply([("60010112345", "incoming", 50.0), ("60010112345", "express", 20.0)])
+        other = Account("Anna", "Nowak", "60010112346")
+        registry.add_account(other)
+        other.history = [1, 2, 3]
+        expected = state(registry)
+        engine.wait()
+        crash(engine)
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert state(recovered) == expected
+        engine.close()
+
+    def test_clear_and_company_accounts(self, tmp_path, mocker):
+        mock_get = mocker.patch('src.account.nip_verifier.session.get')
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {"result": {"subject": {"statusVat": "Czynny"}}}
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        registry.add_account(Account("Jan", "Kowalski", "60010112345"))
+        registry.clear()
+        company = CompanyAccount("XYZ", "1234567890")
+        registry.add_account(company)
+        company.transferIn(70)
+        engine.wait()
+        crash(engine)
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert recovered.account_count() == 1
+        restored = recovered.find_by_nip("1234567890")
+        assert restored.company_name == "XYZ"
+        assert restored.balance == 70.0
+        engine.close()
+
+    def test_background_flusher_and_automatic_snapshot(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=0.01, snapshot_every=5)
+        for i in range(10):
+            registry.add_account(Account("Jan", "Kowalski", f"600101123{i:02d}"))
+        deadline = time.monotonic() + 5
+        while not any(name.startswith("snapshot-") for name in os.listdir(tmp_path)) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        engine.close()
+
+        assert any(name.startswith("snapshot-") for name in os.listdir(tmp_path))
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert recovered.account_count() == 10
+        engine.close()
+
+    def test_recovered_transfers_go_to_the_next_mongo_save(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        account = Account("Jan", "Kowalski", "60010112345")
+        registry.add_account(account)
+        account.transferIn(100)
+        engine.snapshot()
+        account.transferIn(50)
+        account.expressTransferOut(20)
+        logged = registry.unsaved_transfers(account)
+        engine.wait()
+        crash(engine)
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        journal = sorted(recovered.take_journal(), key=lambda entry: entry[1])
+        assert [(seq, amount, kind) for _, seq, amount, kind, _ in journal] == [
+            (0, 100.0, "incoming"), (1, 50.0, "incoming"), (2, -20.0, "express"), (3, -1.0, "fee"),
+        ]
+        assert journal[0][4] is None    # only in the snapshot: rebuilt from the history
+        assert all(abs(entry[4] - original["timestamp"]).total_seconds() < 1e-3
+                   for entry, original in zip(journal[1:], logged[1:]))
+        engine.close()
+
+    def test_fsync_runs_on_the_flusher_thread(self, tmp_path, monkeypatch):
+        threads = []
+        fsync = persistence.os.fsync
+        monkeypatch.setattr(persistence.os, "fsync", lambda fd: (threads.append(threading.current_thread().name), fsync(fd)))
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        account = Account("Jan", "Kowalski", "60010112345")
+        registry.add_account(account)
+        account.transferIn(100)
+        engine.wait()
+
+        assert threads and set(threads) == {"wal-flusher"}
+        engine.close()
+
+    def test_wait_blocks_until_a_flush_covers_the_record(self, tmp_path):
+        registry, engine = open_engine(tmp_path, sync_interval=60)
+        registry.add_account(Account("Jan", "Kowalski", "60010112345"))
+        waiter = threading.Thread(target=engine.wait)
+        waiter.start()
+        waiter.join(0.05)
+        assert waiter.is_alive()
+
+        engine.flush()
+        waiter.join(5)
+        assert not waiter.is_alive()
+        engine.wait()   # nothing new logged: returns at once
+        engine.close()
+
+    def test_failed_flush_is_not_acknowledged(self, tmp_path, monkeypatch):
+        registry, engine = open_engine(tmp_path, sync_interval=60)
+        registry.add_account(Account("Jan", "Kowalski", "60010112345"))
+        monkeypatch.setattr(persistence.os, "fsync", lambda fd: (_ for _ in ()).throw(OSError("disk full")))
+
+        with pytest.raises(OSError):
+            engine.flush()
+        with pytest.raises(OSError):
+            engine.wait()
+        with pytest.raises(OSError):
+            engine.close()
+        assert engine._wal._file.closed
+
+    def test_dead_flusher_fails_waiters(self, tmp_path, monkeypatch):
+        registry, engine = open_engine(tmp_path, sync_interval=0)
+        monkeypatch.setattr(engine._wal, "flush", lambda: (_ for _ in ()).throw(RuntimeError("bug")))
+        registry.add_account(Account("Jan", "Kowalski", "60010112345"))
+
+        with pytest.raises(OSError):
+            engine.wait()
+        engine._flusher.join(5)
+        assert not engine._flusher.is_alive()
+        with pytest.raises(OSError):
+            engine.close()
+
+    def test_writes_are_acknowledged_while_a_snapshot_is_written(self, tmp_path, monkeypatch):
+        registry, engine = open_engine(tmp_path, sync_interval=0, snapshot_every=1)
+        started, release = threading.Event(), threading.Event()
+        page = registry.page
+        monkeypatch.setattr(registry, "page", lambda *args: (started.set(), release.wait(5), page(*args))[2])
+        account = Account("Jan", "Kowalski", "60010112345")
+        registry.add_account(account)
+        assert started.wait(5)
+
+        account.transferIn(100)
+        engine.wait()
+        assert engine._snapshotter.is_alive() and not release.is_set()
+        release.set()
+        engine.close()
+
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert recovered.find_by_pesel("60010112345").balance == 100.0
+        engine.close()
+
+    def test_failed_snapshot_keeps_the_wal(self, tmp_path, monkeypatch):
+        registry, engine = open_engine(tmp_path, sync_interval=0, snapshot_every=1)
+        failed = threading.Event()
+        monkeypatch.setattr(persistence.os, "replace",
+                            lambda *args: (failed.set(), (_ for _ in ()).throw(OSError("disk full")))[1])
+        account = Account("Jan", "Kowalski", "60010112345")
+        registry.add_account(account)
+        assert failed.wait(5)
+        monkeypatch.undo()
+
+        account.transferIn(100)
+        engine.wait()
+        engine.close()
+        recovered, engine = open_engine(tmp_path, sync_interval=0)
+        assert recovered.find_by_pesel("60010112345").balance == 100.0
+        engine.close()
+
+    def test_rejects_foreign_snapshot(self, tmp_path):
+        (tmp_path / "snapshot-00000002.bin").write_bytes(b"not a snapshot")
+        with pytest.raises(ValueError):
+            open_engine(tmp_path)
+        assert SNAPSHOT_MAGIC not in (tmp_path / "snapshot-00000002.bin").read_bytes()
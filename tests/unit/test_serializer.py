@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from src.account import Account, AccountRegistry, CompanyAccount
+from src.serializer import Serializer, account_data
+
+
+@pytest.fixture(params=["orjson", "json"])
+def serializer(request):
+    return Serializer(request.param)
+
+
+def person(pesel="89092909825", balance=0.0):
+    return Account.restore("Jan", "Kowalski", pesel, balance, [])
+
+
+class TestSerializer:
+    def test_backends_agree(self, serializer):
+        data = {"message": "Zażółć", "count": 3, "cursor": None, "balance": 1.5}
+        assert json.loads(serializer.dumps(data)) == data
+
+    def test_default_backend(self, monkeypatch):
+        monkeypatch.delenv("BANK_APP_JSON", raising=False)
+        assert Serializer().backend == "orjson"
+        monkeypatch.setenv("BANK_APP_JSON", "json")
+        assert Serializer().backend == "json"
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            Serializer("yaml")
+
+    def test_account_fragment(self, serializer):
+        account = person(balance=10.0)
+        company = CompanyAccount.restore("Firma", "8461627563", 5.0, [])
+        assert json.loads(serializer.account(account)) == account_data(account) == {
+            "first_name": "Jan", "last_name": "Kowalski", "pesel": "89092909825", "balance": 10.0,
+        }
+        assert json.loads(serializer.account(company)) == {"company_name": "Firma", "nip_number": "8461627563", "balance": 5.0}
+
+    def test_listings(self, serializer):
+        accounts = [person(f"8909290982{i}", float(i)) for i in range(3)]
+        assert [a["balance"] for a in json.loads(serializer.accounts(accounts))] == [0.0, 1.0, 2.0]
+        assert serializer.accounts([]) == b"[]"
+        lines = list(serializer.ndjson(accounts))
+        assert [json.loads(line)["pesel"] for line in lines] == ["89092909820", "89092909821", "89092909822"]
+        assert all(line.endswith(b"\n") for line in lines)
+
+
+class TestFragmentCache:
+    def test_encoded_once(self, serializer):
+        account = person()
+        assert serializer.account(account) is serializer.account(account)
+
+    def test_unregistered_changes_invalidate(self, serializer):
+        account = person()
+        for change in (lambda: setattr(account, "balance", 7.0), lambda: setattr(account, "first_name", "Anna"),
+                       lambda: setattr(account, "last_name", "Nowak")):
+            fragment = serializer.account(account)
+            change()
+            assert serializer.account(account) != fragment
+        assert json.loads(serializer.account(account)) == {
+            "first_name": "Anna", "last_name": "Nowak", "pesel": "89092909825", "balance": 7.0,
+        }
+
+    def test_registered_changes_invalidate(self, serializer):
+        registry = AccountRegistry()
+        account = person()
+        registry.add_account(account)
+        serializer.account(account)
+        account.transferIn(100)
+        assert json.loads(serializer.account(account))["balance"] == 100.0
+        account.last_name = "Nowak"
+        assert json.loads(serializer.account(account))["last_name"] == "Nowak"
+
+    def test_bulk_balance_updates_invalidate(self, serializer):
+        registry = AccountRegistry()
+        accounts = [person(f"890929{i:05d}") for i in range(100)]
+        registry.add_accounts(accounts)
+        serializer.accounts(accounts)
+        registry.set_balances((account, 3.0) for account in accounts)     # the index-rebuild path
+        assert {a["balance"] for a in json.loads(serializer.accounts(accounts))} == {3.0}
+
+    def test_change_during_encoding_is_not_cached(self):
+        account = person()
+        serializer = Serializer("json")
+        dumps = serializer.dumps
+
+        def racing_dumps(data):     # another thread's transfer lands between the snapshot and the store
+            account.balance = 99.0
+            return dumps(data)
+
+        serializer.dumps = racing_dumps
+        assert json.loads(serializer.account(account))["balance"] == 0.0
+        serializer.dumps = dumps
+        assert json.loads(serializer.account(account))["balance"] == 99.0
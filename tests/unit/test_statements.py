@@ -0,0 +1,146 @@
+import csv
+import io
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import Mock
+
+from src import statements
+from src.account import Account, AccountRegistry, CompanyAccount
+from src.statements import Statement, history_entries
+
+
+def log_entry(seq, amount, kind, day):
+    return {"seq": seq, "amount": amount, "type": kind, "timestamp": datetime(2026, 1, day, 12)}
+
+
+LOG = [
+    log_entry(0, 100.0, "incoming", 1),
+    log_entry(1, -30.0, "outgoing", 2),
+    log_entry(2, -1.0, "express_fee", 2),
+    log_entry(3, 50.0, "incoming", 3),
+    log_entry(4, -20.0, "outgoing", 4),
+]
+
+
+class TestHistoryEntries:
+    def test_amounts_become_entries(self):
+        account = Account.restore("Jan", "Kowalski", "60010112345", 0.0, [100.0, -30.0])
+        assert list(history_entries(account.history)) == [
+            {"seq": 0, "amount": 100.0, "type": "incoming", "timestamp": None},
+            {"seq": 1, "amount": -30.0, "type": "outgoing", "timestamp": None},
+        ]
+
+    def test_chunks_keep_the_sequence(self, monkeypatch):
+        monkeypatch.setattr(statements, "CHUNK", 2)
+        account = Account.restore("Jan", "Kowalski", "60010112345", 0.0, [float(i + 1) for i in range(5)])
+        assert [entry["seq"] for entry in history_entries(account.history)] == [0, 1, 2, 3, 4]
+
+
+class TestStatement:
+    def test_summary(self):
+        summary = Statement(iter(LOG)).summarize()
+        assert (summary.count, summary.credits, summary.debits, summary.net) == (5, 150.0, -51.0, 99.0)
+        assert summary.by_type == {"incoming": [2, 150.0], "outgoing": [2, -50.0], "express_fee": [1, -1.0]}
+        assert (summary.first_seq, summary.last_seq) == (0, 4)
+        assert summary.lines() == [
+            "Transfers: 5", "Credits: 150.00", "Debits: -51.00", "Net: 99.00",
+            "  express_fee: 1 totalling -1.00", "  incoming: 2 totalling 150.00", "  outgoing: 2 totalling -50.00",
+        ]
+
+    def test_window_is_half_open(self):
+        statement = Statement(iter(LOG), date(2026, 1, 2), datetime(2026, 1, 4, tzinfo=timezone.utc))
+        assert [entry["seq"] for entry in statement.entries()] == [1, 2, 3]
+        assert statement.summary.count == 3
+
+    def test_window_with_only_one_bound_skips_undated_entries(self):
+        entries = [*LOG, {"seq": 5, "amount": 1.0, "type": "incoming", "timestamp": None}]
+        assert [entry["seq"] for entry in Statement(iter(entries), end=date(2026, 1, 2)).entries()] == [0]
+        assert [entry["seq"] for entry in Statement(iter(entries), start=date(2026, 1, 4)).entries()] == [4]
+
+    def test_text_chunks(self):
+        chunks = list(Statement(iter(LOG)).text_chunks(chunk=2))
+        assert len(chunks) == 4      # 2 + 2 + 1 entries, then the summary
+        assert chunks[0].splitlines()[0].split() == ["0", "2026-01-01T12:00:00+00:00", "incoming", "100.00"]
+        assert chunks[-1].endswith("Net: 99.00\n  express_fee: 1 totalling -1.00\n  incoming: 2 totalling 150.00\n"
+                                   "  outgoing: 2 totalling -50.00\n")
+
+    def test_csv_chunks(self):
+        statement = Statement(iter(LOG))
+        chunks = list(statement.csv_chunks(chunk=2))
+        assert len(chunks) == 3
+        rows = list(csv.reader(io.StringIO("".join(chunks))))
+        assert rows[0] == ["seq", "timestamp", "type", "amount"]
+        assert rows[1] == ["0", "2026-01-01T12:00:00+00:00", "incoming", "100.0"]
+        assert len(rows) == 6
+        assert statement.summary.count == 5
+
+    def test_empty_csv_is_just_the_header(self):
+        assert list(Statement(iter([])).csv_chunks()) == ["seq,timestamp,type,amount\r\n"]
+
+    def test_csv_file_spills_to_disk(self, monkeypatch):
+        monkeypatch.setattr(statements, "SPOOL_SIZE", 64)
+        account = Account.restore("Jan", "Kowalski", "60010112345", 0.0, [1.0] * 100)
+        with account.statement().csv_file() as file:
+            assert file._rolled
+            assert file.read().decode().count("incoming") == 100
+        with Statement(iter([])).csv_file() as file:
+            assert not file._rolled
+            assert file.read() == b"seq,timestamp,type,amount\r\n"
+
+
+class TestAccountStatement:
+    def registered(self):
+        registry = AccountRegistry()
+        account = Account("Jan", "Kowalski", "60010112345")
+        registry.add_account(account)
+        return registry, account
+
+    def test_unsaved_transfers_keep_their_type_and_time(self):
+        registry, account = self.registered()
+        account.transferIn(100)
+        account.expressTransferOut(30)
+        entries = list(account.statement().entries())
+        assert [entry["type"] for entry in entries] == ["incoming", "express", "fee"]
+        assert all(entry["timestamp"] is not None for entry in entries)
+
+        registry.take_journal()     # saved: the in-memory history only has the amounts
+        assert [entry["type"] for entry in account.statement().entries()] == ["incoming", "outgoing", "outgoing"]
+
+    def test_window_merges_the_log_and_the_journal(self):
+        registry, account = self.registered()
+        account.transferIn(100)
+        account.transferOut(30)
+        registry.take_journal()
+        account.transferIn(5)
+        now = datetime.now(timezone.utc)
+        registry.transaction_log = Mock()
+        registry.transaction_log.iter_history.return_value = [
+            {"seq": 0, "amount": 100.0, "type": "incoming", "timestamp": now},
+            {"seq": 1, "amount": -30.0, "type": "outgoing", "timestamp": now},
+        ]
+
+        statement = account.statement(now - timedelta(days=1), now + timedelta(days=1))
+        assert [(entry["seq"], entry["type"]) for entry in statement.entries()] == [(0, "incoming"), (1, "outgoing"), (2, "incoming")]
+        registry.transaction_log.iter_history.assert_called_once_with(
+            "60010112345", start=now - timedelta(days=1), end=now + timedelta(days=1))
+
+    def test_window_without_a_log_covers_the_journal(self):
+        registry, account = self.registered()
+        account.transferIn(100)
+        assert [entry["seq"] for entry in account.statement(start=date(2000, 1, 1)).entries()] == [0]
+        assert list(account.statement(end=date(2000, 1, 1)).entries()) == []
+
+
+class TestHistoryEmail:
+    def test_body_is_the_summary(self):
+        account = Account.restore("Jan", "Kowalski", "60010112345", 0.0, [100.0, -30.0, 5.0])
+        subject, text = account.history_email()
+        assert subject.startswith("Account Transfer History ")
+        assert text.splitlines()[:5] == ["Personal account history", "Transfers: 3", "Credits: 105.00", "Debits: -30.00", "Net: 75.00"]
+
+    def test_company_body_size_does_not_grow_with_history(self):
+        company = CompanyAccount("Firma", "123")     # an invalid NIP is never looked up
+        _, short = company.history_email()
+        company.history.extend([1.0] * 10000)
+        _, long = company.history_email()
+        assert long.startswith("Company account history\nTransfers: 10000\n")
+        assert len(long) < len(short) + 100